@@ -0,0 +1,158 @@
+import hashlib
+from typing import Callable, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+
+from hashed_file import SKETCH_COLUMNS, HashedTable
+from vectorized_join import Entries, capped_product_join
+
+# A personal info sketch is a MinHash signature of the character bigrams of the personal info components.
+# Every value of the signature is one byte (b-bit MinHash), so a sketch of a file with d-byte digests has
+# len(SKETCH_COLUMNS) * d values, stored d per sketch column. Bigrams are hashed with the digest of the
+# file, keyed or not, then every signature value is the minimum of a fixed multiply-add permutation of
+# those hashes, mixed down to its top byte.
+MAX_SKETCH_SIZE = len(SKETCH_COLUMNS) * 64
+_PERMUTATIONS = np.frombuffer(
+    b"".join(
+        hashlib.blake2b(f"minhash:{value}".encode("utf-8"), digest_size=16).digest() for value in range(MAX_SKETCH_SIZE)
+    ),
+    dtype="<u8",
+).reshape(MAX_SKETCH_SIZE, 2)
+MULTIPLIERS = _PERMUTATIONS[:, 0] | np.uint64(1)
+OFFSETS = _PERMUTATIONS[:, 1].copy()
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_BYTE_SHIFT = np.uint64(56)
+# Two one-byte values of different minimums are equal by chance once in 256
+_CHANCE_AGREEMENT = 1 / 256
+
+DEFAULT_BAND_SIZE = 4
+# A band value shared by more row pairs than this across the datasets, like a common city and surname, is
+# too unspecific to block on; such pairs remain candidates through their other bands
+DEFAULT_MAX_BUCKET_PAIRS = 10000
+
+
+def sketch_tokens(components: Sequence[str]) -> List[bytes]:
+    """
+    Return the distinct tokens of the personal info components: the bigrams of every component, lower-cased
+    with single spaces and padded with ^ and $, tagged with the position of the component so the same
+    letters in the city and the surname are different tokens.
+    """
+    tokens: Set[bytes] = set()
+    for number, component in enumerate(components):
+        text = " ".join(component.lower().split())
+        if text:
+            padded = f"^{text}$"
+            tokens.update(f"{number}:{padded[i : i + 2]}".encode("utf-8") for i in range(len(padded) - 1))
+    return list(tokens)
+
+
+def personal_info_sketch(components: Sequence[str], digest: Callable[[bytes], bytes], size: int) -> bytes:
+    """
+    Return the MinHash sketch of the personal info components, or b"" if they are all blank.
+
+    Args:
+        components: The normalized city, state, surname and first initial
+        digest: The digest function of the hashed file; its first 8 bytes hash every token
+        size: Number of one-byte values of the sketch
+    """
+    tokens = sketch_tokens(components)
+    if not tokens:
+        return b""
+    hashes = np.frombuffer(b"".join(digest(token)[:8] for token in tokens), dtype="<u8")
+    minimums = (hashes[:, None] * MULTIPLIERS[:size] + OFFSETS[:size]).min(axis=0)
+    return ((minimums * _MIX) >> _BYTE_SHIFT).astype(np.uint8).tobytes()
+
+
+def sketch_signatures(hashes: HashedTable) -> np.ndarray:
+    """
+    Read the personal info sketches of a dataset as a (rows, sketch size) array of bytes; rows without a
+    sketch are all zeros.
+
+    Raises:
+        ValueError: If the dataset has no sketch columns.
+    """
+    found: List[Optional[int]] = [hashes.column_index(name) for name in SKETCH_COLUMNS]
+    columns = [column for column in found if column is not None]
+    if len(columns) < len(SKETCH_COLUMNS):
+        raise ValueError("Hashed dataset has no personal info sketch columns; hash it with --personal-info-sketches")
+    records = np.frombuffer(
+        hashes.buffer, dtype=np.uint8, count=len(hashes) * hashes.record_size, offset=hashes.records_offset
+    ).reshape(len(hashes), hashes.record_size)
+    size = hashes.digest_size
+    return np.concatenate([records[:, column * size : (column + 1) * size] for column in columns], axis=1)
+
+
+def _band_entries(signatures: np.ndarray, rows: np.ndarray, start: int, band_size: int) -> Entries:
+    """Return the values of one band of the signatures of some rows as join entries, positioned by row id."""
+    band = np.ascontiguousarray(signatures[rows, start : start + band_size])
+    padded = np.zeros((len(rows), 8), dtype=np.uint8)
+    padded[:, :band_size] = band
+    return Entries(padded.view(">u8").ravel().astype(np.uint64), band.view(f"V{band_size}").ravel(), rows, 1)
+
+
+class ApproximatePairs(NamedTuple):
+    """Row pairs with similar personal info sketches, ordered by row of the first and then the second dataset."""
+
+    rows1: np.ndarray
+    rows2: np.ndarray
+    similarities: np.ndarray
+
+
+def estimate_similarity(signatures1: np.ndarray, signatures2: np.ndarray) -> np.ndarray:
+    """Estimate the Jaccard similarity of the token sets of pairs of sketches from their share of equal values."""
+    agreement = (signatures1 == signatures2).mean(axis=1)
+    return np.clip((agreement - _CHANCE_AGREEMENT) / (1 - _CHANCE_AGREEMENT), 0.0, 1.0)
+
+
+def approximate_join(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    min_similarity: float,
+    band_size: int = DEFAULT_BAND_SIZE,
+    max_bucket_pairs: int = DEFAULT_MAX_BUCKET_PAIRS,
+    score_chunk: int = 1 << 20,
+) -> ApproximatePairs:
+    """
+    Find the row pairs whose personal info sketches have at least a minimum estimated similarity.
+
+    Candidates are blocked with LSH banding: the sketches are cut into bands of band_size values, and only
+    rows that agree on all values of at least one band are compared, found with a sort-based join per band.
+    Pairs with a Jaccard similarity s are candidates with probability 1 - (1 - s^band_size)^bands, so
+    similar pairs are found with high probability while the candidates grow close to linearly with the
+    datasets. Candidates are then scored on their full sketches.
+
+    Args:
+        hashes1: First dataset, with sketch columns
+        hashes2: Second dataset, with sketch columns and the same digest size
+        min_similarity: Lowest estimated similarity reported
+        band_size: Number of sketch values per band, 1 to 8; smaller bands find less similar pairs and
+            produce more candidates
+        max_bucket_pairs: Band values that would pair more rows than this are not blocked on
+        score_chunk: Number of candidates scored at a time
+
+    Raises:
+        ValueError: If a dataset has no sketch columns, or the band size is out of range.
+    """
+    if not 1 <= band_size <= 8:
+        raise ValueError(f"The sketch band size must be 1 to 8, got {band_size}")
+    signatures1, signatures2 = sketch_signatures(hashes1), sketch_signatures(hashes2)
+    rows1, rows2 = np.flatnonzero(signatures1.any(axis=1)), np.flatnonzero(signatures2.any(axis=1))
+    size = signatures1.shape[1]
+    candidates = [np.empty(0, dtype=np.int64)]
+    for start in range(0, size - band_size + 1, band_size):
+        entries1 = _band_entries(signatures1, rows1, start, band_size)
+        entries2 = _band_entries(signatures2, rows2, start, band_size)
+        pairs, _ = capped_product_join(entries1, entries2, max_bucket_pairs)
+        candidates.append(pairs.positions1 * len(hashes2) + pairs.positions2)
+    # Sorted and distinct, so pairs come out ordered by row of the first and then the second dataset
+    pair_keys = np.unique(np.concatenate(candidates))
+
+    kept = []
+    for start in range(0, len(pair_keys), score_chunk):
+        candidate_rows1, candidate_rows2 = np.divmod(pair_keys[start : start + score_chunk], len(hashes2))
+        similarities = estimate_similarity(signatures1[candidate_rows1], signatures2[candidate_rows2])
+        similar = similarities >= min_similarity
+        kept.append((candidate_rows1[similar], candidate_rows2[similar], similarities[similar]))
+    if not kept:
+        return ApproximatePairs(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    return ApproximatePairs(*(np.concatenate(arrays) for arrays in zip(*kept)))
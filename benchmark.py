@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import hash_datasets
+from digest_algorithms import MAX_DIGEST_SIZES, Digester
+from generate_data import GeneratorOptions, generate_datasets
+from match_hashes import ENGINES
+from tests.test_normalize_address import generate_address_corpus, legacy_normalize_address
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(function: Callable[[str], Any], values: List[str]) -> float:
+    """Return the number of values per second function processes over values."""
+    start = time.perf_counter()
+    for value in values:
+        function(value)
+    return len(values) / (time.perf_counter() - start)
+
+
+def benchmark_address(count: int, seed: int) -> None:
+    """Compare the throughput of normalize_address with the legacy implementation."""
+    corpus = generate_address_corpus(count, seed)
+    compiled = hash_datasets.normalize_address.__wrapped__
+
+    hash_datasets.normalize_address.cache_clear()
+    print(f"Legacy regex loop:       {measure(legacy_normalize_address, corpus):12,.0f} values/s")
+    print(f"Compiled single pass:    {measure(compiled, corpus):12,.0f} values/s")
+    print(f"Compiled with memoizing: {measure(hash_datasets.normalize_address, corpus):12,.0f} values/s")
+
+
+def generate_phone_corpus(count: int, seed: int) -> List[str]:
+    """
+    Generate phone-like strings around the shapes the NANP fast path accepts.
+
+    The corpus starts with a number of every area code and first digit of an exchange in a common shape,
+    so the fast path validity table is checked entirely. The other values are common shapes half of the
+    time, and otherwise combine area codes and exchanges (valid or not) with leading 1, +1 and 001
+    prefixes, parentheses (sometimes unbalanced), separators the fast path accepts or not, extensions in
+    several spellings and a digit too many or too few.
+    """
+    rng = random.Random(seed)
+    common_prefixes = ["", "1", "1-", "1 ", "+1", "+1-", "+1 ", "+1."]
+    prefixes = common_prefixes + ["001-", "+ 1 ", "11", "+2", "1--", "(1)"]
+    common_separators = ["", "-", " ", "."]
+    separators = common_separators + ["  ", "/", "--", " - "]
+    common_extensions = ["", "", "", "x53", "x053", " x97202", "X12", "ext.5", " ext. 1234", " ext 12", " EXT 7"]
+    extensions = common_extensions + ["x", " x 12", "x1234567", " #12", ";ext=12", " extension 9", "x12a"]
+
+    def common_shape(area_code: str, exchange: str, line: str) -> str:
+        area = rng.choice([area_code, f"({area_code})"])
+        sep_1, sep_2 = rng.choice(common_separators), rng.choice(common_separators)
+        return f"{rng.choice(common_prefixes)}{area}{sep_1}{exchange}{sep_2}{line}{rng.choice(common_extensions)}"
+
+    corpus = [
+        common_shape(str(area_code), f"{digit}{rng.randint(0, 99):02d}", f"{rng.randint(0, 9999):04d}")
+        for area_code in range(200, 1000)
+        for digit in range(10)
+    ]
+    for _ in range(count):
+        area_code = f"{rng.randint(0, 999):03d}" if rng.random() < 0.1 else str(rng.randint(200, 999))
+        exchange = f"{rng.randint(0, 999):03d}"
+        line = f"{rng.randint(0, 9999):04d}"
+        if rng.random() < 0.5:
+            corpus.append(common_shape(area_code, exchange, line))
+            continue
+        if rng.random() < 0.05:
+            line = line[: rng.randint(1, 3)] if rng.random() < 0.5 else line + str(rng.randint(0, 9))
+        area = rng.choice([area_code, f"({area_code})", f"({area_code}", f"{area_code})"])
+        sep_1, sep_2, sep_3 = rng.choice(separators), rng.choice(separators), rng.choice(separators)
+        value = f"{rng.choice(prefixes)}{sep_1}{area}{sep_2}{exchange}{sep_3}{line}{rng.choice(extensions)}"
+        corpus.append(value)
+    return corpus
+
+
+def benchmark_phone(count: int, seed: int) -> None:
+    """Compare the throughput of the phone standardization with and without the NANP fast path."""
+    corpus = generate_phone_corpus(count, seed)
+    libphonenumber = hash_datasets.parse_phone_number_with_libphonenumber
+    valid = [value for value in corpus if hash_datasets.parse_nanp_number(value) is not None]
+    print(f"On the {len(valid)} values the fast path accepts:")
+    print(f"  libphonenumber:        {measure(libphonenumber, valid):12,.0f} values/s")
+    print(f"  NANP fast path:        {measure(hash_datasets.parse_phone_number, valid):12,.0f} values/s")
+    print(f"On all {len(corpus)} values:")
+    print(f"  libphonenumber:        {measure(libphonenumber, corpus):12,.0f} values/s")
+    print(f"  fast path + fallback:  {measure(hash_datasets.parse_phone_number, corpus):12,.0f} values/s")
+
+
+def generate_digest_corpus(count: int, seed: int) -> List[str]:
+    """
+    Generate values shaped like the normalized fields hash_entry digests: E.164 phone numbers, emails
+    and concatenated personal info, in equal parts.
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+
+    def word(low: int, high: int) -> str:
+        return "".join(rng.choice(letters) for _ in range(rng.randint(low, high)))
+
+    corpus = []
+    for index in range(count):
+        kind = index % 3
+        if kind == 0:
+            corpus.append(f"+1{rng.randint(200, 999)}{rng.randint(200, 999)}{rng.randint(0, 9999):04d}")
+        elif kind == 1:
+            corpus.append(f"{word(3, 10)}.{word(3, 10)}{rng.randint(0, 99)}@{word(4, 9)}.com")
+        else:
+            corpus.append(f"{word(4, 12)} {word(3, 8)}{word(2, 2)}{word(4, 12)}{word(1, 1)}")
+    return corpus
+
+
+def benchmark_digest(count: int, seed: int) -> None:
+    """Compare the throughput of the digest algorithms, sizes and keying of digest_algorithms.Digester."""
+    corpus = generate_digest_corpus(count, seed)
+    key = bytes(range(32))
+    print(f"{count} values, UTF-8 encoded and digested as in hash_entry:")
+    print(f"  {'algorithm':<10} {'bytes':>5}  {'keying':<12} {'values/s':>12}")
+    for algorithm in MAX_DIGEST_SIZES:
+        for digest_size in sorted({16, 32, MAX_DIGEST_SIZES[algorithm]}):
+            for keyed in (False, True):
+                digest = Digester(algorithm, digest_size, key if keyed else b"").digest
+                rate = measure(lambda value: digest(value.encode("utf-8")), corpus)
+                keying = ("hmac" if algorithm == "sha256" else "keyed") if keyed else "unkeyed"
+                print(f"  {algorithm:<10} {digest_size:>5}  {keying:<12} {rate:12,.0f}")
+
+
+def run_script(script: str, arguments: List[str], metrics_file: str) -> Dict[str, Any]:
+    """Run one of the scripts in a fresh process with --metrics-file and return its metrics."""
+    command = [sys.executable, os.path.join(SCRIPT_DIR, script), *arguments, "--metrics-file", metrics_file]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        print(result.stdout)
+        raise SystemExit(f"{script} failed with exit code {result.returncode}")
+    with open(metrics_file, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def benchmark_pipeline(
+    sizes: List[int],
+    overlap: float,
+    seed: int,
+    workers: int,
+    output_format: str,
+    engines: List[str],
+    work_dir: Optional[str],
+    results_file: Optional[str],
+) -> None:
+    """
+    Generate two datasets of every size, hash them with hash_datasets.py and match them with
+    match_hashes.py, and report the throughput and peak memory of every step.
+
+    Every step runs in its own process, so its peak memory is its own and not the peak of an earlier,
+    larger step.
+    """
+    results = []
+    print(f"{'rows':>10}  {'step':<16} {'seconds':>9} {'rows/s':>12} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory(prefix="benchmark_", dir=work_dir) as directory:
+        for size in sizes:
+            suffix = "bin" if output_format == "binary" else "csv"
+            inputs = [os.path.join(directory, f"dataset{side}_{size}.csv") for side in (1, 2)]
+            hashed = [os.path.join(directory, f"hashed{side}_{size}.{suffix}") for side in (1, 2)]
+            metrics_file = os.path.join(directory, "metrics.json")
+
+            start = time.perf_counter()
+            generate_datasets(inputs[0], inputs[1], size, overlap=overlap, options=GeneratorOptions(seed=seed))
+            steps: List[Tuple[str, int, float, Optional[Dict[str, Any]]]] = [
+                ("generate", 2 * size, time.perf_counter() - start, None)
+            ]
+            for side in (0, 1):
+                metrics = run_script(
+                    "hash_datasets.py",
+                    [
+                        "--input-file",
+                        inputs[side],
+                        "--output-file",
+                        hashed[side],
+                        "--output-format",
+                        output_format,
+                        "--workers",
+                        str(workers),
+                    ],
+                    metrics_file,
+                )
+                steps.append((f"hash {side + 1}", metrics["rows"], metrics["wall_seconds"], metrics))
+            for engine in engines:
+                metrics = run_script(
+                    "match_hashes.py",
+                    [
+                        "--hashed-file-1",
+                        hashed[0],
+                        "--hashed-file-2",
+                        hashed[1],
+                        "--output-file",
+                        os.path.join(directory, f"matches_{size}.csv"),
+                        "--engine",
+                        engine,
+                    ],
+                    metrics_file,
+                )
+                steps.append((f"match ({engine})", metrics["rows"], metrics["wall_seconds"], metrics))
+
+            for step, rows, seconds, step_metrics in steps:
+                peak = (
+                    max(step_metrics["peak_rss_bytes"], step_metrics["children_peak_rss_bytes"])
+                    if step_metrics
+                    else None
+                )
+                results.append(
+                    {
+                        "size": size,
+                        "step": step,
+                        "rows": rows,
+                        "wall_seconds": seconds,
+                        "rows_per_second": rows / seconds if seconds else None,
+                        "peak_rss_bytes": peak,
+                        "stages": step_metrics["stages"] if step_metrics else None,
+                    }
+                )
+                peak_text = f"{peak / (1 << 20):9.1f}" if peak else f"{'-':>9}"
+                print(f"{size:>10}  {step:<16} {seconds:9.2f} {rows / seconds:12,.0f} {peak_text}")
+            for file_path in inputs + hashed:
+                os.remove(file_path)
+
+    if results_file:
+        with open(results_file, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"Results written to {results_file}")
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Benchmarks for the hashing and matching scripts.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    address_parser = subparsers.add_parser(
+        "address", help="Microbenchmark of normalize_address against the legacy implementation"
+    )
+    address_parser.add_argument("--values", type=int, default=200000, help="Number of generated address values")
+    address_parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated values")
+
+    phone_parser = subparsers.add_parser("phone", help="Microbenchmark of the NANP fast path against libphonenumber")
+    phone_parser.add_argument("--values", type=int, default=200000, help="Number of generated phone values")
+    phone_parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated values")
+
+    digest_parser = subparsers.add_parser(
+        "digest", help="Microbenchmark of the digest algorithms, sizes and keying of hash_datasets.py"
+    )
+    digest_parser.add_argument("--values", type=int, default=300000, help="Number of generated values")
+    digest_parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated values")
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline",
+        help="Generate datasets of several sizes, hash and match them, and report throughput and peak memory",
+    )
+    pipeline_parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Rows of each generated dataset (default: 10000 100000 1000000)",
+    )
+    pipeline_parser.add_argument(
+        "--overlap", type=float, default=0.3, help="Fraction of the second dataset shared with the first"
+    )
+    pipeline_parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated datasets")
+    pipeline_parser.add_argument("--workers", type=int, default=1, help="Number of hash_datasets.py workers")
+    pipeline_parser.add_argument(
+        "--output-format", choices=("csv", "binary"), default="csv", help="Format of the hashed files"
+    )
+    pipeline_parser.add_argument(
+        "--engines", choices=ENGINES, nargs="+", default=["python"], help="match_hashes.py join engines to run"
+    )
+    pipeline_parser.add_argument(
+        "--work-dir", type=str, help="Directory for the generated files (default: the system temporary directory)"
+    )
+    pipeline_parser.add_argument("--results-file", type=str, help="Write the results as JSON to this file")
+
+    args = parser.parse_args()
+    if args.benchmark == "address":
+        benchmark_address(args.values, args.seed)
+    elif args.benchmark == "phone":
+        benchmark_phone(args.values, args.seed)
+    elif args.benchmark == "digest":
+        benchmark_digest(args.values, args.seed)
+    elif args.benchmark == "pipeline":
+        benchmark_pipeline(
+            args.sizes,
+            args.overlap,
+            args.seed,
+            args.workers,
+            args.output_format,
+            args.engines,
+            args.work_dir,
+            args.results_file,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import gzip
+import io
+from typing import IO, Optional, cast
+
+try:
+    import zstandard
+except ImportError:  # zstandard is only needed for .zst files
+    zstandard = None  # type: ignore[assignment]
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+# Levels trading a little size for much faster writing than the library defaults, as the CLIs do
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_of(file_path: str, mode: str = "r") -> Optional[str]:
+    """
+    Return the compression of a file: "gzip", "zstd" or None.
+
+    Files to read are recognized by their first bytes, so compressed files are read whatever their name;
+    files to write are compressed according to their suffix (.gz or .zst).
+    """
+    if "r" in mode:
+        with open(file_path, "rb") as file:
+            magic = file.read(4)
+        if magic.startswith(GZIP_MAGIC):
+            return "gzip"
+        if magic.startswith(ZSTD_MAGIC):
+            return "zstd"
+        return None
+    return next((name for suffix, name in COMPRESSION_SUFFIXES.items() if file_path.endswith(suffix)), None)
+
+
+def open_text(file_path: str, mode: str = "r", encoding: str = "utf-8", offset: int = 0) -> IO[str]:
+    """
+    Open a text file for csv reading or writing, decompressing or compressing it on the fly.
+
+    Args:
+        file_path: Path to the file
+        mode: "r" or "w"
+        encoding: Text encoding of the (uncompressed) file
+        offset: Byte offset in the uncompressed file to start reading at; a compressed file is
+            decompressed up to there
+
+    Returns:
+        A text stream opened with newline="", as the csv module expects
+
+    Raises:
+        ValueError: If the file is zstd-compressed and the zstandard package is not installed.
+    """
+    compression = compression_of(file_path, mode)
+    if offset:
+        if "r" not in mode:
+            raise ValueError("An offset can only be given for reading")
+        binary: IO[bytes]
+        if compression == "gzip":
+            binary = cast(IO[bytes], gzip.open(file_path, "rb"))
+        elif compression == "zstd":
+            if zstandard is None:
+                raise ValueError(f"Reading {file_path} needs the zstandard package (pip install zstandard)")
+            binary = zstandard.open(file_path, "rb")
+        else:
+            binary = open(file_path, "rb")
+        binary.seek(offset)
+        return io.TextIOWrapper(binary, encoding=encoding, newline="")
+    if compression == "gzip":
+        # A text stream; the gzip stubs cannot tell text mode from a non-literal mode
+        return cast(IO[str], gzip.open(file_path, mode + "t", compresslevel=GZIP_LEVEL, encoding=encoding, newline=""))
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError(f"Reading or writing {file_path} needs the zstandard package (pip install zstandard)")
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if "w" in mode else None
+        return zstandard.open(file_path, mode + "t", cctx=cctx, encoding=encoding, newline="")
+    return open(file_path, mode, encoding=encoding, newline="")
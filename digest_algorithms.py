@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+from typing import Any, Callable, Dict
+
+from hashed_file import DEFAULT_ALGORITHM, DEFAULT_DIGEST_SIZE, DigestParameters
+
+# Longest digest of every algorithm; shorter digests are truncated (sha256) or native (blake2b)
+MAX_DIGEST_SIZES: Dict[str, int] = {"sha256": 32, "blake2b": 64}
+DIGEST_ALGORITHMS = tuple(MAX_DIGEST_SIZES)
+# Match indexes and the vectorized join take a 64-bit fingerprint from the start of every digest
+MIN_DIGEST_SIZE = 8
+MIN_KEY_SIZE = 16
+MAX_KEY_SIZE = 64
+
+
+def key_id(key: bytes) -> str:
+    """
+    Return the public identifier of a digest key, recorded with the hashed files made with it.
+
+    It is a short personalized BLAKE2b hash of the key, so two files can be checked for the same key
+    without revealing it; keys are random, so it cannot be inverted.
+    """
+    return hashlib.blake2b(key, digest_size=8, person=b"psi-key-id").hexdigest()
+
+
+def read_digest_key(file_path: str) -> bytes:
+    """
+    Read a digest key from a file holding it in hex, as written by
+    python -c "import secrets; print(secrets.token_hex(32))".
+
+    Raises:
+        ValueError: If the file does not hold a hex key of MIN_KEY_SIZE to MAX_KEY_SIZE bytes.
+    """
+    with open(file_path, encoding="utf-8") as file:
+        text = file.read().strip()
+    try:
+        key = bytes.fromhex(text)
+    except ValueError:
+        raise ValueError(f"{file_path} does not hold a hex digest key") from None
+    if not MIN_KEY_SIZE <= len(key) <= MAX_KEY_SIZE:
+        raise ValueError(f"Digest keys must be {MIN_KEY_SIZE} to {MAX_KEY_SIZE} bytes, {file_path} holds {len(key)}")
+    return key
+
+
+class Digester:
+    """
+    Computes the digests of normalized values with a configurable algorithm, output length and key.
+
+    sha256 is plain SHA-256, or HMAC-SHA256 with a key, truncated to the digest size. blake2b is BLAKE2b
+    with the digest size as its native output length, keyed with its built-in key parameter. A keyed
+    digest cannot be recomputed by anyone without the key, so values with little entropy such as phone
+    numbers cannot be recovered by hashing every candidate.
+
+    The key is absorbed once into a template hash, which is copied for every value.
+
+    Raises:
+        ValueError: If the algorithm is unknown, or the digest size or key length is out of range.
+    """
+
+    def __init__(
+        self, algorithm: str = DEFAULT_ALGORITHM, digest_size: int = DEFAULT_DIGEST_SIZE, key: bytes = b""
+    ) -> None:
+        if algorithm not in MAX_DIGEST_SIZES:
+            raise ValueError(f"Unknown digest algorithm '{algorithm}', expected one of {DIGEST_ALGORITHMS}")
+        if not MIN_DIGEST_SIZE <= digest_size <= MAX_DIGEST_SIZES[algorithm]:
+            raise ValueError(
+                f"{algorithm} digests must be {MIN_DIGEST_SIZE} to {MAX_DIGEST_SIZES[algorithm]} bytes, "
+                f"got {digest_size}"
+            )
+        if key and not MIN_KEY_SIZE <= len(key) <= MAX_KEY_SIZE:
+            raise ValueError(f"Digest keys must be {MIN_KEY_SIZE} to {MAX_KEY_SIZE} bytes, got {len(key)}")
+        self.algorithm = algorithm
+        self.digest_size = digest_size
+        self.key = key
+        self.parameters = DigestParameters(algorithm, digest_size, key_id(key) if key else None)
+        self.digest = self._digest_function()
+
+    def _digest_function(self) -> Callable[[bytes], bytes]:
+        size = self.digest_size
+        template: Any
+        if self.algorithm == "blake2b":
+            if not self.key:
+                return lambda value: hashlib.blake2b(value, digest_size=size).digest()
+            template = hashlib.blake2b(digest_size=size, key=self.key)
+        elif not self.key:
+            if size == MAX_DIGEST_SIZES["sha256"]:
+                return lambda value: hashlib.sha256(value).digest()
+            return lambda value: hashlib.sha256(value).digest()[:size]
+        else:
+            template = hmac.new(self.key, digestmod="sha256")
+
+        def keyed_digest(value: bytes) -> bytes:
+            state = template.copy()
+            state.update(value)
+            return state.digest()[:size]
+
+        return keyed_digest
@@ -0,0 +1,91 @@
+from array import array
+from typing import Dict, Iterator, List, Protocol, Sequence, Tuple
+
+import numpy as np
+
+from hashed_file import PHONE_COLUMNS, HashedTable
+
+# Every identifier matches on the digests of its hash columns: phones in any position, then emails, then
+# personal info. Every row of one dataset is paired with every row of the other that shares a digest.
+IDENTIFIERS: List[Tuple[str, Sequence[str]]] = [
+    ("Phone Match", PHONE_COLUMNS),
+    ("Email Match", ["Email Hash"]),
+    ("Personal Info Match", ["Personal Info Hash"]),
+]
+IDENTIFIER_NAMES = {"Phone Match": "phone", "Email Match": "email", "Personal Info Match": "personal info"}
+
+
+class DigestLookup(Protocol):
+    """The lookups the streaming matcher needs from the index of an identifier."""
+
+    def __contains__(self, digest: bytes) -> bool: ...
+
+    def get(self, digest: bytes) -> List[int]: ...
+
+
+class DigestIndex:
+    """
+    Multimap from the digests of some hash columns to the ids of the rows that have them, in CSR layout.
+
+    Distinct digests get consecutive key ids in order of first appearance. The row ids of all keys are held
+    in a single array, grouped by key and in scan order within a key, and key k owns
+    rows[offsets[k]:offsets[k + 1]]. A digest costs one dictionary entry and every occurrence one integer,
+    however many rows share the digest. A row that has a digest in several of the columns is listed once
+    per column.
+    """
+
+    def __init__(self, keys: Dict[bytes, int], offsets: np.ndarray, rows: np.ndarray) -> None:
+        self.keys = keys
+        self.offsets = offsets
+        self.rows = rows
+
+    @classmethod
+    def build(cls, hashes: HashedTable, column_names: Sequence[str]) -> "DigestIndex":
+        """
+        Index the non-empty digests of some hash columns of a dataset.
+
+        Args:
+            hashes: The hashed dataset
+            column_names: The hash columns to index together; columns the dataset does not have are skipped
+
+        Returns:
+            The index of the digests of all the columns
+        """
+        columns = [column for column in map(hashes.column_index, column_names) if column is not None]
+        keys: Dict[bytes, int] = {}
+        entry_keys = array("q")
+        entry_rows = array("q")
+        for row_id in range(len(hashes)):
+            for column in columns:
+                digest = hashes.digest(column, row_id)
+                if digest:
+                    entry_keys.append(keys.setdefault(digest, len(keys)))
+                    entry_rows.append(row_id)
+
+        # Group the entries by key with a stable counting sort, keeping scan order within each key
+        entry_keys_array = np.frombuffer(entry_keys, dtype=np.int64)
+        order = np.argsort(entry_keys_array, kind="stable")
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_keys_array, minlength=len(keys)), out=offsets[1:])
+        return cls(keys, offsets, np.frombuffer(entry_rows, dtype=np.int64)[order])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.keys
+
+    def count(self, digest: bytes) -> int:
+        """Return the number of entries of a digest."""
+        key = self.keys.get(digest)
+        return 0 if key is None else int(self.offsets[key + 1] - self.offsets[key])
+
+    def get(self, digest: bytes) -> List[int]:
+        """Return the ids of the rows that have a digest, in scan order, or an empty list."""
+        key = self.keys.get(digest)
+        return [] if key is None else self.rows[self.offsets[key] : self.offsets[key + 1]].tolist()
+
+    def items(self) -> Iterator[Tuple[bytes, List[int]]]:
+        """Yield every digest with the ids of the rows that have it, in order of first appearance."""
+        for digest, key in self.keys.items():
+            yield digest, self.rows[self.offsets[key] : self.offsets[key + 1]].tolist()
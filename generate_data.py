@@ -1,81 +1,399 @@
+import argparse
 import csv
+import random
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
 
+import phonenumbers
 from faker import Faker
 
-fake = Faker("en_US")
-
-
-def generate_data(file_path, records=10, common_records=None):
-    headers = [
-        "pseudonym",
-        "u_account",
-        "u_firstname",
-        "u_name",
-        "u_zip",
-        "u_city",
-        "u_state",
-        "u_address",
-        "u_address2",
-        "md_country",
-        "md_us_phone_1",
-        "md_us_phone_2",
-        "md_companyname",
-        "md_us_email",
-    ]
+from compressed_io import open_text
+
+HEADERS = [
+    "pseudonym",
+    "u_account",
+    "u_firstname",
+    "u_name",
+    "u_zip",
+    "u_city",
+    "u_state",
+    "u_address",
+    "u_address2",
+    "md_country",
+    "md_us_phone_1",
+    "md_us_phone_2",
+    "md_us_phone_3",
+    "md_companyname",
+    "md_us_email",
+]
+
+T = TypeVar("T")
+
+# Rows are generated in blocks, each from its own seeded random stream
+BLOCK_SIZE = 10000
+POOL_SIZE = 2000
+EMAIL_DOMAINS = ["example.com", "example.org", "example.net", "mail.example.com", "corp.example.com"]
+# How a valid phone number (area code, exchange, line) is written in the input files
+PHONE_FORMATS = [
+    "({0}) {1}-{2}",
+    "({0}){1}-{2}",
+    "{0}-{1}-{2}",
+    "{0}.{1}.{2}",
+    "{0} {1} {2}",
+    "{0}{1}{2}",
+    "1-{0}-{1}-{2}",
+    "1{0}{1}{2}",
+    "+1-{0}-{1}-{2}",
+    "+1 ({0}) {1}-{2}",
+    "+1{0}{1}{2}",
+]
+PHONE_COUNTS = [1, 2, 2, 3]
+ACCOUNT_LETTERS = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+EXTENSION_FORMATS = ["x{0}", " x{0}", " ext. {0}", " ext {0}"]
+INVALID_PHONES = [
+    "0",
+    "123",
+    "555-0100",
+    "000-000-0000",
+    "111-111-1111",
+    "(123) 456-7890",
+    "+1-999-999-9999",
+    "12345678901234",
+    "n/a",
+    "none",
+    "unknown",
+    "call office",
+    "-",
+]
+
+
+class Person(NamedTuple):
+    """The identity of a generated person: what both datasets hold for them when they share them."""
+
+    first_name: str
+    last_name: str
+    city: str
+    state: str
+    zip_code: str
+    address: str
+    phones: List[str]
+    email: str
+
+
+# rng.random of a random.Random; drawing with it directly is several times faster than choice or randint
+Uniform = Callable[[], float]
+
+
+def pick(uniform: Uniform, values: Sequence[T]) -> T:
+    """Return a random element of a non-empty sequence."""
+    return values[int(uniform() * len(values))]
+
+
+class Pools:
+    """Value pools drawn once with Faker, from which people are assembled quickly."""
+
+    def __init__(self, seed: int, rows: int, hot_phones: int, duplicate_email_rate: float) -> None:
+        fake = Faker("en_US")
+        fake.seed_instance(seed)
+        self.first_names = [fake.first_name() for _ in range(POOL_SIZE)]
+        self.last_names = [fake.last_name() for _ in range(POOL_SIZE)]
+        self.cities = [fake.city() for _ in range(POOL_SIZE)]
+        self.states = [fake.state_abbr() for _ in range(POOL_SIZE)]
+        self.streets = [fake.street_name() for _ in range(POOL_SIZE)]
+        self.companies = [fake.company() for _ in range(POOL_SIZE)]
+        self.countries = [fake.country() for _ in range(POOL_SIZE)]
+        self.area_codes = valid_area_codes()
+        # Exchanges of the form N11 and 555 are not assigned to subscribers
+        self.exchanges = [str(exchange) for exchange in range(200, 1000) if exchange % 100 != 11 and exchange != 555]
+        rng = random.Random(f"{seed}:hot")
+        self.hot_phones = [self.phone(rng.random) for _ in range(hot_phones)]
+        # About five people share each of the shared emails
+        self.shared_emails = max(1, int(rows * duplicate_email_rate / 5))
+
+    def phone(self, uniform: Uniform) -> str:
+        """Return a US or Canada number as 10 digits, with an area code libphonenumber accepts."""
+        return f"{pick(uniform, self.area_codes)}{pick(uniform, self.exchanges)}{int(uniform() * 10000):04d}"
+
+
+def valid_area_codes() -> List[str]:
+    """Return the US and Canada area codes that libphonenumber accepts."""
+    area_codes = []
+    for area_code in range(200, 1000):
+        number = phonenumbers.parse(f"+1{area_code}2345678")
+        if phonenumbers.is_valid_number(number) and phonenumbers.region_code_for_number(number) in ("US", "CA"):
+            area_codes.append(str(area_code))
+    return area_codes
+
+
+class GeneratorOptions(NamedTuple):
+    """How dirty and how skewed the generated data is; every rate is a fraction between 0 and 1."""
+
+    seed: int = 0
+    invalid_phone_rate: float = 0.05
+    duplicate_email_rate: float = 0.02
+    hot_phones: int = 10
+    hot_phone_rate: float = 0.001
+
+
+def make_person(uniform: Uniform, pools: Pools, options: GeneratorOptions) -> Person:
+    """Draw a person from the pools."""
+    first_name = pick(uniform, pools.first_names)
+    last_name = pick(uniform, pools.last_names)
+    phones = [pools.phone(uniform) for _ in range(pick(uniform, PHONE_COUNTS))]
+    if pools.hot_phones and uniform() < options.hot_phone_rate:
+        phones[-1] = pick(uniform, pools.hot_phones)
+    if uniform() < options.duplicate_email_rate:
+        email = f"family{int(uniform() * pools.shared_emails)}@{pick(uniform, EMAIL_DOMAINS)}"
+    else:
+        email = f"{first_name}.{last_name}{int(uniform() * 1000000)}@{pick(uniform, EMAIL_DOMAINS)}".lower()
+    return Person(
+        first_name,
+        last_name,
+        pick(uniform, pools.cities),
+        pick(uniform, pools.states),
+        f"{int(uniform() * 100000):05d}",
+        f"{int(uniform() * 99999) + 1} {pick(uniform, pools.streets)}",
+        phones,
+        email,
+    )
+
+
+def base_people(pools: Pools, options: GeneratorOptions, block: int) -> List[Person]:
+    """
+    Return the people of a block of BLOCK_SIZE rows of dataset 1.
+
+    Every block is drawn from its own seeded random stream, so dataset 2 regenerates the people it
+    shares with dataset 1 block by block, without holding dataset 1 in memory.
+    """
+    uniform = random.Random(f"{options.seed}:base:{block}").random
+    return [make_person(uniform, pools, options) for _ in range(BLOCK_SIZE)]
 
-    with open(file_path, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(headers)
-
-        for _ in range(records):
-            writer.writerow(
-                [
-                    fake.user_name(),
-                    fake.bothify(text="???-###-###"),
-                    fake.first_name(),
-                    fake.last_name(),
-                    fake.zipcode(),
-                    fake.city(),
-                    fake.state_abbr(),
-                    fake.street_address(),
-                    "",
-                    fake.country(),
-                    fake.phone_number(),
-                    fake.phone_number(),
-                    fake.company(),
-                    fake.email(),
-                ]
-            )
-
-        # Add common records if provided
-        if common_records:
-            for record in common_records:
-                writer.writerow(record)
-
-
-def main():
-    common_records = [
-        [
-            fake.user_name(),
-            fake.bothify(text="???-###-###"),
-            fake.first_name(),
-            fake.last_name(),
-            fake.zipcode(),
-            fake.city(),
-            fake.state_abbr(),
-            fake.street_address(),
-            "",
-            fake.country(),
-            fake.phone_number(),
-            fake.phone_number(),
-            fake.company(),
-            fake.email(),
-        ]
-        for _ in range(3)  # Number of common records
+
+def write_phone(uniform: Uniform, digits: str) -> str:
+    """Write 10 phone digits in one of the formats found in the input files, sometimes with an extension."""
+    phone = pick(uniform, PHONE_FORMATS).format(digits[:3], digits[3:6], digits[6:])
+    if uniform() < 0.05:
+        phone += pick(uniform, EXTENSION_FORMATS).format(int(uniform() * 99999) + 1)
+    return phone
+
+
+def render_row(uniform: Uniform, pools: Pools, options: GeneratorOptions, person: Person, pseudonym: str) -> List[str]:
+    """
+    Write a person as an input row of a dataset.
+
+    The formatting varies from row to row: the phone formats, the order of the phones, the case of the
+    name, city and email and stray whitespace, so a shared person only matches after normalization.
+    Phones are made invalid at options.invalid_phone_rate, independently in every dataset.
+    """
+    phones = [write_phone(uniform, digits) for digits in person.phones]
+    if len(phones) > 1 and uniform() < 0.2:
+        phones.reverse()
+    phones = [pick(uniform, INVALID_PHONES) if uniform() < options.invalid_phone_rate else phone for phone in phones]
+    phones += [""] * (3 - len(phones))
+    first_name, last_name, city, email = person.first_name, person.last_name, person.city, person.email
+    if uniform() < 0.1:
+        first_name, last_name, city = first_name.upper(), last_name.upper(), city.upper()
+    if uniform() < 0.05:
+        email = f" {email.upper()} "
+    return [
+        pseudonym,
+        f"{pick(uniform, ACCOUNT_LETTERS)}{pick(uniform, ACCOUNT_LETTERS)}-{int(uniform() * 1000000):06d}",
+        first_name,
+        last_name,
+        person.zip_code,
+        city,
+        person.state,
+        person.address,
+        f"Apt {int(uniform() * 999) + 1}" if uniform() < 0.25 else "",
+        pick(uniform, pools.countries),
+        *phones,
+        pick(uniform, pools.companies),
+        email,
     ]
 
-    generate_data("dataset1.csv", records=7, common_records=common_records)
-    generate_data("dataset2.csv", records=7, common_records=common_records)
+
+def dataset_block(
+    pools: Pools, options: GeneratorOptions, dataset: int, block: int, rows: int, base_rows: int, overlap: float
+) -> List[List[str]]:
+    """
+    Generate the rows of a block of BLOCK_SIZE rows of a dataset.
+
+    Row i of dataset 1 is person i of the base people. Row i of dataset 2 is the same person with
+    probability overlap when i < base_rows, so that is the fraction of dataset 2 shared with dataset 1,
+    and otherwise a new person, found in dataset 1 only by chance (hot phones and shared emails).
+    """
+    uniform = random.Random(f"{options.seed}:render{dataset}:{block}").random
+    start = block * BLOCK_SIZE
+    base: Optional[List[Person]] = None
+    if dataset == 1 or (overlap and start < base_rows):
+        base = base_people(pools, options, block)
+    block_rows = []
+    for offset in range(min(BLOCK_SIZE, rows - start)):
+        index = start + offset
+        if base is not None and (dataset == 1 or (index < base_rows and uniform() < overlap)):
+            person = base[offset]
+        else:
+            person = make_person(uniform, pools, options)
+        block_rows.append(render_row(uniform, pools, options, person, f"ds{dataset}_{index:09d}"))
+    return block_rows
+
+
+_worker_pools: Optional[Pools] = None
+
+
+def _init_worker(pools: Pools) -> None:
+    """Initialize module state in a generator worker process."""
+    global _worker_pools
+    _worker_pools = pools
+
+
+def _dataset_block_in_worker(*args: Any) -> List[List[str]]:
+    assert _worker_pools is not None
+    return dataset_block(_worker_pools, *args)
+
+
+def dataset_blocks(
+    pools: Pools,
+    options: GeneratorOptions,
+    dataset: int,
+    rows: int,
+    base_rows: int,
+    overlap: float,
+    workers: int = 1,
+) -> Iterator[List[List[str]]]:
+    """
+    Generate the rows of a dataset block by block, in order.
+
+    Blocks do not depend on each other, so with more than one worker they are generated by a process
+    pool, with at most two blocks per worker in flight; the rows are the same as with one worker.
+    """
+    blocks = range((rows + BLOCK_SIZE - 1) // BLOCK_SIZE)
+    if workers == 1:
+        for block in blocks:
+            yield dataset_block(pools, options, dataset, block, rows, base_rows, overlap)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pools,)) as executor:
+        pending: Deque[Future] = deque()
+        for block in blocks:
+            pending.append(executor.submit(_dataset_block_in_worker, options, dataset, block, rows, base_rows, overlap))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_dataset(file_path: str, blocks: Iterator[List[List[str]]]) -> int:
+    """Write generated rows to a CSV file, compressed if its name ends in .gz or .zst, and count them."""
+    count = 0
+    with open_text(file_path, "w") as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS)
+        for block_rows in blocks:
+            writer.writerows(block_rows)
+            count += len(block_rows)
+    return count
+
+
+def generate_datasets(
+    file_path_1: str,
+    file_path_2: str,
+    rows_1: int,
+    rows_2: Optional[int] = None,
+    overlap: float = 0.3,
+    options: GeneratorOptions = GeneratorOptions(),
+    workers: int = 1,
+) -> Tuple[int, int]:
+    """
+    Generate two input datasets that share people.
+
+    The output only depends on the arguments, so a seed reproduces the same files.
+
+    Args:
+        file_path_1: Path of the first dataset
+        file_path_2: Path of the second dataset
+        rows_1: Number of rows of the first dataset
+        rows_2: Number of rows of the second dataset (default: rows_1)
+        overlap: Fraction of the rows of the second dataset that are people of the first one, among its
+            first rows_1 rows
+        options: Seed, dirty phones and skew of the data
+        workers: Number of processes generating rows
+
+    Returns:
+        The number of rows written to each dataset
+    """
+    rows_2 = rows_1 if rows_2 is None else rows_2
+    pools = Pools(options.seed, rows_1 + rows_2, options.hot_phones, options.duplicate_email_rate)
+    written_1 = write_dataset(file_path_1, dataset_blocks(pools, options, 1, rows_1, rows_1, overlap, workers))
+    written_2 = write_dataset(file_path_2, dataset_blocks(pools, options, 2, rows_2, rows_1, overlap, workers))
+    return written_1, written_2
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Generate two synthetic input datasets that share people.")
+    parser.add_argument("--output-file-1", type=str, default="dataset1.csv", help="Path of the first dataset")
+    parser.add_argument("--output-file-2", type=str, default="dataset2.csv", help="Path of the second dataset")
+    parser.add_argument("--rows", type=int, default=10, help="Number of rows of the first dataset (default: 10)")
+    parser.add_argument("--rows-2", type=int, help="Number of rows of the second dataset (default: --rows)")
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=0.3,
+        help="Fraction of the second dataset that are people of the first one (default: 0.3)",
+    )
+    parser.add_argument(
+        "--invalid-phone-rate",
+        type=float,
+        default=0.05,
+        help="Fraction of phone values replaced with junk or invalid numbers (default: 0.05)",
+    )
+    parser.add_argument(
+        "--duplicate-email-rate",
+        type=float,
+        default=0.02,
+        help="Fraction of people whose email is shared with about four other people (default: 0.02)",
+    )
+    parser.add_argument(
+        "--hot-phones", type=int, default=10, help="Number of hot phone numbers shared by many people (default: 10)"
+    )
+    parser.add_argument(
+        "--hot-phone-rate",
+        type=float,
+        default=0.001,
+        help="Fraction of people with one of the hot phone numbers (default: 0.001)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes generating rows; same output (default: 1)"
+    )
+    args = parser.parse_args()
+    if args.rows < 0 or (args.rows_2 is not None and args.rows_2 < 0):
+        parser.error("--rows and --rows-2 cannot be negative")
+    for name in ("overlap", "invalid_phone_rate", "duplicate_email_rate", "hot_phone_rate"):
+        if not 0 <= getattr(args, name) <= 1:
+            parser.error(f"--{name.replace('_', '-')} must be between 0 and 1")
+    if args.hot_phones < 0:
+        parser.error("--hot-phones cannot be negative")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    written_1, written_2 = generate_datasets(
+        args.output_file_1,
+        args.output_file_2,
+        args.rows,
+        args.rows_2,
+        args.overlap,
+        GeneratorOptions(
+            seed=args.seed,
+            invalid_phone_rate=args.invalid_phone_rate,
+            duplicate_email_rate=args.duplicate_email_rate,
+            hot_phones=args.hot_phones,
+            hot_phone_rate=args.hot_phone_rate,
+        ),
+        args.workers,
+    )
+    print(f"Wrote {written_1} rows to {args.output_file_1} and {written_2} rows to {args.output_file_2}")
 
 
 if __name__ == "__main__":
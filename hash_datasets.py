@@ -1,11 +1,42 @@
 import argparse
 import csv
+import functools
 import hashlib
+import itertools
+import json
+import os
+import queue
 import re
-from typing import Any, Dict, List, Optional
+import shutil
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import IO, Any, Callable, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import phonenumbers
 
+import approximate_match
+import digest_algorithms
+from compressed_io import open_text
+from digest_algorithms import DIGEST_ALGORITHMS, Digester, read_digest_key
+from hashed_file import (
+    DEFAULT_ALGORITHM,
+    DEFAULT_DIGEST_SIZE,
+    HASH_COLUMNS,
+    OUTPUT_FORMATS,
+    SKETCH_COLUMNS,
+    HashedCsvWriter,
+    HashedRow,
+    HashedWriter,
+    concatenate_binary_files,
+    open_hashed_writer,
+    write_digest_manifest,
+)
+from metrics import Metrics, clock, profiled
+from row_cache import CachedRow, RowCache, row_cache_key
+
+PhoneParseResult = Tuple[str, Optional[str], bool]
+
 debug_mode = False
 phone_warnings = {
     "md_us_phone_1_blank": 0,
@@ -26,51 +57,235 @@ def debug_print(message: str) -> None:
         print(message)
 
 
-def standardize_phone_number(phone: str, pseudonym: str, phone_label: str) -> tuple[str, Optional[str]]:
+class PhoneCache:
     """
-    Standardize phone numbers to E.164 format using libphonenumber.
+    Bounded cache of phone standardization results keyed on the raw input string.
+
+    Real panels repeat the same raw phone strings (shared household lines, placeholder junk,
+    the same number in several phone fields), so the libphonenumber work is only done once
+    per distinct string. Entries are evicted either least-recently-used ("lru") or in
+    insertion order ("fifo") once the cache holds max_size entries.
+    """
+
+    POLICIES = ("lru", "fifo")
+
+    def __init__(self, max_size: int = 100000, policy: str = "lru") -> None:
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown phone cache eviction policy '{policy}', expected one of {self.POLICIES}")
+        self.max_size = max_size
+        self.policy = policy
+        self.entries: OrderedDict[str, PhoneParseResult] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, phone: str) -> Optional[PhoneParseResult]:
+        """Return the cached result for a raw phone string, or None on a miss."""
+        result = self.entries.get(phone)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == "lru":
+            self.entries.move_to_end(phone)
+        return result
+
+    def put(self, phone: str, result: PhoneParseResult) -> None:
+        """Store the result for a raw phone string, evicting an entry if the cache is full."""
+        self.entries[phone] = result
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit, miss and eviction counts."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def reset_stats(self) -> None:
+        """Reset the hit, miss and eviction counts, keeping the cached entries."""
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+
+phone_cache: Optional[PhoneCache] = PhoneCache()
+# Performance metrics of the run, collected only when set (see metrics.py)
+metrics: Optional[Metrics] = None
+
+
+def configure_phone_cache(max_size: int, policy: str = "lru") -> None:
+    """Replace the module phone cache; a max_size of 0 disables caching."""
+    global phone_cache
+    phone_cache = PhoneCache(max_size, policy) if max_size > 0 else None
+
+
+digester = Digester()
+
+
+def configure_digest(
+    algorithm: str = DEFAULT_ALGORITHM, digest_size: int = DEFAULT_DIGEST_SIZE, key: bytes = b""
+) -> None:
+    """
+    Replace the module digester, which computes the digests of normalized values (see digest_algorithms).
+
+    Raises:
+        ValueError: If the algorithm is unknown, or the digest size or key length is out of range.
+    """
+    global digester
+    digester = Digester(algorithm, digest_size, key)
+
+
+# Whether to add the personal info sketch columns for approximate matching to the output
+personal_info_sketches = False
+
+
+def output_columns() -> List[str]:
+    """Return the hash columns of the output."""
+    return HASH_COLUMNS + SKETCH_COLUMNS if personal_info_sketches else HASH_COLUMNS
+
+
+# US and Canada numbers in their common shapes: an optional leading 1 or +1, the area code (in parentheses
+# or not), the exchange and the line, with at most one space, dot or dash between the groups, and an
+# optional extension such as "x053", which E.164 leaves out
+NANP_PHONE_PATTERN = re.compile(
+    r"(?:\+?1[ .-]?)?(?:\(([2-9]\d\d)\)|([2-9]\d\d))[ .-]?(\d{3})[ .-]?(\d{4})(?: ?(?:x|ext\.?) ?\d{1,6})?",
+    re.IGNORECASE,
+)
+NANP_REGIONS = ("US", "CA")
+NANP_NUMBER_TYPES = (
+    phonenumbers.PhoneNumberType.FIXED_LINE,
+    phonenumbers.PhoneNumberType.MOBILE,
+    phonenumbers.PhoneNumberType.FIXED_LINE_OR_MOBILE,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def nanp_prefix_is_valid(prefix: str) -> bool:
+    """
+    Return whether US and Canada numbers starting with an area code and the first digit of an exchange are
+    valid geographic numbers.
+
+    libphonenumber decides the validity of these numbers on their first four digits only (the line and the
+    rest of the exchange are free), so the table of the 8000 prefixes is filled from libphonenumber itself,
+    probing the lowest and highest number of each prefix on first use. Other numbers (toll free, personal
+    and Caribbean numbers) are not valid here and are left to libphonenumber.
+    """
+    for line in ("000000", "999999"):
+        number = phonenumbers.PhoneNumber(country_code=1, national_number=int(prefix + line))
+        if phonenumbers.region_code_for_number(number) not in NANP_REGIONS:
+            return False
+        if not phonenumbers.is_valid_number(number) or phonenumbers.number_type(number) not in NANP_NUMBER_TYPES:
+            return False
+    return True
+
+
+def parse_nanp_number(phone: str) -> Optional[PhoneParseResult]:
+    """
+    Standardize a valid US or Canada phone number without libphonenumber.
+
+    Returns:
+        The parse_phone_number result, or None if the input is not of a common shape or is not a valid
+        geographic number, so libphonenumber has to decide.
+    """
+    match = NANP_PHONE_PATTERN.fullmatch(phone)
+    if match is None:
+        return None
+    area_code = match.group(1) or match.group(2)
+    if not nanp_prefix_is_valid(area_code + match.group(3)[0]):
+        return None
+    return f"+1{area_code}{match.group(3)}{match.group(4)}", None, False
+
+
+def parse_phone_number(phone: str) -> PhoneParseResult:
+    """
+    Parse and validate a non-blank phone number.
+
+    Valid US and Canada numbers of the common shapes are standardized directly (see parse_nanp_number);
+    everything else goes through libphonenumber, with the same result.
 
     Args:
         phone: The input phone number string
-        pseudonym: The pseudonym for error reporting
-        phone_label: Label for the phone field (md_us_phone_1, md_us_phone_2, etc.)
 
     Returns:
         A tuple containing:
-            - Standardized phone number in E.164 format (or empty string if invalid/blank).
+            - Standardized phone number in E.164 format (or empty string if invalid).
             - A string describing the failure reason (or None if successful).
+            - Whether the failure came from libphonenumber being unable to parse the input.
     """
-    if phone is None or phone.strip() == "":
-        debug_print(f"Warning: Blank phone number for pseudonym '{pseudonym}', field '{phone_label}'")
-        phone_warnings[f"{phone_label}_blank"] += 1
-        return "", "Blank phone number"
+    return parse_nanp_number(phone) or parse_phone_number_with_libphonenumber(phone)
+
+
+def parse_phone_number_with_libphonenumber(phone: str) -> PhoneParseResult:
+    """
+    Parse and validate a non-blank phone number with libphonenumber.
 
+    Args:
+        phone: The input phone number string
+
+    Returns:
+        A tuple containing:
+            - Standardized phone number in E.164 format (or empty string if invalid).
+            - A string describing the failure reason (or None if successful).
+            - Whether the failure came from libphonenumber being unable to parse the input.
+    """
     try:
         parsed_phone = phonenumbers.parse(phone, "US")
 
         if phonenumbers.is_valid_number(parsed_phone):
-            formatted_phone = phonenumbers.format_number(parsed_phone, phonenumbers.PhoneNumberFormat.E164)
-            debug_print(
-                f"Formatted phone number for '{pseudonym}': Original '{phone}' => Formatted '{formatted_phone}'"
-            )
-            phone_warnings[f"{phone_label}_success"] += 1
-            return formatted_phone, None
+            return phonenumbers.format_number(parsed_phone, phonenumbers.PhoneNumberFormat.E164), None, False
         else:
             reason = "Invalid phone number"
             if not phonenumbers.is_possible_number(parsed_phone):
                 reason = "Not a possible number"
             elif phonenumbers.number_type(parsed_phone) == phonenumbers.PhoneNumberType.UNKNOWN:
                 reason = "Unknown number type"
-
-            debug_print(f"Warning: Invalid phone number '{phone}' for pseudonym '{pseudonym}': {reason}")
-            phone_warnings[f"{phone_label}_invalid"] += 1
-            return "", reason
+            return "", reason, False
 
     except phonenumbers.NumberParseException as e:
+        return "", f"Failed to parse phone number: {e}", True
+
+
+def standardize_phone_number(phone: str, pseudonym: str, phone_label: str) -> tuple[str, Optional[str]]:
+    """
+    Standardize phone numbers to E.164 format using libphonenumber.
+
+    Results for non-blank input are looked up in, and stored into, the module phone cache.
+
+    Args:
+        phone: The input phone number string
+        pseudonym: The pseudonym for error reporting
+        phone_label: Label for the phone field (md_us_phone_1, md_us_phone_2, etc.)
+
+    Returns:
+        A tuple containing:
+            - Standardized phone number in E.164 format (or empty string if invalid/blank).
+            - A string describing the failure reason (or None if successful).
+    """
+    if phone is None or phone.strip() == "":
+        debug_print(f"Warning: Blank phone number for pseudonym '{pseudonym}', field '{phone_label}'")
+        phone_warnings[f"{phone_label}_blank"] += 1
+        return "", "Blank phone number"
+
+    result = phone_cache.get(phone) if phone_cache is not None else None
+    if result is None:
+        if metrics is not None:
+            started = clock()
+            result = parse_phone_number(phone)
+            metrics.observe("phone_parse_uncached", started)
+        else:
+            result = parse_phone_number(phone)
+        if phone_cache is not None:
+            phone_cache.put(phone, result)
+    formatted_phone, reason, parse_failed = result
+
+    if reason is None:
+        debug_print(f"Formatted phone number for '{pseudonym}': Original '{phone}' => Formatted '{formatted_phone}'")
+        phone_warnings[f"{phone_label}_success"] += 1
+    elif parse_failed:
+        debug_print(f"Warning: {reason} for '{phone}' pseudonym '{pseudonym}'")
+        phone_warnings[f"{phone_label}_invalid"] += 1
+    else:
+        debug_print(f"Warning: Invalid phone number '{phone}' for pseudonym '{pseudonym}': {reason}")
         phone_warnings[f"{phone_label}_invalid"] += 1
-        error_message = f"Failed to parse phone number: {e}"
-        debug_print(f"Warning: {error_message} for '{phone}' pseudonym '{pseudonym}'")
-        return "", error_message
+    return formatted_phone, reason
 
 
 state_province_codes = {
@@ -142,10 +357,72 @@ def normalize_state_province(name: str) -> str:
     return state_province_codes.get(name.title(), name)
 
 
+ADDRESS_SUBSTITUTIONS = {
+    "street": "st",
+    "avenue": "ave",
+    "road": "rd",
+    "drive": "dr",
+    "place": "pl",
+    "lane": "ln",
+    "highway": "hwy",
+    "court": "ct",
+    "square": "sq",
+    "loop": "lp",
+    "trail": "trl",
+    "parkway": "pkwy",
+    "commons": "cmns",
+    "north": "n",
+    "south": "s",
+    "east": "e",
+    "west": "w",
+    "boulevard": "blvd",
+    "circle": "cir",
+    "terrace": "ter",
+}
+_ADDRESS_SUBSTITUTION_ORDER = {word: order for order, word in enumerate(ADDRESS_SUBSTITUTIONS)}
+_ADDRESS_EDGE_RE = re.compile(r"^[,.\s]+|[,.\s]+$")
+_ADDRESS_UNIT_RE = re.compile(r"\b(?:apartment|apt|suite|ste|unit|fl|floor|#)\s*[\w-]+\b")
+_ADDRESS_WORD_RE = re.compile(r"\b(" + "|".join(map(re.escape, ADDRESS_SUBSTITUTIONS)) + r")\b(\.?)")
+_ADDRESS_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _abbreviate_address_words(address: str) -> str:
+    """
+    Apply all ADDRESS_SUBSTITUTIONS in a single pass over the address.
+
+    The substitutions used to be applied one word at a time, in dictionary order, and each one also
+    consumes a "." directly after the word. That glues the next word onto the abbreviation, so a
+    word that directly follows a consumed "." is left alone when its own substitution came later
+    in that order (e.g. "north.west" becomes "nwest", but "west.north" becomes "wn").
+    """
+    parts = []
+    position = 0
+    glued_end, glued_order = -1, -1
+    for match in _ADDRESS_WORD_RE.finditer(address):
+        start, end = match.span()
+        order = _ADDRESS_SUBSTITUTION_ORDER[match.group(1)]
+        parts.append(address[position:start])
+        if start == glued_end and glued_order < order:
+            parts.append(match.group(0))
+            glued_end, glued_order = -1, -1
+        else:
+            parts.append(ADDRESS_SUBSTITUTIONS[match.group(1)])
+            glued_end, glued_order = (end, order) if match.group(2) else (-1, -1)
+        position = end
+    if not parts:
+        return address
+    parts.append(address[position:])
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=65536)
 def normalize_address(address: str) -> str:
     """
     Normalize an address by standardizing format and removing apartment/unit numbers.
 
+    Results are memoized, since city values repeat heavily across rows.
+
     Args:
         address: The input address string
 
@@ -155,227 +432,1188 @@ def normalize_address(address: str) -> str:
     if not address:
         return ""
     address = address.lower().strip()
-    address = re.sub(r"^[,.\s]+|[,.\s]+$", "", address)
-    address = re.sub(r"\b(?:apartment|apt|suite|ste|unit|fl|floor|#)\s*[\w-]+\b", "", address)
-    substitutions = {
-        "street": "st",
-        "avenue": "ave",
-        "road": "rd",
-        "drive": "dr",
-        "place": "pl",
-        "lane": "ln",
-        "highway": "hwy",
-        "court": "ct",
-        "square": "sq",
-        "loop": "lp",
-        "trail": "trl",
-        "parkway": "pkwy",
-        "commons": "cmns",
-        "north": "n",
-        "south": "s",
-        "east": "e",
-        "west": "w",
-        "boulevard": "blvd",
-        "circle": "cir",
-        "terrace": "ter",
-    }
-    for k, v in substitutions.items():
-        address = re.sub(rf"\b{k}\b\.?", v, address)
-    address = re.sub(r"[^\w\s]", "", address)
-    address = re.sub(r"\s+", " ", address).strip()
+    address = _ADDRESS_EDGE_RE.sub("", address)
+    address = _ADDRESS_UNIT_RE.sub("", address)
+    address = _abbreviate_address_words(address)
+    address = _ADDRESS_PUNCTUATION_RE.sub("", address)
+    address = _WHITESPACE_RE.sub(" ", address).strip()
     return address
 
 
-def hash_entry(row: Dict[str, str]) -> tuple[Optional[List[str]], List[Dict[str, Any]]]:
+COLUMN_ALIASES = {
+    "pseudonym": ["Panelistid", "pseudonym", "uniqueid", "index"],
+    "u_firstname": ["FirstName", "u_firstname", "firstname", "first_name"],
+    "u_name": ["LastName", "u_name", "surname", "last_name"],
+    "u_city": ["City", "u_city", "city"],
+    "u_state": ["State", "u_state", "state"],
+    "md_us_phone_1": ["Phone 1", "md_us_phone_1", "phone1", "phone_1", "md_us_phone_1_rec"],
+    "md_us_phone_2": ["Phone 2", "md_us_phone_2", "phone2", "phone_2", "md_us_phone_2_rec"],
+    "md_us_phone_3": ["Phone 3", "md_us_phone_3", "phone3", "phone_3", "md_us_phone_3_rec"],
+    "md_us_email": ["Email", "md_us_email", "email"],
+}
+OPTIONAL_COLUMNS = {"md_us_phone_2", "md_us_phone_3"}
+PHONE_LABELS = ["md_us_phone_1", "md_us_phone_2", "md_us_phone_3"]
+# Positions of the phone fields among the values returned by RowProjector.project
+PHONE_FIELDS = slice(list(COLUMN_ALIASES).index(PHONE_LABELS[0]), list(COLUMN_ALIASES).index(PHONE_LABELS[-1]) + 1)
+
+
+class RowProjector:
+    """
+    Extracts the hashed fields from csv.reader rows using column indices resolved once from the header.
+
+    Each field in COLUMN_ALIASES is taken from the first of its aliases present in the header. When a
+    column name appears more than once, its last occurrence is used, as csv.DictReader would.
+    """
+
+    def __init__(self, fieldnames: Sequence[str]) -> None:
+        """
+        Resolve the column aliases against a header row.
+
+        Args:
+            fieldnames: The header row of the input file
+
+        Raises:
+            ValueError: If a required column is missing from the header.
+        """
+        self.fieldnames = list(fieldnames)
+        positions = {name: index for index, name in enumerate(self.fieldnames)}
+        self.indices: List[int] = []
+        missing = []
+        for field, aliases in COLUMN_ALIASES.items():
+            index = next((positions[alias] for alias in aliases if alias in positions), -1)
+            if index < 0 and field not in OPTIONAL_COLUMNS:
+                missing.append(f"{field} (one of: {', '.join(aliases)})")
+            self.indices.append(index)
+        if missing:
+            raise ValueError("Input file is missing required columns: " + "; ".join(missing))
+        self.width = max(self.indices) + 1
+
+    def project(self, row: Sequence[str]) -> List[str]:
+        """Return the stripped, lowercased values of the COLUMN_ALIASES fields of a row, in that order."""
+        if len(row) < self.width:
+            row = list(row) + [""] * (self.width - len(row))
+        return [row[index].strip().lower() if index >= 0 else "" for index in self.indices]
+
+    def as_dict(self, row: Sequence[str]) -> Dict[str, str]:
+        """Return a row keyed by the header, as csv.DictReader would produce it."""
+        return dict(zip(self.fieldnames, row))
+
+
+def _bad_phone_record(
+    row: Sequence[str], projector: RowProjector, pseudonym: str, phone: str, phone_label: str, reason: str
+) -> Dict[str, Any]:
+    """Return the details of a phone number that failed standardization, for the bad records file."""
+    bad_record_detail = {
+        "Pseudonym": pseudonym,
+        "OriginalPhoneInput": phone,
+        "PhoneFieldLabel": phone_label,
+        "ReasonForFailure": reason,
+    }
+    # Add all original row data to the bad record for full context
+    bad_record_detail.update(projector.as_dict(row))
+    return bad_record_detail
+
+
+def hash_entry(row: Sequence[str], projector: RowProjector) -> tuple[Optional[HashedRow], List[Dict[str, Any]]]:
     """
     Process a row from the input file and generate hashed values.
     It also collects details of any phone numbers that failed standardization.
 
     Args:
-        row: Dictionary containing the row data
+        row: The row data as read by csv.reader
+        projector: The projector built from the header of the input file
 
     Returns:
         A tuple containing:
-            - List of values for output (hashed_row) or None if the row should be skipped.
+            - The pseudonym and the raw digests for output (hashed_row), with b"" for blank values,
+              followed by the personal info sketch split over the sketch columns when sketches are on,
+              or None if the row should be skipped.
             - A list of dictionaries, where each dictionary contains details of a bad phone record.
     """
-    columns = {
-        "pseudonym": ["Panelistid", "pseudonym", "uniqueid", "index"],
-        "u_firstname": ["FirstName", "u_firstname", "firstname", "first_name"],
-        "u_name": ["LastName", "u_name", "surname", "last_name"],
-        "u_city": ["City", "u_city", "city"],
-        "u_state": ["State", "u_state", "state"],
-        "md_us_phone_1": ["Phone 1", "md_us_phone_1", "phone1", "phone_1", "md_us_phone_1_rec"],
-        "md_us_phone_2": ["Phone 2", "md_us_phone_2", "phone2", "phone_2", "md_us_phone_2_rec"],
-        "md_us_phone_3": ["Phone 3", "md_us_phone_3", "phone3", "phone_3", "md_us_phone_3_rec"],
-        "md_us_email": ["Email", "md_us_email", "email"],
-    }
+    row_metrics = metrics
+    started = clock() if row_metrics is not None else (0.0, 0.0)
+    pseudonym, u_firstname, u_name, u_city, u_state, phone_1, phone_2, phone_3, email = projector.project(row)
+    if not pseudonym:
+        return None, []
+
+    u_firstname = u_firstname[0] if u_firstname else ""
+    u_city = normalize_address(u_city)
+    u_state = normalize_state_province(u_state)
+    if row_metrics is not None:
+        started = row_metrics.add_since("normalize", started, rows=1)
 
     bad_phone_records = []
+    processed_phones = []
+    for phone_label, original_phone_value in zip(PHONE_LABELS, (phone_1, phone_2, phone_3)):
+        std_phone, reason = standardize_phone_number(original_phone_value, pseudonym, phone_label)
+        processed_phones.append(std_phone)
+        if reason and reason != "Blank phone number":
+            bad_phone_records.append(
+                _bad_phone_record(row, projector, pseudonym, original_phone_value, phone_label, reason)
+            )
 
-    def get_column_value(column_variants: List[str]) -> str:
-        """Get the value from the first matching column name in the row."""
-        for variant in column_variants:
-            if variant in row:
-                return row[variant].strip().lower()
-        return ""
+    if row_metrics is not None:
+        started = row_metrics.add_since("phone_parse", started, rows=1)
 
-    pseudonym = get_column_value(columns["pseudonym"])
-    if not pseudonym:
-        return None, []
+    personal_info_concat = f"{u_city}{u_state}{u_name}{u_firstname}"
+
+    digest = digester.digest
+    digests = []
+    for value in [*processed_phones, personal_info_concat, email]:
+        if value:
+            digests.append(digest(value.encode("utf-8")))
+        else:
+            digests.append(b"")
+    if row_metrics is not None:
+        started = row_metrics.add_since("digest", started, rows=1)
+
+    if personal_info_sketches:
+        size = digester.digest_size
+        sketch = approximate_match.personal_info_sketch(
+            (u_city, u_state, u_name, u_firstname), digest, len(SKETCH_COLUMNS) * size
+        )
+        digests.extend(sketch[start : start + size] for start in range(0, len(SKETCH_COLUMNS) * size, size))
+        if row_metrics is not None:
+            row_metrics.add_since("sketch", started, rows=1)
+
+    return (pseudonym, digests), bad_phone_records
+
+
+HashResult = Tuple[Optional[HashedRow], List[Dict[str, Any]]]
+# A batch of results to write, with the progress of the run after it if a checkpoint follows it
+OutputBatch = Tuple[List[HashResult], Optional[Dict[str, Any]]]
+
+
+def _init_worker(
+    worker_debug_mode: bool,
+    cache_size: int,
+    cache_policy: str,
+    collect_metrics: bool,
+    digest_configuration: Tuple[str, int, bytes],
+    sketches: bool,
+) -> None:
+    """Initialize module state in a hashing worker process."""
+    global debug_mode, metrics, personal_info_sketches
+    debug_mode = worker_debug_mode
+    personal_info_sketches = sketches
+    configure_phone_cache(cache_size, cache_policy)
+    configure_digest(*digest_configuration)
+    metrics = Metrics("hash_datasets worker") if collect_metrics else None
+
+
+def _hash_chunk(
+    rows: List[List[str]], projector: RowProjector
+) -> Tuple[List[HashResult], Dict[str, int], Dict[str, int], Optional[Tuple[Any, Any]]]:
+    """
+    Hash a chunk of rows inside a worker process.
+
+    Args:
+        rows: The input rows of the chunk, in input order
+        projector: The projector built from the header of the input file
+
+    Returns:
+        A tuple containing:
+            - The hash_entry result for every row of the chunk, in input order.
+            - The phone_warnings counts accumulated while hashing this chunk only.
+            - The phone cache statistics accumulated while hashing this chunk only.
+            - The metrics state of this chunk only, if metrics are collected.
+    """
+    for key in phone_warnings:
+        phone_warnings[key] = 0
+    if phone_cache is not None:
+        phone_cache.reset_stats()
+    if metrics is not None:
+        metrics.reset()
+    results = [hash_entry(row, projector) for row in rows]
+    return (
+        results,
+        dict(phone_warnings),
+        phone_cache.stats() if phone_cache is not None else {},
+        metrics.state() if metrics is not None else None,
+    )
+
+
+def _hash_rows_serial(rows: Iterable[List[str]], projector: RowProjector) -> Iterator[Tuple[List[str], HashResult]]:
+    """Hash rows in the current process, yielding every row with its hash_entry result."""
+    for row in rows:
+        yield row, hash_entry(row, projector)
+
+
+# Marks the end of the items of a pipeline queue
+_END = object()
+_STAGE_POLL_SECONDS = 0.1
+
+
+def _put(buffer: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item into a bounded queue, waiting while it is full, unless stop is set; return whether it was put."""
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=_STAGE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_ahead(items: Iterable[Any], queue_size: int) -> Iterator[Any]:
+    """
+    Produce items in a background reader thread, at most queue_size items ahead of the consumer.
+
+    Exceptions of the reader are re-raised in the consumer, and a consumer that stops early stops the reader.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def read() -> None:
+        try:
+            for item in items:
+                if not _put(buffer, (item, None), stop):
+                    return
+            _put(buffer, (_END, None), stop)
+        except BaseException as error:
+            _put(buffer, (_END, error), stop)
+
+    thread = threading.Thread(target=read, name="hash-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _WriterStage:
+    """
+    Runs a write function on batches of results in a background writer thread, fed through a bounded queue.
 
-    u_firstname = get_column_value(columns["u_firstname"])[0] if get_column_value(columns["u_firstname"]) else ""
-    u_name = get_column_value(columns["u_name"])
-    u_city = normalize_address(get_column_value(columns["u_city"]))
-    u_state = normalize_state_province(get_column_value(columns["u_state"]))
+    submit blocks while queue_size batches are waiting, so a slow writer holds back hashing. Batches are
+    written in the order they are submitted. An exception of the writer is re-raised by submit or close.
+    """
+
+    def __init__(self, write: Callable[[OutputBatch], None], queue_size: int) -> None:
+        self.write = write
+        self.buffer: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name="hash-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self.buffer.get()
+            if batch is _END:
+                return
+            try:
+                self.write(batch)
+            except BaseException as error:
+                self.error = error
+                self.stop.set()
+                return
+
+    def submit(self, batch: OutputBatch) -> None:
+        """Queue a batch of results for writing."""
+        if not _put(self.buffer, batch, self.stop):
+            # The writer thread only stops early after recording its error
+            assert self.error is not None
+            raise self.error
+
+    def close(self) -> None:
+        """Wait until every queued batch is written."""
+        _put(self.buffer, _END, self.stop)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def _read_chunks(rows: Iterable[List[str]], chunk_size: int) -> Iterator[List[List[str]]]:
+    """Split an iterable of rows into lists of at most chunk_size rows."""
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _hash_rows_parallel(
+    rows: Iterable[List[str]], projector: RowProjector, workers: int, chunk_size: int, ordered: bool = True
+) -> Iterator[Tuple[List[str], HashResult]]:
+    """
+    Hash rows in a process pool and yield every row with its hash_entry result.
 
-    phone_fields_to_process = [
-        ("md_us_phone_1", columns["md_us_phone_1"]),
-        ("md_us_phone_2", columns["md_us_phone_2"]),
-        ("md_us_phone_3", columns["md_us_phone_3"]),
+    The input is split into chunks that are hashed by the workers, with at most two chunks per
+    worker in flight so memory stays bounded on very large inputs. Every worker keeps its own
+    phone cache. The phone_warnings counts, phone cache statistics and metrics of every chunk are
+    merged into those of the module as the chunk is consumed.
+
+    Args:
+        rows: The input rows
+        projector: The projector built from the header of the input file
+        workers: Number of worker processes
+        chunk_size: Number of rows per chunk sent to a worker
+        ordered: Yield results in input order; otherwise yield chunks as soon as they complete
+
+    Yields:
+        Every input row with its hash_entry result.
+    """
+    chunks = _read_chunks(rows, chunk_size)
+    max_in_flight = workers * 2
+    cache_size, cache_policy = (phone_cache.max_size, phone_cache.policy) if phone_cache is not None else (0, "lru")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            debug_mode,
+            cache_size,
+            cache_policy,
+            metrics is not None,
+            (digester.algorithm, digester.digest_size, digester.key),
+            personal_info_sketches,
+        ),
+    ) as executor:
+        pending: Deque[Future] = deque()
+        in_flight: Dict[Future, List[List[str]]] = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                future = executor.submit(_hash_chunk, chunk, projector)
+                pending.append(future)
+                in_flight[future] = chunk
+            if not in_flight:
+                return
+
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done = list(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            for future in done:
+                chunk = in_flight.pop(future)
+                results, chunk_warnings, chunk_cache_stats, chunk_metrics = future.result()
+                for key, count in chunk_warnings.items():
+                    phone_warnings[key] += count
+                if phone_cache is not None:
+                    phone_cache.hits += chunk_cache_stats["hits"]
+                    phone_cache.misses += chunk_cache_stats["misses"]
+                    phone_cache.evictions += chunk_cache_stats["evictions"]
+                if metrics is not None and chunk_metrics is not None:
+                    metrics.merge(chunk_metrics)
+                yield from zip(chunk, results)
+
+
+def hashing_fingerprint() -> str:
+    """
+    Return a fingerprint of everything the hashed output of a row depends on besides its input fields: the
+    normalization and hashing code of this module and of digest_algorithms, the phonenumbers metadata, the
+    digest parameters, including the identifier of the digest key, and whether personal info sketches are added.
+    """
+    source = b""
+    for module_file in (__file__, digest_algorithms.__file__):
+        with open(module_file, "rb") as file:
+            source += file.read()
+    algorithm, digest_size, key_id = digester.parameters
+    configuration = f"{phonenumbers.__version__}|{algorithm}|{digest_size}|{key_id}|{personal_info_sketches}"
+    if personal_info_sketches:
+        with open(approximate_match.__file__, "rb") as file:
+            source += file.read()
+    return hashlib.sha256(source + b"\0" + configuration.encode("utf-8")).hexdigest()
+
+
+def _phone_reasons(fields: Sequence[str], bad_phone_records: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """Return the standardization failure reason of each phone field of a hashed row, None for a valid phone."""
+    reasons = {record["PhoneFieldLabel"]: record["ReasonForFailure"] for record in bad_phone_records}
+    return [
+        reasons.get(label, None if phone else "Blank phone number")
+        for label, phone in zip(PHONE_LABELS, fields[PHONE_FIELDS])
     ]
 
-    processed_phones = {}
-    for phone_label, column_variants in phone_fields_to_process:
-        original_phone_value = get_column_value(column_variants)
-        std_phone, reason = standardize_phone_number(original_phone_value, pseudonym, phone_label)
-        processed_phones[phone_label] = std_phone
-        if reason and reason != "Blank phone number":
-            bad_record_detail = {
-                "Pseudonym": pseudonym,
-                "OriginalPhoneInput": original_phone_value,
-                "PhoneFieldLabel": phone_label,
-                "ReasonForFailure": reason,
+
+def _cached_result(row: Sequence[str], fields: Sequence[str], cached: CachedRow, projector: RowProjector) -> HashResult:
+    """Rebuild the hash_entry result of a row from the row cache, counting its phones as hash_entry would."""
+    digests, reasons = cached
+    pseudonym = fields[0]
+    bad_phone_records = []
+    for phone_label, phone, reason in zip(PHONE_LABELS, fields[PHONE_FIELDS], reasons):
+        if reason is None:
+            phone_warnings[f"{phone_label}_success"] += 1
+        elif reason == "Blank phone number":
+            phone_warnings[f"{phone_label}_blank"] += 1
+        else:
+            phone_warnings[f"{phone_label}_invalid"] += 1
+            bad_phone_records.append(_bad_phone_record(row, projector, pseudonym, phone, phone_label, reason))
+    return (pseudonym, digests), bad_phone_records
+
+
+def _hash_rows_cached(
+    rows: Iterable[List[str]],
+    projector: RowProjector,
+    row_cache: RowCache,
+    hash_rows: Callable[[Iterable[List[str]]], Iterator[Tuple[List[str], HashResult]]],
+    batch_size: int,
+) -> Iterator[HashResult]:
+    """
+    Yield the hash_entry results of rows, reusing the results of unchanged rows from the row cache.
+
+    Rows are looked up in the cache a batch at a time. Only the rows the cache does not hold are passed to
+    hash_rows, and their results are added to the cache. Results are yielded in input order when hash_rows
+    keeps the order of its input.
+
+    Args:
+        rows: The input rows
+        projector: The projector built from the header of the input file
+        row_cache: The row cache
+        hash_rows: Hashes an iterable of rows, yielding every row with its hash_entry result
+        batch_size: Number of rows looked up in, and added to, the cache at a time
+    """
+    # One entry per input row not yet yielded: its result, or None while it is being hashed
+    pending: Deque[Optional[HashResult]] = deque()
+
+    def uncached_rows() -> Iterator[List[str]]:
+        for batch in _read_chunks(rows, batch_size):
+            batch_fields = [projector.project(row) for row in batch]
+            keys = [row_cache_key(fields) for fields in batch_fields]
+            cached_rows = row_cache.lookup(keys)
+            for row, fields, key in zip(batch, batch_fields, keys):
+                if not fields[0]:
+                    pending.append((None, []))
+                elif key in cached_rows:
+                    pending.append(_cached_result(row, fields, cached_rows[key], projector))
+                    row_cache.reused += 1
+                else:
+                    pending.append(None)
+                    yield row
+
+    new_entries: List[Tuple[bytes, CachedRow]] = []
+    for row, result in hash_rows(uncached_rows()):
+        # Yield the cached results before this row, up to its own placeholder
+        pending_result = pending.popleft()
+        while pending_result is not None:
+            yield pending_result
+            pending_result = pending.popleft()
+        row_cache.computed += 1
+        hashed_row, bad_phone_records = result
+        if hashed_row is not None:
+            fields = projector.project(row)
+            new_entries.append((row_cache_key(fields), (hashed_row[1], _phone_reasons(fields, bad_phone_records))))
+            if len(new_entries) >= batch_size:
+                row_cache.store(new_entries)
+                new_entries = []
+        yield result
+    row_cache.store(new_entries)
+    # Every row passed to hash_rows has been hashed, so only cached results are left
+    for pending_result in pending:
+        assert pending_result is not None
+        yield pending_result
+
+
+BAD_RECORD_COLUMNS = ["Pseudonym", "OriginalPhoneInput", "PhoneFieldLabel", "ReasonForFailure"]
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def _write_results(
+    batch: List[HashResult],
+    writer: HashedWriter,
+    bad_records_writer: Optional[Any],
+    original_fieldnames: List[str],
+) -> None:
+    """Write hashed rows to the output and the details of their bad phone numbers to the bad records file."""
+    for hashed_row, bad_phone_details_list in batch:
+        # Batches only hold the results of hashed rows; rows with a blank pseudonym are skipped before
+        assert hashed_row is not None
+        writer.write_row(*hashed_row)
+        if bad_records_writer and bad_phone_details_list:
+            for bad_detail in bad_phone_details_list:
+                # Construct the row for the bad records file carefully based on the bad records header
+                # The first few fields are from bad_detail, the rest are from the original row
+                # (which is already in bad_detail)
+                record_to_write = [bad_detail.get(column, "") for column in BAD_RECORD_COLUMNS]
+                for fieldname in original_fieldnames:
+                    record_to_write.append(bad_detail.get(fieldname, ""))
+                bad_records_writer.writerow(record_to_write)
+
+
+class _DirectOutput:
+    """Writes the hashed output and the bad records file of a run directly to their files."""
+
+    def __init__(
+        self,
+        output_file: str,
+        output_format: str,
+        bad_records_file: Optional[str],
+        original_fieldnames: List[str],
+    ) -> None:
+        self.original_fieldnames = original_fieldnames
+        self.bad_records_csvfile: Optional[IO[str]] = None
+        self.bad_records_writer: Optional[Any] = None
+        self.writer: Optional[HashedWriter] = open_hashed_writer(
+            output_file, output_format, output_columns(), *digester.parameters
+        )
+        if bad_records_file and original_fieldnames:
+            self.bad_records_csvfile = open_text(bad_records_file, "w")
+            self.bad_records_writer = csv.writer(self.bad_records_csvfile)
+            self.bad_records_writer.writerow(BAD_RECORD_COLUMNS + original_fieldnames)
+
+    def write(self, batch: List[HashResult], progress: Optional[Dict[str, Any]] = None) -> None:
+        """Write a batch of results."""
+        assert self.writer is not None
+        _write_results(batch, self.writer, self.bad_records_writer, self.original_fieldnames)
+
+    def finish(self) -> None:
+        """Close the output files."""
+        self.close()
+
+    def close(self) -> None:
+        """Close the output files, if still open."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.bad_records_csvfile is not None:
+            self.bad_records_csvfile.close()
+            self.bad_records_csvfile = None
+
+
+def _save_json(path: str, data: Dict[str, Any]) -> None:
+    """Replace a JSON file atomically."""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
+    os.replace(temporary_path, path)
+
+
+class _SegmentedOutput:
+    """
+    Writes the hashed output and the bad records file of a resumable run as numbered segments in a parts
+    directory, and records a checkpoint after every complete segment.
+
+    A segment is written under a temporary name and renamed once complete; only then is checkpoint.json
+    replaced, so the checkpoint never refers to an incomplete segment. Only the first segment of a CSV file
+    has the header, so the finished run concatenates the segments byte for byte (compressed segments are
+    self-contained gzip members or zstd frames) into the final files, which replace any older ones at once.
+    """
+
+    def __init__(
+        self,
+        parts_dir: str,
+        output_file: str,
+        output_format: str,
+        bad_records_file: Optional[str],
+        original_fieldnames: List[str],
+        run: Dict[str, Any],
+        segment: int,
+    ) -> None:
+        self.parts_dir = parts_dir
+        self.output_file = output_file
+        self.output_format = output_format
+        self.bad_records_file = bad_records_file if bad_records_file and original_fieldnames else None
+        self.original_fieldnames = original_fieldnames
+        self.run = run
+        self.segment = segment
+        self.writer: Optional[HashedWriter] = None
+        self.bad_records_csvfile: Optional[IO[str]] = None
+        self.bad_records_writer: Optional[Any] = None
+        os.makedirs(parts_dir, exist_ok=True)
+        self._open_segment()
+
+    def _path(self, file_path: str, segment: int, complete: bool = True) -> str:
+        # Segments keep the name of their file, so CSV segments are compressed like it
+        state = "" if complete else ".partial"
+        return os.path.join(self.parts_dir, f"{segment:06d}{state}.{os.path.basename(file_path)}")
+
+    def _open_segment(self) -> None:
+        path = self._path(self.output_file, self.segment, complete=False)
+        if self.output_format == "csv":
+            self.writer = HashedCsvWriter(path, output_columns(), self.segment == 0, *digester.parameters)
+        else:
+            self.writer = open_hashed_writer(path, self.output_format, output_columns(), *digester.parameters)
+        if self.bad_records_file:
+            self.bad_records_csvfile = open_text(self._path(self.bad_records_file, self.segment, complete=False), "w")
+            self.bad_records_writer = csv.writer(self.bad_records_csvfile)
+            if self.segment == 0:
+                self.bad_records_writer.writerow(BAD_RECORD_COLUMNS + self.original_fieldnames)
+
+    def _complete_segment(self) -> None:
+        self.close()
+        for file_path in (self.output_file, self.bad_records_file):
+            if file_path:
+                os.replace(self._path(file_path, self.segment, complete=False), self._path(file_path, self.segment))
+
+    def write(self, batch: List[HashResult], progress: Optional[Dict[str, Any]] = None) -> None:
+        """Write a batch of results; with the progress of the run after it, complete the segment there."""
+        assert self.writer is not None
+        _write_results(batch, self.writer, self.bad_records_writer, self.original_fieldnames)
+        if progress is not None:
+            self._complete_segment()
+            self.segment += 1
+            checkpoint = {
+                "version": CHECKPOINT_VERSION,
+                "run": self.run,
+                "segments": self.segment,
+                "progress": progress,
             }
-            # Add all original row data to the bad record for full context
-            bad_record_detail.update(row)
-            bad_phone_records.append(bad_record_detail)
+            _save_json(os.path.join(self.parts_dir, CHECKPOINT_FILE), checkpoint)
+            self._open_segment()
 
-    email = get_column_value(columns["md_us_email"])
-    personal_info_concat = f"{u_city}{u_state}{u_name}{u_firstname}"
+    def finish(self) -> None:
+        """Complete the last segment, assemble the final files and remove the parts directory."""
+        self._complete_segment()
+        segments = range(self.segment + 1)
+        for file_path in (self.output_file, self.bad_records_file):
+            if not file_path:
+                continue
+            paths = [self._path(file_path, segment) for segment in segments]
+            temporary_file = file_path + ".partial"
+            if file_path == self.output_file and self.output_format == "binary":
+                concatenate_binary_files(paths, temporary_file)
+            else:
+                with open(temporary_file, "wb") as output:
+                    for path in paths:
+                        with open(path, "rb") as part:
+                            shutil.copyfileobj(part, output, 1 << 20)
+                if file_path == self.output_file:
+                    write_digest_manifest(self.output_file, digester.parameters)
+            os.replace(temporary_file, file_path)
+        shutil.rmtree(self.parts_dir)
 
-    hashed_row = [pseudonym]
-    for value in [
-        processed_phones["md_us_phone_1"],
-        processed_phones["md_us_phone_2"],
-        processed_phones["md_us_phone_3"],
-        personal_info_concat,
-        email,
-    ]:
-        if value:
-            hashed_row.append(hashlib.sha256(value.encode("utf-8")).hexdigest())
+    def close(self) -> None:
+        """Close the files of the current segment, if still open, leaving it incomplete."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.bad_records_csvfile is not None:
+            self.bad_records_csvfile.close()
+            self.bad_records_csvfile = None
+
+
+def checkpoint_dir(output_file: str) -> str:
+    """Return the parts directory holding the segments and checkpoint of a resumable run."""
+    return output_file + ".parts"
+
+
+def _load_checkpoint(parts_dir: str) -> Optional[Dict[str, Any]]:
+    """Return the checkpoint saved in a parts directory, or None if there is none."""
+    try:
+        with open(os.path.join(parts_dir, CHECKPOINT_FILE), encoding="utf-8") as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return None
+    return checkpoint if checkpoint.get("version") == CHECKPOINT_VERSION else None
+
+
+def _phone_outcomes(hashed_row: HashedRow, bad_phone_records: List[Dict[str, Any]]) -> Iterator[str]:
+    """Yield the phone_warnings key that hashing counted for every phone field of a hashed row."""
+    invalid_labels = {record["PhoneFieldLabel"] for record in bad_phone_records}
+    for phone_label, digest in zip(PHONE_LABELS, hashed_row[1]):
+        if digest:
+            yield f"{phone_label}_success"
+        elif phone_label in invalid_labels:
+            yield f"{phone_label}_invalid"
         else:
-            hashed_row.append("")
+            yield f"{phone_label}_blank"
+
+
+def iter_hashed_input(input_file: str, workers: int = 1, chunk_size: int = 10000) -> Generator[HashedRow, None, None]:
+    """
+    Hash an input file and stream the pseudonym and raw digests of every row, in input order, for callers
+    that use the hashed rows directly instead of writing a hashed file.
+
+    Rows are hashed as hash_dataset hashes them, with the columns of output_columns(); rows with a blank
+    pseudonym are skipped. The phone_warnings counts, the phone cache statistics and the metrics are kept
+    up to date.
+
+    Args:
+        input_file: Path to the input CSV file
+        workers: Number of worker processes used for hashing (1 hashes in the current process)
+        chunk_size: Number of rows per chunk sent to a worker process
+
+    Raises:
+        ValueError: If a required column is missing from the input file header.
+    """
+    csvfile = open_text(input_file, encoding="latin-1")
+    reader = csv.reader(csvfile)
+    fieldnames: List[str] = next(reader, [])
+    try:
+        projector = RowProjector(fieldnames) if fieldnames else None
+    except ValueError:
+        csvfile.close()
+        raise
+
+    def hashed_rows() -> Generator[HashedRow, None, None]:
+        with csvfile:
+            if projector is None:
+                return
+            # Blank lines are skipped, as csv.DictReader does
+            rows: Iterable[List[str]] = (row for row in reader if row)
+            if metrics is not None:
+                rows = metrics.timed_iter("read", rows)
+            results: Iterable[HashResult]
+            if workers > 1:
+                results = (result for _, result in _hash_rows_parallel(rows, projector, workers, chunk_size))
+            else:
+                results = (hash_entry(row, projector) for row in rows)
+            for hashed_row, _ in results:
+                if hashed_row is not None:
+                    yield hashed_row
 
-    return hashed_row, bad_phone_records
+    return hashed_rows()
 
 
-def hash_dataset(input_file: str, output_file: str, bad_records_file: Optional[str] = None) -> None:
+def hash_dataset(
+    input_file: str,
+    output_file: str,
+    bad_records_file: Optional[str] = None,
+    workers: int = 1,
+    chunk_size: int = 10000,
+    ordered: bool = True,
+    output_format: str = "csv",
+    row_cache_file: Optional[str] = None,
+    pipeline: bool = False,
+    queue_size: int = 4,
+    checkpoint_rows: Optional[int] = None,
+    resume: bool = False,
+) -> None:
     """
     Process the input file and generate a hashed output file.
     Optionally, write records with bad phone numbers to a separate CSV file.
 
+    With more than one worker, rows are hashed in chunks by a process pool. In ordered mode the
+    output, the bad records file and the summary are identical to a serial run. In pipelined mode,
+    reading and parsing the input and writing the output run in their own threads, fed through bounded
+    queues, so reading, hashing and writing overlap. Compressed input is read directly, and output
+    files named .gz or .zst are compressed (see compressed_io).
+
+    With checkpoints, the output is written in segments of checkpoint_rows input rows, and after every
+    segment the input offset, the row counts and the phone_warnings counts are saved (see
+    _SegmentedOutput). A run that stops can then be resumed from its last checkpoint, with the same
+    final output as an uninterrupted run; the output files only appear once the run completes.
+
     Args:
         input_file: Path to the input CSV file
-        output_file: Path to the output CSV file
+        output_file: Path to the output hashed file
         bad_records_file: Optional path for a CSV file to store records with bad phone numbers
+        workers: Number of worker processes used for hashing (1 hashes in the current process)
+        chunk_size: Number of rows per chunk sent to a worker process
+        ordered: Write output in input order; otherwise write chunks in the order they complete
+        output_format: Format of the output hashed file, "csv" (hex digests) or "binary"
+        row_cache_file: Optional path of an SQLite row cache kept across runs; rows whose input fields
+            are in the cache are not re-hashed, and the results of the other rows are added to it
+        pipeline: Read the input and write the output in background threads
+        queue_size: Number of chunks that may wait between two pipeline stages before the faster stage
+            blocks
+        checkpoint_rows: Optional number of input rows between checkpoints
+        resume: Continue from the checkpoint of an earlier run with the same input and options, if any
+
+    Raises:
+        ValueError: If a required column is missing from the input file header, or the checkpoint to
+            resume from was made for another input or other options.
     """
-    bad_records_writer = None
-    bad_records_csvfile = None
+    if checkpoint_rows and not ordered:
+        raise ValueError("Checkpoints need output in input order")
+    row_cache = None
+    output: Union[_DirectOutput, _SegmentedOutput, None] = None
+
+    # Resolve the columns before any output is created, so a missing required column fails fast.
     # Keep track of original fieldnames for the bad records file
-    original_fieldnames: List[str] = []
+    with open_text(input_file, encoding="latin-1") as csvfile:
+        original_fieldnames: List[str] = next(csv.reader(csvfile), [])
+    projector = RowProjector(original_fieldnames) if original_fieldnames else None
+
+    progress: Dict[str, Any] = {
+        "input_offset": 0,
+        "total_rows": 0,
+        "skipped_rows": 0,
+        "hashed_rows": 0,
+        "bad_phone_entries_written": 0,
+        "phone_warnings": dict(phone_warnings),
+    }
+    segment = 0
+    if checkpoint_rows:
+        parts_dir = checkpoint_dir(output_file)
+        input_stat = os.stat(input_file)
+        run = {
+            "input_file": os.path.abspath(input_file),
+            "input_size": input_stat.st_size,
+            "input_mtime_ns": input_stat.st_mtime_ns,
+            "output_format": output_format,
+            "bad_records_file": bool(bad_records_file),
+            "checkpoint_rows": checkpoint_rows,
+            "fingerprint": hashing_fingerprint(),
+        }
+        checkpoint = _load_checkpoint(parts_dir) if resume else None
+        if checkpoint is not None:
+            if checkpoint["run"] != run:
+                raise ValueError(
+                    f"The checkpoint in {parts_dir} was made for another input file, other options or other "
+                    "hashing code; run without --resume to start over"
+                )
+            progress = checkpoint["progress"]
+            segment = checkpoint["segments"]
+            phone_warnings.update(progress["phone_warnings"])
+            print(f"Resuming from the checkpoint after row {progress['total_rows']} of {input_file}")
+        else:
+            if resume:
+                print(f"No checkpoint to resume from in {parts_dir}; starting from the beginning")
+            elif os.path.isdir(parts_dir):
+                print(f"Discarding the segments of an earlier run in {parts_dir}; use --resume to continue it")
+            shutil.rmtree(parts_dir, ignore_errors=True)
 
     try:
-        with open(input_file, newline="", encoding="latin-1") as csvfile, open(
-            output_file, "w", newline="", encoding="utf-8"
-        ) as outfile:
-            reader = csv.DictReader(csvfile)
-            writer = csv.writer(outfile)
-
-            original_fieldnames = list(reader.fieldnames) if reader.fieldnames else []
-
-            if bad_records_file and original_fieldnames:
-                bad_records_csvfile = open(bad_records_file, "w", newline="", encoding="utf-8")
-                bad_records_writer = csv.writer(bad_records_csvfile)
-                header_row_bad_records = [
-                    "Pseudonym",
-                    "OriginalPhoneInput",
-                    "PhoneFieldLabel",
-                    "ReasonForFailure",
-                ] + original_fieldnames
-                bad_records_writer.writerow(header_row_bad_records)
-
-            writer.writerow(
-                [
-                    "Pseudonym",
-                    "Phone Hash 1",
-                    "Phone Hash 2",
-                    "Phone Hash 3",
-                    "Personal Info Hash",
-                    "Email Hash",
-                ]
+        if row_cache_file and projector is not None:
+            row_cache = RowCache(row_cache_file, hashing_fingerprint())
+        input_offset = progress["input_offset"]
+        with open_text(input_file, encoding="latin-1", offset=input_offset) as csvfile:
+            if checkpoint_rows:
+                output = _SegmentedOutput(
+                    parts_dir, output_file, output_format, bad_records_file, original_fieldnames, run, segment
+                )
+            else:
+                output = _DirectOutput(output_file, output_format, bad_records_file, original_fieldnames)
+
+            # Track the input offset after every row, so a checkpoint can record where its rows end;
+            # with latin-1, every character read is one byte of the input
+            position = input_offset
+            boundaries: Deque[Tuple[int, int]] = deque()
+
+            def lines() -> Iterator[str]:
+                nonlocal position
+                for line in csvfile:
+                    position += len(line)
+                    yield line
+
+            reader = csv.reader(lines() if checkpoint_rows else csvfile)
+            if not input_offset:
+                next(reader, None)
+
+            def input_rows() -> Iterator[List[str]]:
+                row_number = progress["total_rows"]
+                # Blank lines are skipped, as csv.DictReader does
+                for row in reader:
+                    if row:
+                        row_number += 1
+                        if checkpoint_rows and row_number % checkpoint_rows == 0:
+                            boundaries.append((row_number, position))
+                        yield row
+
+            rows: Iterable[List[str]] = input_rows()
+            if metrics is not None:
+                rows = metrics.timed_iter("read", rows)
+            if pipeline:
+                rows = itertools.chain.from_iterable(_read_ahead(_read_chunks(rows, chunk_size), queue_size))
+            results: Iterable[HashResult]
+            if projector is None:
+                results = []
+            elif row_cache is not None:
+                if workers > 1:
+                    hash_rows = functools.partial(
+                        _hash_rows_parallel,
+                        projector=projector,
+                        workers=workers,
+                        chunk_size=chunk_size,
+                        ordered=ordered,
+                    )
+                else:
+                    hash_rows = functools.partial(_hash_rows_serial, projector=projector)
+                results = _hash_rows_cached(rows, projector, row_cache, hash_rows, chunk_size)
+            elif workers > 1:
+                results = (result for _, result in _hash_rows_parallel(rows, projector, workers, chunk_size, ordered))
+            else:
+                results = (hash_entry(row, projector) for row in rows)
+
+            def write_output(batch: OutputBatch) -> None:
+                if metrics is None:
+                    output.write(*batch)
+                    return
+                with metrics.stage("write", rows=len(batch[0])):
+                    output.write(*batch)
+
+            writer_stage = _WriterStage(write_output, queue_size) if pipeline else None
+            emit = writer_stage.submit if writer_stage else write_output
+            total_rows, skipped_rows, hashed_rows = (
+                progress["total_rows"],
+                progress["skipped_rows"],
+                progress["hashed_rows"],
             )
-            total_rows, skipped_rows, hashed_rows, bad_phone_entries_written = 0, 0, 0, 0
-            for row in reader:
-                total_rows += 1
-                hashed_row, bad_phone_details_list = hash_entry(row)
-                if hashed_row is None:
-                    skipped_rows += 1
-                    continue
-                writer.writerow(hashed_row)
-                hashed_rows += 1
-
-                if bad_records_writer and bad_phone_details_list:
-                    for bad_detail in bad_phone_details_list:
-                        # Construct the row for the bad records file carefully based on header_row_bad_records
-                        # The first few fields are from bad_detail, the rest are from the original row
-                        # (which is already in bad_detail)
-                        record_to_write = [
-                            bad_detail.get("Pseudonym", ""),
-                            bad_detail.get("OriginalPhoneInput", ""),
-                            bad_detail.get("PhoneFieldLabel", ""),
-                            bad_detail.get("ReasonForFailure", ""),
-                        ]
-                        for fieldname in original_fieldnames:
-                            record_to_write.append(bad_detail.get(fieldname, ""))
-                        bad_records_writer.writerow(record_to_write)
-                        bad_phone_entries_written += 1
+            bad_phone_entries_written = progress["bad_phone_entries_written"]
+            # The phone counts of the rows consumed so far; the module counters of a worker pool run ahead
+            checkpoint_warnings = Counter(progress["phone_warnings"])
+            try:
+                batch: List[HashResult] = []
+                for result in results:
+                    total_rows += 1
+                    hashed_row, bad_phone_details_list = result
+                    if hashed_row is None:
+                        skipped_rows += 1
+                    else:
+                        hashed_rows += 1
+                        if bad_records_file and original_fieldnames:
+                            bad_phone_entries_written += len(bad_phone_details_list)
+                        batch.append(result)
+                        if checkpoint_rows:
+                            checkpoint_warnings.update(_phone_outcomes(hashed_row, bad_phone_details_list))
+                    if checkpoint_rows and total_rows % checkpoint_rows == 0:
+                        while boundaries[0][0] < total_rows:
+                            boundaries.popleft()
+                        snapshot = {
+                            "input_offset": boundaries.popleft()[1],
+                            "total_rows": total_rows,
+                            "skipped_rows": skipped_rows,
+                            "hashed_rows": hashed_rows,
+                            "bad_phone_entries_written": bad_phone_entries_written,
+                            "phone_warnings": dict(checkpoint_warnings),
+                        }
+                        emit((batch, snapshot))
+                        batch = []
+                    elif len(batch) >= chunk_size:
+                        emit((batch, None))
+                        batch = []
+                if batch:
+                    emit((batch, None))
+            finally:
+                if writer_stage:
+                    writer_stage.close()
+            if metrics is not None:
+                with metrics.stage("finish"):
+                    output.finish()
+            else:
+                output.finish()
 
             print(f"Input file: {input_file}")
             print(f"Output file: {output_file}")
+            print(f"Digests: {digester.parameters.describe()}")
+            if personal_info_sketches:
+                print(f"Personal info sketches: {len(SKETCH_COLUMNS) * digester.digest_size} MinHash values per row")
             if bad_records_file:
                 print(f"Bad records file: {bad_records_file}")
                 print(f"Total bad phone entries written: {bad_phone_entries_written}")
+            if workers > 1:
+                print(f"Worker processes: {workers} ({'ordered' if ordered else 'unordered'} output)")
+            if pipeline:
+                print(f"Pipeline: reader and writer threads, up to {queue_size} chunks of {chunk_size} rows queued")
+            if checkpoint_rows:
+                print(f"Checkpoints: every {checkpoint_rows} rows")
             print(f"Total rows processed: {total_rows}")
             print(f"Rows hashed and written to output: {hashed_rows}")
             print(f"Rows skipped due to blank pseudonym: {skipped_rows}")
             print("Phone number processing summary:")
             for key, count in phone_warnings.items():
                 print(f"- {key.replace('_', ' ').title()}: {count}")
+            if row_cache is not None:
+                if row_cache.invalidated:
+                    print("Row cache invalidated: the normalization code or hashing configuration changed")
+                print(
+                    f"Row cache ({row_cache_file}): {row_cache.reused} rows reused, "
+                    f"{row_cache.computed} rows recomputed"
+                )
+            if metrics is not None:
+                metrics.rows = total_rows
+                metrics.count("total_rows", total_rows)
+                metrics.count("hashed_rows", hashed_rows)
+                metrics.count("skipped_rows", skipped_rows)
+                metrics.count("bad_phone_entries_written", bad_phone_entries_written)
+                metrics.count("phone_warnings", dict(phone_warnings))
+                if phone_cache is not None:
+                    metrics.count("phone_cache", phone_cache.stats())
+                if row_cache is not None:
+                    metrics.count("row_cache", {"reused": row_cache.reused, "computed": row_cache.computed})
+            if phone_cache is not None:
+                lookups = phone_cache.hits + phone_cache.misses
+                hit_rate = phone_cache.hits / lookups if lookups else 0.0
+                print(
+                    f"Phone cache ({phone_cache.policy}, max {phone_cache.max_size} entries): "
+                    f"{phone_cache.hits} hits, {phone_cache.misses} misses ({hit_rate:.1%} hit rate), "
+                    f"{phone_cache.evictions} evictions"
+                )
     finally:
-        if bad_records_csvfile:
-            bad_records_csvfile.close()
+        if output is not None:
+            output.close()
+        if row_cache is not None:
+            row_cache.close()
+
+
+def add_digest_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line arguments of the digest configuration and the personal info sketches."""
+    parser.add_argument(
+        "--digest-algorithm",
+        choices=DIGEST_ALGORITHMS,
+        default=DEFAULT_ALGORITHM,
+        help="Digest algorithm: sha256 (HMAC-SHA256 with a key) or blake2b (keyed BLAKE2b with a key) "
+        f"(default: {DEFAULT_ALGORITHM})",
+    )
+    parser.add_argument(
+        "--digest-size",
+        type=int,
+        default=DEFAULT_DIGEST_SIZE,
+        help=f"Digest length in bytes, 8 to 32 for sha256 and 8 to 64 for blake2b (default: {DEFAULT_DIGEST_SIZE})",
+    )
+    parser.add_argument(
+        "--digest-key-file",
+        type=str,
+        help="File holding a secret hex key of 16 to 64 bytes to key the digests with; both datasets must be "
+        "hashed with the same key to be matched",
+    )
+    parser.add_argument(
+        "--personal-info-sketches",
+        action="store_true",
+        help="Add MinHash sketches of the personal info components, so match_hashes.py can also match personal "
+        "info approximately, despite typos or abbreviations",
+    )
+
+
+def configure_digest_from_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Configure the digests from the arguments added by add_digest_arguments."""
+    try:
+        key = read_digest_key(args.digest_key_file) if args.digest_key_file else b""
+        configure_digest(args.digest_algorithm, args.digest_size, key)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
 
 
 def main():
     """Main entry point for the script."""
-    global debug_mode
+    global debug_mode, metrics, personal_info_sketches
     parser = argparse.ArgumentParser(
         description="Hash a dataset for privacy-preserving comparison, keeping pseudonyms clear."
     )
-    parser.add_argument("--input-file", type=str, required=True, help="Path to the input CSV file")
-    parser.add_argument("--output-file", type=str, required=True, help="Path for the output CSV file with hashes")
+    parser.add_argument(
+        "--input-file", type=str, required=True, help="Path to the input CSV file, optionally gzip or zstd compressed"
+    )
+    parser.add_argument(
+        "--output-file",
+        type=str,
+        required=True,
+        help="Path for the output file with hashes; CSV output named .gz or .zst is compressed",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default="csv",
+        help="Format of the output file: csv with hex digests, or the compact binary format (default: csv)",
+    )
     parser.add_argument(
         "--bad-records-file",
         type=str,
         required=False,
         help="Optional path for CSV file to store records with bad phone numbers",
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes used for hashing (default: 1)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="Rows per chunk sent to a worker process (default: 10000)"
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="With --workers, write chunks as they complete instead of in input order",
+    )
+    parser.add_argument(
+        "--phone-cache-size",
+        type=int,
+        default=100000,
+        help="Maximum number of distinct raw phone strings cached per process, 0 to disable (default: 100000)",
+    )
+    parser.add_argument(
+        "--phone-cache-policy",
+        choices=PhoneCache.POLICIES,
+        default="lru",
+        help="Phone cache eviction policy (default: lru)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read the input and write the output in background threads, overlapping I/O with hashing",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="With --pipeline, chunks of --chunk-size rows that may wait between two stages (default: 4)",
+    )
+    parser.add_argument(
+        "--row-cache",
+        type=str,
+        help="SQLite file caching the hashed output of every row across runs; rows whose input is unchanged "
+        "are not re-hashed. Entries are dropped when the normalization code or hashing configuration changes",
+    )
+    parser.add_argument(
+        "--checkpoint-rows",
+        type=int,
+        help="Write the output in segments and save a checkpoint every this many input rows, so an "
+        "interrupted run can be resumed; the output files only appear once the run completes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --checkpoint-rows, continue from the last checkpoint of an interrupted run with the same "
+        "input and options",
+    )
+    add_digest_arguments(parser)
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Write performance metrics as JSON to this file: wall and CPU time and rows/sec of every stage "
+        "(read, normalize, phone parse, digest, write), peak memory and phone parse latency histograms",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the run with cProfile and write the stats to this file (the main thread only)",
+    )
     parser.add_argument("--debug", action="store_true", help="Enable debug output")
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if args.phone_cache_size < 0:
+        parser.error("--phone-cache-size must not be negative")
+    if args.checkpoint_rows is not None and args.checkpoint_rows < 1:
+        parser.error("--checkpoint-rows must be at least 1")
+    if args.resume and not args.checkpoint_rows:
+        parser.error("--resume requires --checkpoint-rows")
+    if args.checkpoint_rows and args.unordered:
+        parser.error("--checkpoint-rows cannot be combined with --unordered")
+
+    configure_digest_from_arguments(parser, args)
 
     debug_mode = args.debug
-    hash_dataset(args.input_file, args.output_file, args.bad_records_file)
+    personal_info_sketches = args.personal_info_sketches
+    if args.metrics_file:
+        metrics = Metrics("hash_datasets")
+    configure_phone_cache(args.phone_cache_size, args.phone_cache_policy)
+    try:
+        with profiled(args.profile):
+            hash_dataset(
+                args.input_file,
+                args.output_file,
+                args.bad_records_file,
+                workers=args.workers,
+                chunk_size=args.chunk_size,
+                ordered=not args.unordered,
+                output_format=args.output_format,
+                row_cache_file=args.row_cache,
+                pipeline=args.pipeline,
+                queue_size=args.queue_size,
+                checkpoint_rows=args.checkpoint_rows,
+                resume=args.resume,
+            )
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    if metrics is not None:
+        metrics.write_json(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
 
 
 if __name__ == "__main__":
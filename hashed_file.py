@@ -0,0 +1,692 @@
+import argparse
+import csv
+import itertools
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import IO, Any, Dict, Generator, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from compressed_io import compression_of, open_text
+
+PHONE_COLUMNS = ["Phone Hash 1", "Phone Hash 2", "Phone Hash 3"]
+HASH_COLUMNS = [*PHONE_COLUMNS, "Personal Info Hash", "Email Hash"]
+# Optional columns holding the personal info sketch used for approximate matching (see approximate_match)
+SKETCH_COLUMNS = [f"Personal Info Sketch {number}" for number in range(1, 5)]
+PSEUDONYM_COLUMN = "Pseudonym"
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_DIGEST_SIZE = 32
+# A CSV hashed file records its digest parameters in a JSON file named after it with this suffix; a CSV file
+# without one was made with the unkeyed default algorithm
+DIGEST_MANIFEST_SUFFIX = ".digest.json"
+
+# Binary layout: MAGIC, then a JSON header padded with spaces to HEADER_SIZE bytes, then one fixed-width record
+# per row (one digest per hash column followed by the little-endian uint64 end offset of the row's pseudonym
+# in the string table), then the string table holding the UTF-8 pseudonyms back to back. Missing digests are
+# stored as all-zero bytes.
+MAGIC = b"PSIHASH\x00"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096
+_OFFSET = struct.Struct("<Q")
+
+HashedRow = Tuple[str, List[bytes]]
+
+
+class DigestParameters(NamedTuple):
+    """
+    How the digests of a hashed dataset were computed. Digests made with different parameters never match,
+    so datasets can only be matched if these are equal.
+    """
+
+    algorithm: str = DEFAULT_ALGORITHM
+    digest_size: int = DEFAULT_DIGEST_SIZE
+    # Public identifier of the digest key (see digest_algorithms.key_id), or None for unkeyed digests
+    key_id: Optional[str] = None
+
+    def describe(self) -> str:
+        """Return a readable description, such as "blake2b, 16 bytes, key 1f2e3d4c5b6a7988"."""
+        key = f"key {self.key_id}" if self.key_id else "unkeyed"
+        return f"{self.algorithm}, {self.digest_size} bytes, {key}"
+
+
+def require_same_digests(datasets: Sequence[Tuple[str, DigestParameters]]) -> None:
+    """
+    Check that named datasets were hashed with the same digest parameters.
+
+    Raises:
+        ValueError: If any dataset was hashed with other parameters than the first, so no digest of one
+            could ever match a digest of the other.
+    """
+    first_name, first = datasets[0]
+    for name, parameters in datasets[1:]:
+        if parameters != first:
+            raise ValueError(
+                f"The digests of {name} ({parameters.describe()}) differ from those of {first_name} "
+                f"({first.describe()}); datasets must be hashed with the same digest algorithm, size and key "
+                "to be matched"
+            )
+
+
+def is_binary_hashed_file(file_path: str) -> bool:
+    """Return whether a file is in the binary hashed format."""
+    with open(file_path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class HashedTable:
+    """
+    Read-only, row-indexed view of a hashed dataset.
+
+    Binary hashed files are memory-mapped, so loading them takes no parsing and almost no heap.
+    CSV hashed files are parsed once into the same record layout in memory.
+    """
+
+    def __init__(
+        self,
+        buffer: Union[bytes, bytearray, mmap.mmap],
+        records_offset: int,
+        row_count: int,
+        columns: List[str],
+        algorithm: str = DEFAULT_ALGORITHM,
+        digest_size: int = DEFAULT_DIGEST_SIZE,
+        strings: Union[bytes, bytearray, mmap.mmap, None] = None,
+        strings_offset: int = 0,
+        key_id: Optional[str] = None,
+    ) -> None:
+        self.buffer = buffer
+        self.records_offset = records_offset
+        self.row_count = row_count
+        self.columns = columns
+        self.algorithm = algorithm
+        self.digest_size = digest_size
+        self.key_id = key_id
+        self.record_size = len(columns) * digest_size + _OFFSET.size
+        self.strings = buffer if strings is None else strings
+        self.strings_offset = strings_offset
+        self._empty_digest = bytes(digest_size)
+        self._mmap: Optional[mmap.mmap] = buffer if isinstance(buffer, mmap.mmap) else None
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column_index(self, column: str) -> Optional[int]:
+        """Return the position of a hash column, or None if the dataset does not have it."""
+        return self.columns.index(column) if column in self.columns else None
+
+    def digest(self, column_index: int, row_id: int) -> bytes:
+        """Return the digest of a row in a hash column, or b"" if the row has none."""
+        start = self.records_offset + row_id * self.record_size + column_index * self.digest_size
+        digest = bytes(self.buffer[start : start + self.digest_size])
+        return b"" if digest == self._empty_digest else digest
+
+    def pseudonym(self, row_id: int) -> str:
+        """Return the pseudonym of a row."""
+        end_position = self.records_offset + row_id * self.record_size + self.record_size - _OFFSET.size
+        end = _OFFSET.unpack_from(self.buffer, end_position)[0]
+        start = _OFFSET.unpack_from(self.buffer, end_position - self.record_size)[0] if row_id else 0
+        return bytes(self.strings[self.strings_offset + start : self.strings_offset + end]).decode("utf-8")
+
+    def rows(self) -> Iterator[HashedRow]:
+        """Yield the pseudonym and digests of every row, in file order."""
+        for row_id in range(self.row_count):
+            yield self.pseudonym(row_id), [self.digest(column, row_id) for column in range(len(self.columns))]
+
+    def digest_parameters(self) -> DigestParameters:
+        """Return how the digests of the dataset were computed."""
+        return DigestParameters(self.algorithm, self.digest_size, self.key_id)
+
+    def header(self) -> Dict[str, Any]:
+        """Return the format parameters of the dataset, as stored in a binary header."""
+        header = {
+            "version": FORMAT_VERSION,
+            "algorithm": self.algorithm,
+            "digest_size": self.digest_size,
+            "columns": self.columns,
+            "row_count": self.row_count,
+        }
+        if self.key_id:
+            header["key_id"] = self.key_id
+        return header
+
+    def close(self) -> None:
+        """Release the memory map of a binary hashed file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def _parse_binary_header(file_path: str, data: bytes) -> Dict[str, Any]:
+    """Parse the header at the start of a binary hashed file."""
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{file_path} is not a binary hashed file")
+    header = json.loads(data[len(MAGIC) : HEADER_SIZE].decode("utf-8"))
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"{file_path} uses binary hashed format version {header['version']}, expected {FORMAT_VERSION}"
+        )
+    return header
+
+
+def _read_binary(file_path: str) -> HashedTable:
+    """Memory-map a binary hashed file."""
+    with open(file_path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header = _parse_binary_header(file_path, bytes(buffer[:HEADER_SIZE]))
+    except ValueError:
+        buffer.close()
+        raise
+    return HashedTable(
+        buffer,
+        HEADER_SIZE,
+        header["row_count"],
+        header["columns"],
+        header["algorithm"],
+        header["digest_size"],
+        strings_offset=header["strings_offset"],
+        key_id=header.get("key_id"),
+    )
+
+
+def digest_manifest_path(file_path: str) -> str:
+    """Return the path of the digest manifest of a CSV hashed file."""
+    return file_path + DIGEST_MANIFEST_SUFFIX
+
+
+def write_digest_manifest(file_path: str, parameters: DigestParameters) -> None:
+    """Record the digest parameters of a CSV hashed file in its digest manifest."""
+    with open(digest_manifest_path(file_path), "w", encoding="utf-8") as file:
+        json.dump(parameters._asdict(), file, indent=2)
+        file.write("\n")
+
+
+def _read_digest_manifest(file_path: str) -> Optional[DigestParameters]:
+    """Return the digest parameters recorded for a CSV hashed file, or None if it has no digest manifest."""
+    try:
+        with open(digest_manifest_path(file_path), encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    return DigestParameters(manifest["algorithm"], manifest["digest_size"], manifest.get("key_id"))
+
+
+def read_digest_parameters(file_path: str) -> DigestParameters:
+    """
+    Return how the digests of a hashed file were computed, without loading it.
+
+    Binary files record the parameters in their header, CSV files in their digest manifest. A CSV file
+    without one is taken to be unkeyed SHA-256, with the digest size of its first digest.
+    """
+    if is_binary_hashed_file(file_path):
+        with open(file_path, "rb") as file:
+            header = _parse_binary_header(file_path, file.read(HEADER_SIZE))
+        return DigestParameters(header["algorithm"], header["digest_size"], header.get("key_id"))
+    parameters = _read_digest_manifest(file_path)
+    if parameters is not None:
+        return parameters
+    _, rows = iter_hashed_csv(file_path)
+    try:
+        digest_size = next((len(value) // 2 for _, values in rows for value in values if value), 0)
+    finally:
+        rows.close()
+    return DigestParameters(digest_size=digest_size or DEFAULT_DIGEST_SIZE)
+
+
+def iter_hashed_csv(file_path: str) -> Tuple[List[str], Generator[Tuple[str, List[str]], None, None]]:
+    """
+    Open a hashed CSV file for streaming, decompressing a gzip or zstd file on the fly.
+
+    Args:
+        file_path: Path to the hashed CSV file
+
+    Returns:
+        The hash columns of the file, and an iterator over its rows as the pseudonym and the hex digests
+        of those columns ("" for blank values); the file is closed once the iterator is exhausted
+
+    Raises:
+        ValueError: If the file has no pseudonym column.
+    """
+    csvfile = open_text(file_path)
+    reader = csv.reader(csvfile)
+    fieldnames = next(reader, [])
+    if PSEUDONYM_COLUMN not in fieldnames:
+        csvfile.close()
+        raise ValueError(f"{file_path} has no {PSEUDONYM_COLUMN} column")
+    pseudonym_index = fieldnames.index(PSEUDONYM_COLUMN)
+    columns = [name for name in fieldnames if name in HASH_COLUMNS or name in SKETCH_COLUMNS]
+    column_indices = [fieldnames.index(name) for name in columns]
+
+    def rows() -> Generator[Tuple[str, List[str]], None, None]:
+        with csvfile:
+            for row in reader:
+                if row:
+                    yield row[pseudonym_index], [row[index] if index < len(row) else "" for index in column_indices]
+
+    return columns, rows()
+
+
+def _read_csv(file_path: str) -> HashedTable:
+    """Parse a hashed CSV file into an in-memory HashedTable, with the parameters of its digest manifest."""
+    parameters = _read_digest_manifest(file_path)
+    columns, rows = iter_hashed_csv(file_path)
+    records = bytearray()
+    strings = bytearray()
+    row_count = 0
+    digest_size = parameters.digest_size if parameters is not None else 0
+    for pseudonym, digests in rows:
+        if not digest_size:
+            digest_size = next((len(value) // 2 for value in digests if value), 0)
+        empty = "00" * (digest_size or DEFAULT_DIGEST_SIZE)
+        for value in digests:
+            records += bytes.fromhex(value or empty)
+        strings += pseudonym.encode("utf-8")
+        records += _OFFSET.pack(len(strings))
+        row_count += 1
+
+    if parameters is None:
+        parameters = DigestParameters(digest_size=digest_size or DEFAULT_DIGEST_SIZE)
+    return HashedTable(
+        bytes(records),
+        0,
+        row_count,
+        columns,
+        parameters.algorithm,
+        parameters.digest_size,
+        strings=bytes(strings),
+        key_id=parameters.key_id,
+    )
+
+
+def read_hashed_file(file_path: str) -> HashedTable:
+    """
+    Load a hashed dataset, detecting whether it is a binary or a CSV hashed file.
+
+    Args:
+        file_path: Path to the hashed file
+
+    Returns:
+        The hashed dataset.
+
+    Raises:
+        ValueError: If the file is not a valid hashed file.
+    """
+    if is_binary_hashed_file(file_path):
+        return _read_binary(file_path)
+    return _read_csv(file_path)
+
+
+def iter_hashed_rows(file_path: str) -> Tuple[List[str], Iterator[HashedRow]]:
+    """
+    Stream the rows of a hashed file of either format without loading it.
+
+    Args:
+        file_path: Path to the hashed file
+
+    Returns:
+        The hash columns of the file, and an iterator over its rows as the pseudonym and the raw digests
+        of those columns (b"" for blank values)
+    """
+    if is_binary_hashed_file(file_path):
+        table = _read_binary(file_path)
+
+        def binary_rows() -> Iterator[HashedRow]:
+            try:
+                yield from table.rows()
+            finally:
+                table.close()
+
+        return table.columns, binary_rows()
+
+    columns, csv_rows = iter_hashed_csv(file_path)
+    return columns, ((pseudonym, [bytes.fromhex(value) for value in values]) for pseudonym, values in csv_rows)
+
+
+class HashedCsvWriter:
+    """
+    Writes hashed rows as a CSV file with hex digests.
+
+    With the header row, the digest parameters are recorded in the digest manifest of the file; without
+    it, the file is a piece of a larger file, which records them itself.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        columns: Sequence[str] = HASH_COLUMNS,
+        header: bool = True,
+        algorithm: str = DEFAULT_ALGORITHM,
+        digest_size: int = DEFAULT_DIGEST_SIZE,
+        key_id: Optional[str] = None,
+    ) -> None:
+        self.file: IO[str] = open_text(file_path, "w")
+        self.writer = csv.writer(self.file)
+        if header:
+            write_digest_manifest(file_path, DigestParameters(algorithm, digest_size, key_id))
+            self.writer.writerow([PSEUDONYM_COLUMN, *columns])
+
+    def write_row(self, pseudonym: str, digests: Sequence[bytes]) -> None:
+        """Write one row; empty digests are written as empty cells."""
+        self.writer.writerow([pseudonym, *(digest.hex() for digest in digests)])
+
+    def close(self) -> None:
+        """Close the output file."""
+        self.file.close()
+
+    def __enter__(self) -> "HashedCsvWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def _write_binary_header(
+    file: IO[bytes],
+    columns: List[str],
+    algorithm: str,
+    digest_size: int,
+    row_count: int,
+    strings_offset: int,
+    key_id: Optional[str] = None,
+) -> None:
+    """Write the final header at the start of a binary hashed file; key_id is only recorded for keyed digests."""
+    header = {
+        "version": FORMAT_VERSION,
+        "algorithm": algorithm,
+        "digest_size": digest_size,
+        "columns": columns,
+        "row_count": row_count,
+        "strings_offset": strings_offset,
+    }
+    if key_id:
+        header["key_id"] = key_id
+    encoded_header = MAGIC + json.dumps(header).encode("utf-8")
+    if len(encoded_header) > HEADER_SIZE:
+        raise ValueError("Hashed file header does not fit in the reserved header space")
+    file.seek(0)
+    file.write(encoded_header.ljust(HEADER_SIZE, b" "))
+
+
+class HashedBinaryWriter:
+    """
+    Writes hashed rows in the binary hashed format.
+
+    Records are streamed to the output file; pseudonyms are spooled to a temporary file and appended
+    as the string table on close, when the final header is written.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        columns: Sequence[str] = HASH_COLUMNS,
+        algorithm: str = DEFAULT_ALGORITHM,
+        digest_size: int = DEFAULT_DIGEST_SIZE,
+        key_id: Optional[str] = None,
+    ) -> None:
+        self.columns = list(columns)
+        self.algorithm = algorithm
+        self.digest_size = digest_size
+        self.key_id = key_id
+        self.file: IO[bytes] = open(file_path, "wb")
+        self.file.write(bytes(HEADER_SIZE))
+        self.strings: IO[bytes] = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(file_path)))
+        self.strings_size = 0
+        self.row_count = 0
+        self._empty_digest = bytes(digest_size)
+
+    def write_row(self, pseudonym: str, digests: Sequence[bytes]) -> None:
+        """Write one row; empty digests are stored as all-zero bytes."""
+        encoded = pseudonym.encode("utf-8")
+        self.strings.write(encoded)
+        self.strings_size += len(encoded)
+        for digest in digests:
+            if digest and len(digest) != self.digest_size:
+                raise ValueError(f"Expected {self.digest_size}-byte digests, got {len(digest)} bytes")
+            self.file.write(digest or self._empty_digest)
+        self.file.write(_OFFSET.pack(self.strings_size))
+        self.row_count += 1
+
+    def close(self) -> None:
+        """Append the string table, write the final header and close the output file."""
+        strings_offset = self.file.tell()
+        self.strings.seek(0)
+        while True:
+            block = self.strings.read(1 << 20)
+            if not block:
+                break
+            self.file.write(block)
+        self.strings.close()
+
+        _write_binary_header(
+            self.file, self.columns, self.algorithm, self.digest_size, self.row_count, strings_offset, self.key_id
+        )
+        self.file.close()
+
+    def __enter__(self) -> "HashedBinaryWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class HashedTableBuilder:
+    """
+    Collects hashed rows into an in-memory HashedTable, in the record layout of the binary format.
+
+    It takes the same rows as the writers, so rows hashed in the same process can be matched directly,
+    without writing a hashed file and parsing it back.
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[str] = HASH_COLUMNS,
+        algorithm: str = DEFAULT_ALGORITHM,
+        digest_size: int = DEFAULT_DIGEST_SIZE,
+        key_id: Optional[str] = None,
+    ) -> None:
+        self.columns = list(columns)
+        self.algorithm = algorithm
+        self.digest_size = digest_size
+        self.key_id = key_id
+        self.records = bytearray()
+        self.strings = bytearray()
+        self.row_count = 0
+        self._empty_digest = bytes(digest_size)
+
+    def write_row(self, pseudonym: str, digests: Sequence[bytes]) -> None:
+        """Add one row; empty digests are stored as all-zero bytes."""
+        for digest in digests:
+            if digest and len(digest) != self.digest_size:
+                raise ValueError(f"Expected {self.digest_size}-byte digests, got {len(digest)} bytes")
+            self.records += digest or self._empty_digest
+        self.strings += pseudonym.encode("utf-8")
+        self.records += _OFFSET.pack(len(self.strings))
+        self.row_count += 1
+
+    def table(self) -> HashedTable:
+        """Return the rows added so far as a HashedTable, which shares the buffers of the builder."""
+        return HashedTable(
+            self.records,
+            0,
+            self.row_count,
+            self.columns,
+            self.algorithm,
+            self.digest_size,
+            strings=self.strings,
+            key_id=self.key_id,
+        )
+
+
+HashedWriter = Union[HashedCsvWriter, HashedBinaryWriter]
+OUTPUT_FORMATS = ("csv", "binary")
+
+
+def open_hashed_writer(
+    file_path: str,
+    output_format: str = "csv",
+    columns: Sequence[str] = HASH_COLUMNS,
+    algorithm: str = DEFAULT_ALGORITHM,
+    digest_size: int = DEFAULT_DIGEST_SIZE,
+    key_id: Optional[str] = None,
+) -> HashedWriter:
+    """
+    Open a writer for a hashed file in the given output format ("csv" or "binary").
+
+    CSV files whose name ends in .gz or .zst are compressed; binary files cannot be, since they are
+    memory-mapped for reading. The digest parameters go into the binary header or the CSV digest manifest.
+    """
+    if output_format == "binary":
+        if compression_of(file_path, "w"):
+            raise ValueError(f"Binary hashed files cannot be compressed: {file_path}")
+        return HashedBinaryWriter(file_path, columns, algorithm, digest_size, key_id)
+    if output_format == "csv":
+        return HashedCsvWriter(file_path, columns, True, algorithm, digest_size, key_id)
+    raise ValueError(f"Unknown hashed file format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+
+def csv_to_binary(input_file: str, output_file: str) -> int:
+    """
+    Convert a hashed CSV file to the binary format, streaming it row by row.
+
+    Args:
+        input_file: Path to the hashed CSV file
+        output_file: Path to the binary hashed file to write
+
+    Returns:
+        The number of rows converted.
+    """
+    parameters = _read_digest_manifest(input_file)
+    columns, rows = iter_hashed_csv(input_file)
+    # Without a digest manifest, the digest size is taken from the first non-empty digest, so rows before it
+    # are held back
+    buffered = []
+    if parameters is None:
+        digest_size = 0
+        for pseudonym, values in rows:
+            buffered.append((pseudonym, values))
+            digest_size = next((len(value) // 2 for value in values if value), 0)
+            if digest_size:
+                break
+        parameters = DigestParameters(digest_size=digest_size or DEFAULT_DIGEST_SIZE)
+
+    with HashedBinaryWriter(output_file, columns, *parameters) as writer:
+        for pseudonym, values in itertools.chain(buffered, rows):
+            writer.write_row(pseudonym, [bytes.fromhex(value) for value in values])
+    return writer.row_count
+
+
+def concatenate_binary_files(input_files: Sequence[str], output_file: str, block_rows: int = 65536) -> int:
+    """
+    Concatenate binary hashed files with the same columns and digest format into one, without parsing rows.
+
+    Records are copied a block at a time, with their pseudonym offsets moved past the strings of the files
+    before them, then the string tables are copied back to back.
+
+    Args:
+        input_files: Paths to the binary hashed files, in output order
+        output_file: Path to the binary hashed file to write
+        block_rows: Number of records copied at a time
+
+    Returns:
+        The number of rows written
+
+    Raises:
+        ValueError: If the files differ in columns or digest parameters.
+    """
+    tables = [_read_binary(input_file) for input_file in input_files]
+    try:
+        first = tables[0]
+        for input_file, table in zip(input_files, tables):
+            if (table.columns, table.digest_parameters()) != (first.columns, first.digest_parameters()):
+                raise ValueError(f"{input_file} does not have the columns and digest format of {input_files[0]}")
+        offset_dtype = np.dtype(
+            {
+                "names": ["offset"],
+                "formats": ["<u8"],
+                "offsets": [first.record_size - _OFFSET.size],
+                "itemsize": first.record_size,
+            }
+        )
+        # The end offset of the last pseudonym of a file is the size of its string table
+        non_empty = [table for table in tables if len(table)]
+        string_sizes = [
+            _OFFSET.unpack_from(table.buffer, table.records_offset + len(table) * table.record_size - _OFFSET.size)[0]
+            for table in non_empty
+        ]
+        with open(output_file, "wb") as file:
+            file.write(bytes(HEADER_SIZE))
+            strings_base = 0
+            for table, string_size in zip(non_empty, string_sizes):
+                for start in range(0, len(table), block_rows):
+                    block_start = table.records_offset + start * table.record_size
+                    block_end = table.records_offset + min(start + block_rows, len(table)) * table.record_size
+                    records = bytearray(table.buffer[block_start:block_end])
+                    np.frombuffer(records, dtype=offset_dtype)["offset"] += np.uint64(strings_base)
+                    file.write(records)
+                strings_base += string_size
+            strings_offset = file.tell()
+            for table, string_size in zip(non_empty, string_sizes):
+                file.write(table.strings[table.strings_offset : table.strings_offset + string_size])
+            row_count = sum(len(table) for table in tables)
+            _write_binary_header(
+                file, first.columns, first.algorithm, first.digest_size, row_count, strings_offset, first.key_id
+            )
+    finally:
+        for table in tables:
+            table.close()
+    return row_count
+
+
+def convert_hashed_file(input_file: str, output_file: str, output_format: str) -> int:
+    """
+    Convert a hashed file between the CSV and binary formats.
+
+    Args:
+        input_file: Path to the hashed file to convert
+        output_file: Path to the converted file
+        output_format: Format of the converted file ("csv" or "binary")
+
+    Returns:
+        The number of rows converted.
+    """
+    if output_format == "binary" and not is_binary_hashed_file(input_file):
+        return csv_to_binary(input_file, output_file)
+
+    table = read_hashed_file(input_file)
+    try:
+        with open_hashed_writer(output_file, output_format, table.columns, *table.digest_parameters()) as writer:
+            for pseudonym, digests in table.rows():
+                writer.write_row(pseudonym, digests)
+    finally:
+        table.close()
+    return len(table)
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Convert hashed datasets between the CSV and binary formats.")
+    parser.add_argument("--input-file", type=str, required=True, help="Path to the hashed file to convert")
+    parser.add_argument("--output-file", type=str, required=True, help="Path for the converted hashed file")
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help="Format of the converted file (default: the other format than the input file)",
+    )
+    args = parser.parse_args()
+
+    try:
+        output_format = args.output_format or ("csv" if is_binary_hashed_file(args.input_file) else "binary")
+        row_count = convert_hashed_file(args.input_file, args.output_file, output_format)
+    except FileNotFoundError as e:
+        print(f"File not found: {e.filename}")
+        raise SystemExit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print(f"Converted {row_count} rows from {args.input_file} to {output_format} file {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
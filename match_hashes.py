@@ -1,31 +1,486 @@
 import argparse
 import csv
+import glob
 import itertools
-from typing import Any, Dict, List, Tuple
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
 from tqdm import tqdm
 
+from approximate_match import DEFAULT_BAND_SIZE, approximate_join
+from digest_index import IDENTIFIER_NAMES, IDENTIFIERS, DigestIndex, DigestLookup
+from hashed_file import (
+    HashedRow,
+    HashedTable,
+    iter_hashed_rows,
+    read_digest_parameters,
+    read_hashed_file,
+    require_same_digests,
+)
+from match_index import MatchIndex, is_match_index
+from match_store import MATCH_TYPES, OUTPUT_HEADER, MatchStore, output_header
+from metrics import Metrics, peak_memory_bytes, profiled, stage
+from partitioned_join import parse_memory_size, partitioned_join, spool_hashed_file
+from vectorized_join import (
+    Entries,
+    HotEntries,
+    JoinedPairs,
+    capped_product_join,
+    column_entries,
+    product_join,
+    require_column,
+)
 
-def load_hashes(file_path: str) -> List[Dict[str, str]]:
+# Performance metrics of the run, collected only when set (see metrics.py)
+metrics: Optional[Metrics] = None
+
+
+def _join_stage(match_type: str) -> str:
+    return f"join_{IDENTIFIER_NAMES[match_type].replace(' ', '_')}"
+
+
+def load_hashes(file_path: str, spill_dir: Optional[str] = None) -> Optional[HashedTable]:
     """
-    Load hashed data from a CSV file.
+    Load hashed data from a CSV or binary hashed file.
+
+    Binary hashed files are memory-mapped; CSV files are parsed into the same compact layout, or, when
+    a spill directory is given, streamed into a binary file there and memory-mapped.
 
     Args:
-        file_path: Path to the CSV file containing hashed data
+        file_path: Path to the file containing hashed data
+        spill_dir: Optional directory for a binary copy of a CSV file, so it is never held in memory
 
     Returns:
-        List of dictionaries, each representing a row in the CSV
+        The hashed dataset, or None if the file does not exist
     """
     try:
-        with open(file_path, newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            return [row for row in reader]
+        with stage(metrics, "load") as call:
+            hashes = spool_hashed_file(file_path, spill_dir) if spill_dir else read_hashed_file(file_path)
+            call.rows = len(hashes)
+        if metrics is not None:
+            metrics.rows += len(hashes)
+        return hashes
     except FileNotFoundError:
         print(f"File not found: {file_path}")
-        return []
+        return None
+
+
+def build_indexes(hashes: HashedTable) -> List[DigestIndex]:
+    """
+    Index the digests of every identifier of a dataset, in the order of IDENTIFIERS.
+
+    Raises:
+        ValueError: If the dataset has no email or personal info column.
+    """
+    for column_name in ("Email Hash", "Personal Info Hash"):
+        if hashes.column_index(column_name) is None:
+            raise ValueError(f"Hashed dataset has no {column_name} column")
+    return [DigestIndex.build(hashes, column_names) for _, column_names in IDENTIFIERS]
+
+
+def open_build_side(file_path: str) -> Tuple[Union[HashedTable, MatchIndex], Sequence[DigestLookup]]:
+    """
+    Open the dataset the streaming matcher probes: a saved match index in place, or a hashed file loaded
+    and indexed in memory.
+
+    Raises:
+        ValueError: If the dataset has no email or personal info column.
+    """
+    with stage(metrics, "load") as call:
+        build = MatchIndex(file_path) if is_match_index(file_path) else read_hashed_file(file_path)
+        call.rows = len(build)
+    if metrics is not None:
+        metrics.rows += len(build)
+    if isinstance(build, MatchIndex):
+        return build, build.identifier_indexes()
+    try:
+        with stage(metrics, "index_build", len(build)):
+            return build, build_indexes(build)
+    except ValueError:
+        build.close()
+        raise
+
+
+ENGINES = ("python", "numpy")
+
+
+class FanoutCap:
+    """
+    Caps on the fan-out of a digest: the number of pairs of rows, one from each dataset, that share it.
+
+    A digest shared by many rows on both sides, like a call-center line, a household email or a junk value,
+    pairs every one of them with every other. Hot digests over the cap of their identifier are left out of
+    the join and recorded for a side report, and the pairs of rows that share one are only kept when
+    another identifier links them.
+    """
+
+    def __init__(self, max_fanouts: Dict[str, int]) -> None:
+        """
+        Args:
+            max_fanouts: The largest number of pairs a single digest may produce, by match type; match
+                types without a cap are joined in full
+
+        Raises:
+            ValueError: If a cap is smaller than 1.
+        """
+        for match_type, max_fanout in max_fanouts.items():
+            if max_fanout < 1:
+                raise ValueError(
+                    f"Invalid {IDENTIFIER_NAMES[match_type]} fan-out cap {max_fanout}, expected at least 1"
+                )
+        self.max_fanouts = max_fanouts
+        self.hot_keys: List[Tuple[str, bytes, int, int]] = []
+        self.linked_pairs = 0
+        self._hot_digests: Tuple[Dict[str, Set[Tuple[str, bytes]]], Dict[str, Set[Tuple[str, bytes]]]] = ({}, {})
+
+    def is_hot(self, match_type: str, count1: int, count2: int) -> bool:
+        """Whether a digest in count1 rows of the first dataset and count2 rows of the second is over the cap."""
+        max_fanout = self.max_fanouts.get(match_type)
+        return max_fanout is not None and count1 * count2 > max_fanout
+
+    def skip(self, match_type: str, digest: bytes, count1: int, count2: int) -> None:
+        """Record a hot digest left out of the join."""
+        self.hot_keys.append((match_type, digest, count1, count2))
+
+    def mark(self, side: int, pseudonym: str, match_type: str, digest: bytes) -> None:
+        """Record that a record of dataset side (1 or 2) has a hot digest."""
+        self._hot_digests[side - 1].setdefault(pseudonym, set()).add((match_type, digest))
+
+    def forget(self, side: int, pseudonym: str) -> None:
+        """Drop the hot digests recorded for a record of dataset side (1 or 2)."""
+        self._hot_digests[side - 1].pop(pseudonym, None)
+
+    def skip_entries(
+        self, match_type: str, hot_entries: HotEntries, hashes1: HashedTable, hashes2: HashedTable, width: int
+    ) -> None:
+        """Record the hot digests and the records that have them from the entries a capped join left out."""
+        counts1 = Counter(hot_entries.digests1.tolist())
+        counts2 = Counter(hot_entries.digests2.tolist())
+        for digest, count1 in counts1.items():
+            self.skip(match_type, digest, count1, counts2[digest])
+        for side, hashes, digests, positions in (
+            (1, hashes1, hot_entries.digests1, hot_entries.positions1),
+            (2, hashes2, hot_entries.digests2, hot_entries.positions2),
+        ):
+            for digest, row_id in zip(digests.tolist(), (positions // width).tolist()):
+                self.mark(side, hashes.pseudonym(row_id), match_type, digest)
+
+    def link(self, matches: MatchStore) -> None:
+        """Add the hot digests shared by the pairs that other identifiers matched to their matches."""
+        hot_digests1, hot_digests2 = self._hot_digests
+        for pair in range(len(matches)):
+            pseudonym1, pseudonym2 = matches.pair_pseudonyms(pair)
+            shared = hot_digests1.get(pseudonym1, set()) & hot_digests2.get(pseudonym2, set())
+            if shared:
+                self.linked_pairs += 1
+            for match_type, digest in sorted(shared):
+                matches.record(pseudonym1, pseudonym2, match_type, digest)
+
+    def write_report(self, report_file: str) -> bool:
+        """
+        Write the hot digests with their row counts to a CSV file, the largest fan-out first.
+
+        Returns:
+            Whether the file was written successfully
+        """
+        hot_keys = sorted(self.hot_keys, key=lambda hot_key: (-hot_key[2] * hot_key[3], hot_key[0], hot_key[1]))
+        try:
+            with open(report_file, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["Identifier", "Hash", "Rows In File 1", "Rows In File 2", "Skipped Pairs"])
+                for match_type, digest, count1, count2 in hot_keys:
+                    identifier = IDENTIFIER_NAMES[match_type].title()
+                    writer.writerow([identifier, digest.hex(), count1, count2, count1 * count2])
+        except IOError:
+            print(f"Error writing to hot key report: {report_file}")
+            return False
+        return True
+
+    def print_summary(self, report_file: str) -> None:
+        """Print how many hot digests were skipped and how many of their pairs were kept."""
+        for match_type, max_fanout in self.max_fanouts.items():
+            hot_keys = [hot_key for hot_key in self.hot_keys if hot_key[0] == match_type]
+            skipped_pairs = sum(count1 * count2 for _, _, count1, count2 in hot_keys)
+            print(
+                f"Skipped {len(hot_keys)} hot {IDENTIFIER_NAMES[match_type]} hash(es) over the fan-out cap of "
+                f"{max_fanout} ({skipped_pairs} pairs)"
+            )
+        print(f"Kept {self.linked_pairs} pair(s) sharing a hot hash and linked by another identifier")
+        if self.hot_keys:
+            print(f"Hot hashes written to {report_file}")
+
+
+def default_hot_key_report(output_file: str) -> str:
+    """Return the default path of the hot key report next to an output file."""
+    return f"{os.path.splitext(output_file)[0]}_hot_keys.csv"
+
+
+def find_matches(hashes1: HashedTable, hashes2: HashedTable, fanout_cap: Optional[FanoutCap] = None) -> MatchStore:
+    """
+    Find matching records between two datasets with per-hash dictionary lookups.
+
+    Args:
+        hashes1: First dataset with hashed identifiers
+        hashes2: Second dataset with hashed identifiers
+        fanout_cap: Optional caps on the number of pairs a single digest may produce
+
+    Returns:
+        The match results, one entry per pseudonym pair, in the order the pairs were first matched
+    """
+    matches = MatchStore()
+
+    # Index every identifier of both datasets, then pair all rows that share a digest
+    with stage(metrics, "index_build", len(hashes1) + len(hashes2)):
+        indexes1 = build_indexes(hashes1)
+        indexes2 = build_indexes(hashes2)
+    for (match_type, _), index1, index2 in zip(IDENTIFIERS, indexes1, indexes2):
+        description = f"Matching {IDENTIFIER_NAMES[match_type]} hashes"
+        with stage(metrics, _join_stage(match_type)):
+            for digest, rows1 in tqdm(index1.items(), desc=description, total=len(index1), unit="hash"):
+                rows2 = index2.get(digest)
+                if not rows2:
+                    continue
+                if fanout_cap and fanout_cap.is_hot(match_type, len(rows1), len(rows2)):
+                    fanout_cap.skip(match_type, digest, len(rows1), len(rows2))
+                    for side, hashes, rows in ((1, hashes1, rows1), (2, hashes2, rows2)):
+                        for row in rows:
+                            fanout_cap.mark(side, hashes.pseudonym(row), match_type, digest)
+                    continue
+                for row1, row2 in itertools.product(rows1, rows2):
+                    matches.record(hashes1.pseudonym(row1), hashes2.pseudonym(row2), match_type, digest)
+
+    if fanout_cap:
+        fanout_cap.link(matches)
+    return matches
+
+
+def join_identifier(
+    match_type: str,
+    entries1: Entries,
+    entries2: Entries,
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    fanout_cap: Optional[FanoutCap] = None,
+) -> JoinedPairs:
+    """Join the entries of an identifier, leaving out its hot digests if it has a fan-out cap."""
+    if not fanout_cap or match_type not in fanout_cap.max_fanouts:
+        return product_join(entries1, entries2)
+    pairs, hot_entries = capped_product_join(entries1, entries2, fanout_cap.max_fanouts[match_type])
+    fanout_cap.skip_entries(match_type, hot_entries, hashes1, hashes2, entries1.width)
+    return pairs
+
+
+def find_matches_vectorized(
+    hashes1: HashedTable, hashes2: HashedTable, fanout_cap: Optional[FanoutCap] = None
+) -> MatchStore:
+    """
+    Find matching records between two datasets with a vectorized sort-based join.
+
+    Indexing and joining run on NumPy arrays of digest fingerprints; only the matched pairs are turned
+    into Python objects. The results are identical to find_matches.
+
+    Args:
+        hashes1: First dataset with hashed identifiers
+        hashes2: Second dataset with hashed identifiers
+        fanout_cap: Optional caps on the number of pairs a single digest may produce
+
+    Returns:
+        The match results, one entry per pseudonym pair, in the order the pairs were first matched
+    """
+    require_column(hashes1, hashes2, "Email Hash")
+    require_column(hashes1, hashes2, "Personal Info Hash")
+    joins = []
+    for match_type, column_names in IDENTIFIERS:
+        with stage(metrics, "index_build", len(hashes1) + len(hashes2)):
+            entries1, entries2 = column_entries(hashes1, column_names), column_entries(hashes2, column_names)
+        with stage(metrics, _join_stage(match_type)):
+            pairs = join_identifier(match_type, entries1, entries2, hashes1, hashes2, fanout_cap)
+        joins.append((match_type, pairs, len(column_names)))
+    with stage(metrics, "collect_pairs"):
+        matches = matches_from_pairs(hashes1, hashes2, joins)
+    if fanout_cap:
+        fanout_cap.link(matches)
+    return matches
+
+
+def find_matches_partitioned(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    memory_budget: int,
+    spill_dir: str,
+    fanout_cap: Optional[FanoutCap] = None,
+) -> MatchStore:
+    """
+    Find matching records between two datasets that do not fit in memory.
+
+    Each identifier is radix-partitioned by digest into spill files and joined one partition at a time
+    within the memory budget. The results are identical to find_matches.
+
+    Args:
+        hashes1: First dataset with hashed identifiers
+        hashes2: Second dataset with hashed identifiers
+        memory_budget: Memory budget in bytes for joining one partition
+        spill_dir: Directory for the spill files
+        fanout_cap: Optional caps on the number of pairs a single digest may produce
+
+    Returns:
+        The match results, one entry per pseudonym pair, in the order the pairs were first matched
+    """
+    require_column(hashes1, hashes2, "Email Hash")
+    require_column(hashes1, hashes2, "Personal Info Hash")
+    joins = []
+    for match_type, column_names in IDENTIFIERS:
+
+        # Equal digests land in the same partition, so the fan-out of every digest is known per partition
+        def join(entries1: Entries, entries2: Entries, match_type: str = match_type) -> JoinedPairs:
+            return join_identifier(match_type, entries1, entries2, hashes1, hashes2, fanout_cap)
+
+        with stage(metrics, _join_stage(match_type)):
+            pairs = partitioned_join(hashes1, hashes2, column_names, join, memory_budget, spill_dir)
+        joins.append((match_type, pairs, len(column_names)))
+    with stage(metrics, "collect_pairs"):
+        matches = matches_from_pairs(hashes1, hashes2, joins)
+    if fanout_cap:
+        fanout_cap.link(matches)
+    return matches
+
+
+def matches_from_pairs(
+    hashes1: HashedTable, hashes2: HashedTable, joins: List[Tuple[str, JoinedPairs, int]]
+) -> MatchStore:
+    """
+    Build match results from joined pairs, looking up the pseudonyms of the matched rows only.
+
+    Args:
+        hashes1: First dataset with hashed identifiers
+        hashes2: Second dataset with hashed identifiers
+        joins: The match type, joined pairs and entry width of every join, in output order
+
+    Returns:
+        The match results, one entry per pseudonym pair, in the order the pairs were first matched
+    """
+    matches = MatchStore()
+    pseudonyms1: Dict[int, str] = {}
+    pseudonyms2: Dict[int, str] = {}
+    for match_type, pairs, width in joins:
+        rows1 = (pairs.positions1 // width).tolist()
+        rows2 = (pairs.positions2 // width).tolist()
+        for row1, row2, digest in zip(rows1, rows2, pairs.digests.tolist()):
+            pseudonym1 = pseudonyms1.get(row1)
+            if pseudonym1 is None:
+                pseudonym1 = pseudonyms1[row1] = hashes1.pseudonym(row1)
+            pseudonym2 = pseudonyms2.get(row2)
+            if pseudonym2 is None:
+                pseudonym2 = pseudonyms2[row2] = hashes2.pseudonym(row2)
+            matches.record(pseudonym1, pseudonym2, match_type, digest)
+    return matches
+
+
+def find_approximate_matches(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    matches: MatchStore,
+    min_similarity: float,
+    band_size: int = DEFAULT_BAND_SIZE,
+) -> None:
+    """
+    Add the pairs whose personal info sketches are similar to match results, with their similarity.
+
+    Pairs already matched get the similarity in their row; the others are added after them. See
+    approximate_match.approximate_join for the blocking and scoring.
+
+    Raises:
+        ValueError: If a dataset has no personal info sketch columns.
+    """
+    pairs = approximate_join(hashes1, hashes2, min_similarity, band_size)
+    matches.track_similarities()
+    for row1, row2, similarity in zip(pairs.rows1.tolist(), pairs.rows2.tolist(), pairs.similarities.tolist()):
+        matches.record_similarity(hashes1.pseudonym(row1), hashes2.pseudonym(row2), similarity)
+
+
+def write_matches(matches: MatchStore, output_file: str) -> bool:
+    """
+    Write match results to a CSV file.
+
+    Args:
+        matches: The match results
+        output_file: Path to output CSV file for match results
+
+    Returns:
+        Whether the file was written successfully
+    """
+    try:
+        with open(output_file, "w", newline="") as file:
+            writer = csv.writer(file)
+            # Update header for flexible phone matching
+            writer.writerow(output_header(matches.approximate))
+            writer.writerows(matches.rows())
+    except IOError:
+        print(f"Error writing to output file: {output_file}")
+        return False
+    return True
+
+
+def print_match_summary(total_pairs: int, match_type_counts: Dict[str, int]) -> None:
+    """Print the summary statistics of a matching run, counted as the pairs were recorded."""
+    print("Matched entries written to output file.")
+    print(f"Total unique matched pairs: {total_pairs}")
+    for match_type, count in match_type_counts.items():
+        print(f"{match_type}: {count}")
+    if metrics is not None:
+        metrics.count("total_pairs", total_pairs)
+        metrics.count("match_type_counts", {match_type: match_type_counts[match_type] for match_type in MATCH_TYPES})
+
+
+def match_datasets(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    engine: str = "python",
+    memory_budget: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+    fanout_cap: Optional[FanoutCap] = None,
+    min_similarity: Optional[float] = None,
+    band_size: int = DEFAULT_BAND_SIZE,
+) -> MatchStore:
+    """
+    Find matching records between two loaded datasets with the chosen engine. See find_and_write_matches
+    for the arguments; the digests skipped by the fan-out caps are collected in fanout_cap.
+
+    Raises:
+        ValueError: If the datasets were hashed with different digest parameters, or have no email or
+            personal info column, or no personal info sketch columns when matching approximately.
+    """
+    require_same_digests(
+        [("the first dataset", hashes1.digest_parameters()), ("the second dataset", hashes2.digest_parameters())]
+    )
+    if memory_budget:
+        with tempfile.TemporaryDirectory(prefix="match_spill_", dir=spill_dir) as partition_dir:
+            matches = find_matches_partitioned(hashes1, hashes2, memory_budget, partition_dir, fanout_cap)
+    elif engine == "numpy":
+        matches = find_matches_vectorized(hashes1, hashes2, fanout_cap)
+    else:
+        matches = find_matches(hashes1, hashes2, fanout_cap)
+    if min_similarity is not None:
+        with stage(metrics, "approximate_personal_info", len(hashes1) + len(hashes2)):
+            find_approximate_matches(hashes1, hashes2, matches, min_similarity, band_size)
+    return matches
 
 
-def find_and_write_matches(hashes1: List[Dict[str, str]], hashes2: List[Dict[str, str]], output_file: str) -> None:
+def find_and_write_matches(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    output_file: str,
+    engine: str = "python",
+    memory_budget: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+    max_fanouts: Optional[Dict[str, int]] = None,
+    hot_key_report: Optional[str] = None,
+    min_similarity: Optional[float] = None,
+    band_size: int = DEFAULT_BAND_SIZE,
+) -> None:
     """
     Find matching records between two datasets and write results to file.
 
@@ -33,172 +488,795 @@ def find_and_write_matches(hashes1: List[Dict[str, str]], hashes2: List[Dict[str
         hashes1: First dataset with hashed identifiers
         hashes2: Second dataset with hashed identifiers
         output_file: Path to output CSV file for match results
+        engine: "python" for dictionary lookups, or "numpy" for the vectorized sort-based join
+        memory_budget: Optional memory budget in bytes; if given, the datasets are joined out of core
+            one partition at a time, whatever the engine
+        spill_dir: Directory for the spill files of an out-of-core join (default: a temporary directory)
+        max_fanouts: Optional caps on the number of pairs a single digest may produce, by match type;
+            hotter digests are skipped unless another identifier links the pair
+        hot_key_report: Path of the CSV report of skipped digests (default: next to output_file)
+        min_similarity: Optional lowest similarity of the personal info sketches of pairs reported by
+            approximate matching; if given, the similarity column is added to the output
+        band_size: Number of sketch values per LSH band of approximate matching
+
+    Raises:
+        ValueError: If the datasets were hashed with different digest parameters, or have no email or
+            personal info column, or no personal info sketch columns when matching approximately.
     """
-    matched_entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
-
-    # Create phone hash mapping for dataset 1
-    phone_map1: Dict[str, List[Dict[str, str]]] = {}
-    for row in hashes1:
-        phones = []
-        if row["Phone Hash 1"]:
-            phones.append(row["Phone Hash 1"])
-        if row["Phone Hash 2"]:
-            phones.append(row["Phone Hash 2"])
-        if "Phone Hash 3" in row and row["Phone Hash 3"]:
-            phones.append(row["Phone Hash 3"])
-
-        for phone in phones:
-            phone_map1.setdefault(phone, []).append(row)
-
-    # Create phone hash mapping for dataset 2
-    phone_map2: Dict[str, List[Dict[str, str]]] = {}
-    for row in hashes2:
-        phones = []
-        if row["Phone Hash 1"]:
-            phones.append(row["Phone Hash 1"])
-        if row["Phone Hash 2"]:
-            phones.append(row["Phone Hash 2"])
-        if "Phone Hash 3" in row and row["Phone Hash 3"]:
-            phones.append(row["Phone Hash 3"])
-
-        for phone in phones:
-            phone_map2.setdefault(phone, []).append(row)
-
-    # Create maps for other identifying information
-    personal_info_map1 = {row["Personal Info Hash"]: row for row in hashes1 if row["Personal Info Hash"]}
-    personal_info_map2 = {row["Personal Info Hash"]: row for row in hashes2 if row["Personal Info Hash"]}
-    email_map1 = {row["Email Hash"]: row for row in hashes1 if row["Email Hash"]}
-    email_map2 = {row["Email Hash"]: row for row in hashes2 if row["Email Hash"]}
-
-    # Find phone matches across any position
-    for phone_hash, rows1 in tqdm(phone_map1.items(), desc="Matching phone hashes", unit="hash"):
-        if phone_hash in phone_map2:
-            rows2 = phone_map2[phone_hash]
-            for row1, row2 in itertools.product(rows1, rows2):
-                pseudonyms = (row1["Pseudonym"], row2["Pseudonym"])
-                hash_pair = matched_entries.get(
-                    pseudonyms,
-                    {
-                        "Phone Match": "No",
-                        "Email Match": "No",
-                        "Personal Info Match": "No",
-                        "Matched Phone Hashes": set(),
-                    },
-                )
+    fanout_cap = FanoutCap(max_fanouts) if max_fanouts else None
+    matches = match_datasets(hashes1, hashes2, engine, memory_budget, spill_dir, fanout_cap, min_similarity, band_size)
 
-                if hash_pair["Phone Match"] == "No":
-                    hash_pair["Phone Match"] = "Yes"
-                    hash_pair["Matched Phone Hashes"] = set()
-
-                hash_pair["Matched Phone Hashes"].add(phone_hash)
-                matched_entries[pseudonyms] = hash_pair
-
-    # Find email matches
-    for key, value in tqdm(email_map1.items(), desc="Matching email hashes", unit="record"):
-        if key in email_map2:
-            pseudonyms = (value["Pseudonym"], email_map2[key]["Pseudonym"])
-            hash_pair = matched_entries.get(
-                pseudonyms,
-                {
-                    "Phone Match": "No",
-                    "Email Match": "No",
-                    "Personal Info Match": "No",
-                    "Matched Phone Hashes": set(),
-                    "Matched Email Hash": "",
-                },
-            )
-            hash_pair["Email Match"] = "Yes"
-            hash_pair["Matched Email Hash"] = key
-            matched_entries[pseudonyms] = hash_pair
-
-    # Find personal info matches
-    for key, value in tqdm(personal_info_map1.items(), desc="Matching personal info hashes", unit="record"):
-        if key in personal_info_map2:
-            pseudonyms = (value["Pseudonym"], personal_info_map2[key]["Pseudonym"])
-            hash_pair = matched_entries.get(
-                pseudonyms,
-                {
-                    "Phone Match": "No",
-                    "Email Match": "No",
-                    "Personal Info Match": "No",
-                    "Matched Phone Hashes": set(),
-                    "Matched Personal Info Hash": "",
-                    "Matched Email Hash": "",
-                },
-            )
-            hash_pair["Personal Info Match"] = "Yes"
-            hash_pair["Matched Personal Info Hash"] = key
-            matched_entries[pseudonyms] = hash_pair
+    with stage(metrics, "write", matches.total_pairs):
+        written = write_matches(matches, output_file)
+    if not written:
+        return
+    report_file = hot_key_report or default_hot_key_report(output_file)
+    if fanout_cap and fanout_cap.hot_keys and not fanout_cap.write_report(report_file):
+        return
+
+    # Print summary statistics
+    print_match_summary(matches.total_pairs, matches.match_type_counts)
+    if fanout_cap:
+        fanout_cap.print_summary(report_file)
+
+
+def choose_build_side(hashed_file_1: str, hashed_file_2: str, build_side: str = "auto") -> int:
+    """
+    Choose which dataset the streaming matcher indexes: 1 or 2, or with "auto" the smaller file on disk.
+    """
+    if build_side == "auto":
+        return 1 if os.path.getsize(hashed_file_1) <= os.path.getsize(hashed_file_2) else 2
+    return int(build_side)
+
+
+def probe_columns(columns: List[str]) -> List[List[int]]:
+    """
+    Return the positions of the hash columns of every identifier among the columns of a probe file.
+
+    Raises:
+        ValueError: If the probe file has no email or personal info column.
+    """
+    for column_name in ("Email Hash", "Personal Info Hash"):
+        if column_name not in columns:
+            raise ValueError(f"Hashed dataset has no {column_name} column")
+    return [[columns.index(name) for name in names if name in columns] for _, names in IDENTIFIERS]
+
+
+def probe_matches(
+    build: Union[HashedTable, MatchIndex],
+    indexes: Sequence[DigestLookup],
+    build_side: int,
+    probe_file: str,
+    matches: MatchStore,
+    fanout_cap: Optional[FanoutCap] = None,
+    progress: bool = True,
+) -> Iterator[None]:
+    """
+    Stream a hashed file row by row through the indexes of another dataset, recording the matches.
+
+    With fan-out caps, a first pass over the probe file counts the probe rows of every digest the build
+    side has, to find the hot digests.
+
+    Args:
+        build: The indexed dataset (the build side), loaded or a saved match index
+        indexes: The indexes of the build side, from build_indexes or MatchIndex.identifier_indexes
+        build_side: Which dataset of the output the build side is, 1 or 2; the probe file is the other one
+        probe_file: Path to the streamed hashed file (the probe side)
+        matches: The store to record the matches in
+        fanout_cap: Optional caps on the number of pairs a single digest may produce
+        progress: Whether to show a progress bar
+
+    Returns:
+        An iterator that matches one probe row per step, so the caller can write out and clear the
+        matches of every row
+
+    Raises:
+        ValueError: If the probe file has no email or personal info column, or was hashed with other digest
+            parameters than the build side.
+    """
+    require_same_digests(
+        [("the indexed dataset", build.digest_parameters()), (probe_file, read_digest_parameters(probe_file))]
+    )
+    columns, first_read = iter_hashed_rows(probe_file)
+    reads = iter([first_read])
+
+    def read_rows() -> Iterable[HashedRow]:
+        # The first pass reads the file opened above, a second pass with fan-out caps opens it again
+        return next(reads, None) or iter_hashed_rows(probe_file)[1]
+
+    return probe_hashed_rows(build, indexes, build_side, columns, read_rows, matches, fanout_cap, progress)
+
+
+def probe_hashed_rows(
+    build: Union[HashedTable, MatchIndex],
+    indexes: Sequence[DigestLookup],
+    build_side: int,
+    columns: List[str],
+    read_rows: Callable[[], Iterable[HashedRow]],
+    matches: MatchStore,
+    fanout_cap: Optional[FanoutCap] = None,
+    progress: bool = True,
+) -> Iterator[None]:
+    """
+    Stream hashed rows through the indexes of another dataset, recording the matches. See probe_matches
+    for the other arguments.
+
+    Args:
+        columns: The hash columns of the probe rows
+        read_rows: Returns the probe rows; called twice with fan-out caps, once to count the probe rows of
+            the digests and once to match
+
+    Raises:
+        ValueError: If the probe rows have no email or personal info column.
+    """
+    identifier_columns = probe_columns(columns)
+
+    def probe() -> Iterator[None]:
+        probe_side = 3 - build_side
+        hot_digests: Set[Tuple[str, bytes]] = set()
+        rows = read_rows()
+        if fanout_cap:
+            probe_counts: Counter = Counter()
+            for _, digests in rows:
+                for (match_type, _), index, columns in zip(IDENTIFIERS, indexes, identifier_columns):
+                    if match_type in fanout_cap.max_fanouts:
+                        probe_counts.update(
+                            (match_type, digests[column]) for column in columns if digests[column] in index
+                        )
+            build_indexes_by_type = {match_type: index for (match_type, _), index in zip(IDENTIFIERS, indexes)}
+            for (match_type, digest), probe_count in probe_counts.items():
+                build_rows = build_indexes_by_type[match_type].get(digest)
+                counts = (len(build_rows), probe_count) if build_side == 1 else (probe_count, len(build_rows))
+                if fanout_cap.is_hot(match_type, *counts):
+                    fanout_cap.skip(match_type, digest, *counts)
+                    hot_digests.add((match_type, digest))
+                    for build_row in build_rows:
+                        fanout_cap.mark(build_side, build.pseudonym(build_row), match_type, digest)
+            del probe_counts
+            rows = read_rows()
+
+        for probe_pseudonym, digests in tqdm(rows, desc="Probing rows", unit="row", disable=not progress):
 
-    # Write results to output file
+            def record(build_row: int, match_type: str, digest: bytes) -> None:
+                build_pseudonym = build.pseudonym(build_row)
+                if build_side == 1:
+                    matches.record(build_pseudonym, probe_pseudonym, match_type, digest)
+                else:
+                    matches.record(probe_pseudonym, build_pseudonym, match_type, digest)
+
+            for (match_type, _), index, columns in zip(IDENTIFIERS, indexes, identifier_columns):
+                for column in columns:
+                    if fanout_cap is not None and (match_type, digests[column]) in hot_digests:
+                        fanout_cap.mark(probe_side, probe_pseudonym, match_type, digests[column])
+                        continue
+                    for build_row in index.get(digests[column]):
+                        record(build_row, match_type, digests[column])
+            if fanout_cap:
+                fanout_cap.link(matches)
+                fanout_cap.forget(probe_side, probe_pseudonym)
+            yield
+
+    return probe()
+
+
+def stream_matches(
+    build: Union[HashedTable, MatchIndex],
+    indexes: Sequence[DigestLookup],
+    build_side: int,
+    probe_file: str,
+    output_file: str,
+    fanout_cap: Optional[FanoutCap] = None,
+    progress: bool = True,
+) -> Optional[MatchStore]:
+    """
+    Stream a hashed file row by row through the indexes of another dataset, writing the matches as they
+    are found.
+
+    Result rows come in probe order, with the match types of a pair merged over one probe row; a pseudonym
+    repeated on several probe rows gets one output row each. See probe_matches for the arguments.
+
+    Returns:
+        The match store, emptied, holding the summary counts of the run, or None if the output file could
+        not be written
+
+    Raises:
+        ValueError: If the probe file has no email or personal info column, or was hashed with other digest
+            parameters than the build side.
+    """
+    matches = MatchStore()
+    probe = probe_matches(build, indexes, build_side, probe_file, matches, fanout_cap, progress)
     try:
         with open(output_file, "w", newline="") as file:
             writer = csv.writer(file)
-            # Update header for flexible phone matching
+            writer.writerow(OUTPUT_HEADER)
+            probe_rows = 0
+            for _ in probe if metrics is None else metrics.timed_iter("probe", probe):
+                # Only the pairs of the current probe row are held; the summary counts carry over
+                writer.writerows(matches.rows())
+                matches.clear()
+                probe_rows += 1
+        if metrics is not None:
+            metrics.rows += probe_rows
+    except IOError:
+        print(f"Error writing to output file: {output_file}")
+        return None
+    return matches
+
+
+def stream_and_write_matches(
+    hashed_file_1: str,
+    hashed_file_2: str,
+    output_file: str,
+    build_side: int,
+    max_fanouts: Optional[Dict[str, int]] = None,
+    hot_key_report: Optional[str] = None,
+) -> None:
+    """
+    Match two datasets by indexing one (the build side) and streaming the other (the probe side).
+
+    Only the build side is loaded and indexed, so memory scales with the smaller dataset; a saved match
+    index is probed in place, without loading it. See stream_matches for the order of the results.
+
+    Args:
+        hashed_file_1: Path to the first hashed dataset
+        hashed_file_2: Path to the second hashed dataset
+        output_file: Path to output CSV file for match results
+        build_side: Which dataset to index, 1 or 2; the other one is streamed. A dataset given as a saved
+            match index must be the build side
+        max_fanouts: Optional caps on the number of pairs a single digest may produce, by match type;
+            hotter digests are skipped unless another identifier links the pair
+        hot_key_report: Path of the CSV report of skipped digests (default: next to output_file)
+    """
+    build_file, probe_file = (hashed_file_1, hashed_file_2) if build_side == 1 else (hashed_file_2, hashed_file_1)
+    try:
+        build, indexes = open_build_side(build_file)
+    except FileNotFoundError:
+        print(f"File not found: {build_file}")
+        return
+    try:
+        print(f"Indexed {len(build)} rows of {build_file}; streaming {probe_file}")
+        fanout_cap = FanoutCap(max_fanouts) if max_fanouts else None
+        matches = stream_matches(build, indexes, build_side, probe_file, output_file, fanout_cap)
+    finally:
+        build.close()
+    if matches is None:
+        return
+    report_file = hot_key_report or default_hot_key_report(output_file)
+    if fanout_cap and fanout_cap.hot_keys and not fanout_cap.write_report(report_file):
+        return
+
+    print_match_summary(matches.total_pairs, matches.match_type_counts)
+    if fanout_cap:
+        fanout_cap.print_summary(report_file)
+
+
+def merge_delta_matches(
+    index_dir_1: str,
+    index_dir_2: str,
+    delta_file_1: Optional[str],
+    delta_file_2: Optional[str],
+    previous_output: str,
+    output_file: str,
+) -> None:
+    """
+    Update the matches of two indexed datasets after appending delta files to their indexes, matching only
+    the delta rows.
+
+    The pairs of the pseudonyms of the deltas are dropped from the previous output and rematched: the rows
+    of delta 1 are streamed through index 2, and those of delta 2 through index 1. Since the indexes
+    already hold both deltas, this finds every pair of a changed pseudonym, merged by pair as in the batch
+    engines, and appends them to the rows kept from the previous output.
+
+    Args:
+        index_dir_1: The index of the first dataset, with delta_file_1 appended
+        index_dir_2: The index of the second dataset, with delta_file_2 appended
+        delta_file_1: Path to the delta appended to the first index, if any
+        delta_file_2: Path to the delta appended to the second index, if any
+        previous_output: Path to the match results before the deltas
+        output_file: Path to output CSV file for the updated match results; may be previous_output
+
+    Raises:
+        ValueError: If a delta file has no email or personal info column, or was hashed with other digest
+            parameters than the indexes.
+    """
+    changed: Tuple[Set[str], Set[str]] = (set(), set())
+    matches = MatchStore()
+    for build_side, index_dir, delta_file in ((2, index_dir_2, delta_file_1), (1, index_dir_1, delta_file_2)):
+        if delta_file is None:
+            continue
+        _, delta_rows = iter_hashed_rows(delta_file)
+        changed[2 - build_side].update(pseudonym for pseudonym, _ in delta_rows)
+        index = MatchIndex(index_dir)
+        try:
+            print(f"Matching {delta_file} against the {len(index)} rows of {index_dir}")
+            probe = probe_matches(index, index.identifier_indexes(), build_side, delta_file, matches)
+            for _ in probe if metrics is None else metrics.timed_iter("probe", probe):
+                pass
+        finally:
+            index.close()
+
+    total_pairs = matches.total_pairs
+    match_type_counts = dict(matches.match_type_counts)
+    temporary_file = output_file + ".tmp"
+    try:
+        with stage(metrics, "write"), open(previous_output, newline="") as previous, open(
+            temporary_file, "w", newline=""
+        ) as file:
+            reader = csv.reader(previous)
+            if next(reader, None) != OUTPUT_HEADER:
+                raise ValueError(f"{previous_output} is not a match results file")
+            writer = csv.writer(file)
+            writer.writerow(OUTPUT_HEADER)
+            kept = 0
+            for row in reader:
+                if row[0] in changed[0] or row[1] in changed[1]:
+                    continue
+                writer.writerow(row)
+                kept += 1
+                total_pairs += 1
+                for match_type, flag in zip(MATCH_TYPES, row[2:5]):
+                    match_type_counts[match_type] += flag == "Yes"
+            writer.writerows(matches.rows())
+        os.replace(temporary_file, output_file)
+    except IOError:
+        print(f"Error writing to output file: {output_file}")
+        return
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+    print(f"Kept {kept} rows of {previous_output}; rematched {matches.total_pairs} pairs of changed pseudonyms")
+    print_match_summary(total_pairs, match_type_counts)
+
+
+class PartnerSummary(NamedTuple):
+    """The outcome of matching the base dataset against one partner file."""
+
+    partner_file: str
+    output_file: str
+    total_pairs: int
+    match_type_counts: Dict[str, int]
+    hot_keys: int
+    error: Optional[str]
+
+
+# The base dataset and its indexes in one-to-many matching, shared with the partner worker processes
+_base: Optional[Tuple[Union[HashedTable, MatchIndex], Sequence[DigestLookup]]] = None
+
+
+def _init_partner_worker(base_file: str) -> None:
+    """Load and index the base dataset in a partner worker process, unless it was inherited on fork."""
+    global _base
+    if _base is None:
+        _base = open_build_side(base_file)
+
+
+def _match_partner(
+    partner_file: str, output_file: str, max_fanouts: Optional[Dict[str, int]], progress: bool
+) -> PartnerSummary:
+    """Stream a partner file through the indexes of the base dataset and write its matches and hot key report."""
+    assert _base is not None
+    base, indexes = _base
+    fanout_cap = FanoutCap(max_fanouts) if max_fanouts else None
+    try:
+        matches = stream_matches(base, indexes, 1, partner_file, output_file, fanout_cap, progress)
+    except (OSError, ValueError) as e:
+        return PartnerSummary(partner_file, output_file, 0, {}, 0, str(e))
+    if matches is None:
+        return PartnerSummary(partner_file, output_file, 0, {}, 0, f"Error writing to output file: {output_file}")
+    hot_keys = len(fanout_cap.hot_keys) if fanout_cap else 0
+    if fanout_cap and hot_keys and not fanout_cap.write_report(default_hot_key_report(output_file)):
+        return PartnerSummary(partner_file, output_file, 0, {}, 0, "Error writing the hot key report")
+    return PartnerSummary(partner_file, output_file, matches.total_pairs, matches.match_type_counts, hot_keys, None)
+
+
+def expand_partner_files(patterns: List[str], base_file: str) -> List[str]:
+    """
+    Expand partner file paths and glob patterns into a list of files, in sorted order within each pattern.
+
+    The base file and repeated files are left out.
+
+    Raises:
+        ValueError: If a pattern matches no file.
+    """
+    partner_files: List[str] = []
+    seen = {os.path.abspath(base_file)}
+    for pattern in patterns:
+        paths = sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else [])
+        if not paths:
+            raise ValueError(f"No partner files match {pattern}")
+        for path in paths:
+            if os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                partner_files.append(path)
+    return partner_files
+
+
+def partner_output_file(output_dir: str, partner_file: str) -> str:
+    """Return the path of the match results of a partner file: <output_dir>/<partner name>_matches.csv."""
+    return os.path.join(output_dir, f"{os.path.splitext(os.path.basename(partner_file))[0]}_matches.csv")
+
+
+def match_partners(
+    base_file: str,
+    partner_files: List[str],
+    output_dir: str,
+    workers: int = 1,
+    max_fanouts: Optional[Dict[str, int]] = None,
+) -> List[PartnerSummary]:
+    """
+    Match one base dataset against many partner files, indexing the base dataset only once.
+
+    Every partner file is streamed through the base indexes as in stream_matches, with the base dataset as
+    the first dataset of the output, and its matches are written to <output_dir>/<partner name>_matches.csv.
+    With several workers, partners are matched in parallel worker processes; forked workers share the
+    base indexes of the parent process, others build their own once. A base dataset given as a saved
+    match index is probed in place. A combined summary of all partners
+    is written to <output_dir>/summary.csv.
+
+    Args:
+        base_file: Path to the base hashed dataset, or to a saved match index of it
+        partner_files: Paths to the partner hashed files
+        output_dir: Directory for the match results (created if needed)
+        workers: Number of partners matched in parallel (1 matches them in the current process)
+        max_fanouts: Optional caps on the number of pairs a single digest may produce, by match type
+
+    Returns:
+        The summary of every partner, in the order of partner_files
+
+    Raises:
+        ValueError: If two partner files have the same name, so their outputs would collide.
+    """
+    global _base
+    output_files = [partner_output_file(output_dir, partner_file) for partner_file in partner_files]
+    if len(set(output_files)) < len(output_files):
+        raise ValueError("Partner files must have distinct file names, since outputs are named after them")
+    os.makedirs(output_dir, exist_ok=True)
+
+    base, indexes = open_build_side(base_file)
+    try:
+        _base = (base, indexes)
+        print(f"Indexed {len(base)} rows of {base_file}; matching {len(partner_files)} partner file(s)")
+        if workers > 1 and len(partner_files) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(partner_files)),
+                initializer=_init_partner_worker,
+                initargs=(base_file,),
+            ) as executor:
+                futures = [
+                    executor.submit(_match_partner, partner_file, output_file, max_fanouts, False)
+                    for partner_file, output_file in zip(partner_files, output_files)
+                ]
+                summaries = [future.result() for future in futures]
+        else:
+            summaries = [
+                _match_partner(partner_file, output_file, max_fanouts, True)
+                for partner_file, output_file in zip(partner_files, output_files)
+            ]
+    finally:
+        _base = None
+        base.close()
+
+    write_partner_summary(summaries, os.path.join(output_dir, "summary.csv"))
+    return summaries
+
+
+def write_partner_summary(summaries: List[PartnerSummary], summary_file: str) -> None:
+    """Write the combined summary of a one-to-many run to a CSV file and print it."""
+    with open(summary_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Partner File", "Output File", "Matched Pairs", *MATCH_TYPES, "Hot Hashes", "Error"])
+        for summary in summaries:
+            counts = [summary.match_type_counts.get(match_type, 0) for match_type in MATCH_TYPES]
             writer.writerow(
                 [
-                    "Pseudonym1",
-                    "Pseudonym2",
-                    "Phone Match",
-                    "Email Match",
-                    "Personal Info Match",
-                    "Matched Phone Hashes",
-                    "Matched Personal Info Hash",
-                    "Matched Email Hash",
+                    summary.partner_file,
+                    summary.output_file,
+                    summary.total_pairs,
+                    *counts,
+                    summary.hot_keys,
+                    summary.error or "",
                 ]
             )
 
-            for pseudonyms, matches in matched_entries.items():
-                # Convert phone hash set to string for output
-                phone_hashes = (
-                    "|".join(matches.get("Matched Phone Hashes", set())) if "Matched Phone Hashes" in matches else ""
-                )
-                writer.writerow(
-                    [
-                        pseudonyms[0],
-                        pseudonyms[1],
-                        matches["Phone Match"],
-                        matches["Email Match"],
-                        matches["Personal Info Match"],
-                        phone_hashes,
-                        matches.get("Matched Personal Info Hash", ""),
-                        matches.get("Matched Email Hash", ""),
-                    ]
-                )
-    except IOError:
-        print(f"Error writing to output file: {output_file}")
-        return
+    for summary in summaries:
+        if summary.error:
+            print(f"{summary.partner_file}: failed: {summary.error}")
+            continue
+        type_counts = ", ".join(
+            f"{IDENTIFIER_NAMES[match_type]} {summary.match_type_counts[match_type]}" for match_type in MATCH_TYPES
+        )
+        print(f"{summary.partner_file}: {summary.total_pairs} matched pairs ({type_counts}) -> {summary.output_file}")
+    matched = [summary for summary in summaries if not summary.error]
+    print(
+        f"Matched {len(matched)} of {len(summaries)} partner file(s): "
+        f"{sum(summary.total_pairs for summary in matched)} matched pairs in total"
+    )
+    print(f"Combined summary written to {summary_file}")
+
+
+def add_fanout_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line arguments of the fan-out caps."""
+    for match_type, name in IDENTIFIER_NAMES.items():
+        parser.add_argument(
+            f"--max-{name.replace(' ', '-')}-fanout",
+            dest=f"max_{name.replace(' ', '_')}_fanout",
+            type=int,
+            help=f"Skip {name} hashes that would pair more than this many rows across the datasets, unless "
+            "another identifier links the pair, and report them",
+        )
+
+
+def add_matching_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line arguments of the fan-out caps and approximate matching."""
+    add_fanout_arguments(parser)
+    parser.add_argument(
+        "--min-personal-info-similarity",
+        type=float,
+        help="Also match personal info approximately: report pairs whose personal info sketches (from "
+        "hash_datasets.py --personal-info-sketches) have at least this estimated similarity, between 0 and 1, "
+        "with the similarity in a column of the output",
+    )
+    parser.add_argument(
+        "--sketch-band-size",
+        type=int,
+        default=DEFAULT_BAND_SIZE,
+        help="Sketch values per LSH band of approximate matching, 1 to 8; smaller bands find less similar "
+        f"pairs but compare more candidates (default: {DEFAULT_BAND_SIZE})",
+    )
+    parser.add_argument(
+        "--hot-key-report",
+        type=str,
+        help="Path of the CSV report of skipped hashes (default: <output-file>_hot_keys.csv)",
+    )
 
-    # Print summary statistics
-    print("Matched entries written to output file.")
-    total_matches = len(matched_entries)
-    print(f"Total unique matched pairs: {total_matches}")
-    for match_type in ["Phone Match", "Email Match", "Personal Info Match"]:
-        count = sum(1 for matches in matched_entries.values() if matches[match_type] == "Yes")
-        print(f"{match_type}: {count}")
+
+def max_fanouts_from_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Dict[str, int]:
+    """
+    Return the fan-out caps by match type and check the approximate matching options, if any, from the
+    arguments added by add_fanout_arguments or add_matching_arguments.
+    """
+    max_fanouts = {}
+    for match_type, name in IDENTIFIER_NAMES.items():
+        max_fanout = getattr(args, f"max_{name.replace(' ', '_')}_fanout")
+        if max_fanout is not None:
+            if max_fanout < 1:
+                parser.error(f"--max-{name.replace(' ', '-')}-fanout must be at least 1")
+            max_fanouts[match_type] = max_fanout
+    if getattr(args, "min_personal_info_similarity", None) is not None:
+        if not 0 < args.min_personal_info_similarity <= 1:
+            parser.error("--min-personal-info-similarity must be greater than 0 and at most 1")
+        if not 1 <= args.sketch_band_size <= 8:
+            parser.error("--sketch-band-size must be 1 to 8")
+    return max_fanouts
 
 
 def main() -> None:
     """Main entry point for the script."""
     parser = argparse.ArgumentParser(description="Match two hashed datasets and output detailed common entries.")
-    parser.add_argument("--hashed-file-1", type=str, required=True, help="Path to the first hashed dataset")
-    parser.add_argument("--hashed-file-2", type=str, required=True, help="Path to the second hashed dataset")
     parser.add_argument(
-        "--output-file",
+        "--hashed-file-1",
         type=str,
         required=True,
+        help="Path to the first hashed dataset (CSV, binary or a match_index.py index directory); with "
+        "--partner-files, the base dataset",
+    )
+    parser.add_argument(
+        "--hashed-file-2",
+        type=str,
+        help="Path to the second hashed dataset (CSV, binary or a match_index.py index directory)",
+    )
+    parser.add_argument(
+        "--output-file",
+        type=str,
         help="Path to output file for detailed matched entries",
     )
+    parser.add_argument(
+        "--partner-files",
+        type=str,
+        nargs="+",
+        help="Match the first dataset against each of these hashed files or glob patterns, indexing it only "
+        "once, instead of against --hashed-file-2",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        help="With --partner-files, directory for the <partner>_matches.csv outputs and the combined summary.csv",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="With --partner-files, number of partner files matched in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="python",
+        help="Join engine: python dictionary lookups, or a vectorized NumPy sort-based join (default: python)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=str,
+        help="Join out of core within this memory budget (e.g. 512M, 4G), spilling partitions to disk",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="Directory for spill files of an out-of-core join (default: the system temporary directory)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Index only one dataset and stream the other row by row, writing matches as they are found",
+    )
+    parser.add_argument(
+        "--build-side",
+        choices=("auto", "1", "2"),
+        default="auto",
+        help="With --stream, which dataset to index; auto picks the smaller file (default: auto)",
+    )
+    parser.add_argument(
+        "--delta-file-1",
+        type=str,
+        help="Delta of new and changed rows already appended to the index given as --hashed-file-1; only "
+        "delta rows are matched and merged into --previous-output",
+    )
+    parser.add_argument(
+        "--delta-file-2",
+        type=str,
+        help="Delta of new and changed rows already appended to the index given as --hashed-file-2",
+    )
+    parser.add_argument(
+        "--previous-output",
+        type=str,
+        help="With --delta-file-1/--delta-file-2, the match results before the deltas",
+    )
+    add_matching_arguments(parser)
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Write performance metrics as JSON to this file: wall and CPU time of every stage (load, index "
+        "build, each join phase, write), rows/sec and peak memory",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the run with cProfile and write the stats to this file (the main thread only)",
+    )
     args = parser.parse_args()
 
-    hashes1 = load_hashes(args.hashed_file_1)
-    hashes2 = load_hashes(args.hashed_file_2)
+    global metrics
+    if args.metrics_file:
+        metrics = Metrics("match_hashes")
+    with profiled(args.profile):
+        run(parser, args)
+    if metrics is not None:
+        metrics.write_json(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
+
+
+def run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Run the matching selected by the parsed command line arguments."""
+    max_fanouts = max_fanouts_from_arguments(parser, args)
+    approximate = args.min_personal_info_similarity is not None
+    if approximate:
+        if args.partner_files or args.delta_file_1 or args.delta_file_2 or args.stream:
+            parser.error("--min-personal-info-similarity cannot be combined with --partner-files, deltas or --stream")
 
-    if not hashes1 or not hashes2:
-        print("One or both input files are empty or not found. Aborting.")
+    if args.partner_files:
+        if args.hashed_file_2 or args.output_file:
+            parser.error("--partner-files replaces --hashed-file-2 and --output-file; use --output-dir")
+        if not args.output_dir:
+            parser.error("--partner-files requires --output-dir")
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        if not os.path.exists(args.hashed_file_1):
+            print(f"File not found: {args.hashed_file_1}")
+            return
+        try:
+            partner_files = expand_partner_files(args.partner_files, args.hashed_file_1)
+            match_partners(args.hashed_file_1, partner_files, args.output_dir, args.workers, max_fanouts)
+        except ValueError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
         return
+    if not args.hashed_file_2 or not args.output_file:
+        parser.error("--hashed-file-2 and --output-file are required, unless --partner-files is given")
+
+    saved_indexes = [is_match_index(args.hashed_file_1), is_match_index(args.hashed_file_2)]
+    if args.delta_file_1 or args.delta_file_2:
+        if not all(saved_indexes):
+            parser.error("--delta-file-1/--delta-file-2 require both datasets to be match_index.py index directories")
+        if not args.previous_output:
+            parser.error("--delta-file-1/--delta-file-2 require --previous-output")
+        if max_fanouts:
+            parser.error("Fan-out caps are not supported when merging deltas")
+        for file_path in (args.delta_file_1, args.delta_file_2, args.previous_output):
+            if file_path and not os.path.exists(file_path):
+                print(f"File not found: {file_path}")
+                return
+        try:
+            merge_delta_matches(
+                args.hashed_file_1,
+                args.hashed_file_2,
+                args.delta_file_1,
+                args.delta_file_2,
+                args.previous_output,
+                args.output_file,
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+        return
+    if all(saved_indexes):
+        parser.error("At most one dataset can be a match index, unless matching deltas with --delta-file-1/2")
+
+    if approximate and any(saved_indexes):
+        parser.error("--min-personal-info-similarity needs two hashed files, not a match index")
+    if args.stream or any(saved_indexes):
+        for file_path in (args.hashed_file_1, args.hashed_file_2):
+            if not os.path.exists(file_path):
+                print(f"File not found: {file_path}")
+                return
+        if any(saved_indexes):
+            # A saved index is probed in place, so it is always the build side
+            if args.build_side not in ("auto", str(saved_indexes.index(True) + 1)):
+                parser.error("A dataset given as a match index must be the build side")
+            build_side = saved_indexes.index(True) + 1
+        else:
+            build_side = choose_build_side(args.hashed_file_1, args.hashed_file_2, args.build_side)
+        try:
+            stream_and_write_matches(
+                args.hashed_file_1,
+                args.hashed_file_2,
+                args.output_file,
+                build_side,
+                max_fanouts=max_fanouts,
+                hot_key_report=args.hot_key_report,
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+        return
+
+    memory_budget = None
+    if args.memory_budget:
+        try:
+            memory_budget = parse_memory_size(args.memory_budget)
+        except ValueError as e:
+            parser.error(str(e))
+
+    with tempfile.TemporaryDirectory(prefix="match_hashes_", dir=args.spill_dir) as spool_dir:
+        # Out of core, CSV inputs are streamed into binary files instead of being parsed into memory
+        hashes1 = load_hashes(args.hashed_file_1, spool_dir if memory_budget else None)
+        hashes2 = load_hashes(args.hashed_file_2, spool_dir if memory_budget else None)
+
+        if not hashes1 or not hashes2:
+            print("One or both input files are empty or not found. Aborting.")
+            return
+
+        try:
+            find_and_write_matches(
+                hashes1,
+                hashes2,
+                args.output_file,
+                engine=args.engine,
+                memory_budget=memory_budget,
+                spill_dir=spool_dir,
+                max_fanouts=max_fanouts,
+                hot_key_report=args.hot_key_report,
+                min_similarity=args.min_personal_info_similarity,
+                band_size=args.sketch_band_size,
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+        finally:
+            hashes1.close()
+            hashes2.close()
 
-    find_and_write_matches(hashes1, hashes2, args.output_file)
+    if memory_budget:
+        print(f"Peak memory: {peak_memory_bytes() / (1 << 20):.1f} MiB (budget {memory_budget / (1 << 20):.1f} MiB)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,347 @@
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from digest_index import IDENTIFIERS
+from hashed_file import DigestParameters, HashedTable, convert_hashed_file, read_hashed_file
+from vectorized_join import column_entries
+
+# Layout of an index directory: manifest.json lists the segments in append order, and every segment
+# directory holds a binary hashed copy of its rows (rows.bin), then per identifier its distinct digests
+# in sorted order with, for each, the local ids of the rows that have it (<name>.digests.npy,
+# <name>.offsets.npy and <name>.rows.npy, in CSR layout), and the sorted 64-bit keys of its pseudonyms
+# with their rows (pseudonyms.keys.npy, pseudonyms.rows.npy). A segment appended from a delta also lists
+# the global ids of the older rows it replaces (supersedes.npy). Global row ids number the rows of all
+# segments in manifest order. The manifest is rewritten last, atomically, so an interrupted append
+# leaves the previous index intact.
+MANIFEST_FILE = "manifest.json"
+INDEX_FORMAT_VERSION = 1
+ROWS_FILE = "rows.bin"
+SUPERSEDES_FILE = "supersedes.npy"
+IDENTIFIER_FILES = {"Phone Match": "phone", "Email Match": "email", "Personal Info Match": "personal_info"}
+
+
+def is_match_index(path: str) -> bool:
+    """Return whether a path is a saved match index directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def pseudonym_key(pseudonym: str) -> int:
+    """Return the 64-bit key a pseudonym is indexed under; keys may collide, so candidates are verified."""
+    return int.from_bytes(hashlib.blake2b(pseudonym.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    with open(path, "wb") as file:
+        np.save(file, array)
+
+
+def _write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    temporary_path = os.path.join(index_dir, MANIFEST_FILE + ".tmp")
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary_path, os.path.join(index_dir, MANIFEST_FILE))
+
+
+def _write_segment(segment_dir: str, hashed_file: str) -> HashedTable:
+    """
+    Copy a hashed file into a new segment directory and write its identifier and pseudonym indexes.
+
+    Returns:
+        The memory-mapped rows of the segment; the caller closes it
+    """
+    # A segment directory the manifest does not list is left over from an interrupted run
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    os.makedirs(segment_dir)
+    convert_hashed_file(hashed_file, os.path.join(segment_dir, ROWS_FILE), "binary")
+    table = read_hashed_file(os.path.join(segment_dir, ROWS_FILE))
+    for match_type, column_names in IDENTIFIERS:
+        entries = column_entries(table, column_names)
+        digests, inverse = np.unique(entries.digests, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind="stable")
+        offsets = np.zeros(len(digests) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(inverse.ravel(), minlength=len(digests)), out=offsets[1:])
+        name = IDENTIFIER_FILES[match_type]
+        _save_array(os.path.join(segment_dir, f"{name}.digests.npy"), digests)
+        _save_array(os.path.join(segment_dir, f"{name}.offsets.npy"), offsets)
+        _save_array(os.path.join(segment_dir, f"{name}.rows.npy"), (entries.positions // entries.width)[order])
+
+    keys = np.fromiter((pseudonym_key(table.pseudonym(row)) for row in range(len(table))), np.uint64, len(table))
+    order = np.argsort(keys, kind="stable")
+    _save_array(os.path.join(segment_dir, "pseudonyms.keys.npy"), keys[order])
+    _save_array(os.path.join(segment_dir, "pseudonyms.rows.npy"), order.astype(np.int64))
+    return table
+
+
+def _check_dataset(table: HashedTable, manifest: Dict[str, Any], hashed_file: str) -> None:
+    if table.digest_size < 8:
+        raise ValueError(f"{hashed_file} has {table.digest_size}-byte digests; indexes need at least 8 bytes")
+    for column_name in ("Email Hash", "Personal Info Hash"):
+        if column_name not in table.columns:
+            raise ValueError(f"Hashed dataset has no {column_name} column")
+    # Indexes made before digest keys were recorded hold unkeyed digests
+    for key in ("columns", "algorithm", "digest_size", "key_id"):
+        if manifest and getattr(table, key) != manifest.get(key):
+            raise ValueError(
+                f"{hashed_file} has {key} {getattr(table, key)!r}, but the index was built with {manifest.get(key)!r}"
+            )
+
+
+class SegmentDigests:
+    """The sorted digests of one identifier in one segment, with the local ids of the rows that have them."""
+
+    def __init__(self, segment_dir: str, name: str) -> None:
+        self.digests = np.load(os.path.join(segment_dir, f"{name}.digests.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(segment_dir, f"{name}.offsets.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(segment_dir, f"{name}.rows.npy"), mmap_mode="r")
+
+    def find(self, digest: bytes) -> int:
+        """Return the position of a digest in the sorted digests, or -1 if the segment does not have it."""
+        if not len(self.digests) or len(digest) != self.digests.dtype.itemsize:
+            return -1
+        key = np.void(digest)
+        position = int(np.searchsorted(self.digests, key))
+        return position if position < len(self.digests) and self.digests[position] == key else -1
+
+    def get(self, digest: bytes) -> np.ndarray:
+        """Return the local ids of the rows that have a digest, in scan order."""
+        position = self.find(digest)
+        return self.rows[0:0] if position < 0 else self.rows[self.offsets[position] : self.offsets[position + 1]]
+
+
+class SavedDigestIndex:
+    """
+    Lookups of one identifier across all segments of a saved index, in global row ids, skipping superseded
+    rows. Offers the lookups of DigestIndex that the streaming matcher uses.
+    """
+
+    def __init__(self, index: "MatchIndex", segments: List[SegmentDigests]) -> None:
+        self.index = index
+        self.segments = segments
+
+    def __contains__(self, digest: bytes) -> bool:
+        return bool(self.get(digest))
+
+    def count(self, digest: bytes) -> int:
+        """Return the number of live entries of a digest."""
+        return len(self.get(digest))
+
+    def get(self, digest: bytes) -> List[int]:
+        """Return the global ids of the live rows that have a digest, in scan order, or an empty list."""
+        rows: List[int] = []
+        for start, segment in zip(self.index.starts, self.segments):
+            local_rows = segment.get(digest)
+            if len(local_rows):
+                rows.extend((local_rows + start).tolist())
+        if self.index.superseded and rows:
+            rows = [row for row in rows if row not in self.index.superseded]
+        return rows
+
+
+class MatchIndex:
+    """
+    A saved match index, opened read-only with every array memory-mapped.
+
+    Offers the pseudonym lookup of HashedTable and, through identifier_indexes, the digest lookups of
+    build_indexes, so the streaming matcher can probe it in place of an in-memory build side.
+    """
+
+    def __init__(self, index_dir: str) -> None:
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding="utf-8") as file:
+            self.manifest: Dict[str, Any] = json.load(file)
+        if self.manifest["version"] != INDEX_FORMAT_VERSION:
+            raise ValueError(
+                f"{index_dir} uses match index version {self.manifest['version']}, expected {INDEX_FORMAT_VERSION}"
+            )
+        self.columns: List[str] = self.manifest["columns"]
+        self.algorithm: str = self.manifest["algorithm"]
+        self.digest_size: int = self.manifest["digest_size"]
+        self.key_id: Optional[str] = self.manifest.get("key_id")
+
+        self.tables: List[HashedTable] = []
+        self.starts: List[int] = []
+        self.superseded: Set[int] = set()
+        row_count = 0
+        for segment in self.manifest["segments"]:
+            segment_dir = os.path.join(index_dir, segment["name"])
+            self.tables.append(read_hashed_file(os.path.join(segment_dir, ROWS_FILE)))
+            self.starts.append(row_count)
+            row_count += segment["rows"]
+            if os.path.exists(os.path.join(segment_dir, SUPERSEDES_FILE)):
+                self.superseded.update(np.load(os.path.join(segment_dir, SUPERSEDES_FILE)).tolist())
+        self.row_count = row_count
+
+    def __len__(self) -> int:
+        # Only the rows not replaced by a later delta are matched
+        return self.row_count - len(self.superseded)
+
+    def digest_parameters(self) -> DigestParameters:
+        """Return how the digests of the indexed dataset were computed."""
+        return DigestParameters(self.algorithm, self.digest_size, self.key_id)
+
+    def segment_dir(self, segment: int) -> str:
+        """Return the directory of a segment."""
+        return os.path.join(self.index_dir, self.manifest["segments"][segment]["name"])
+
+    def pseudonym(self, row_id: int) -> str:
+        """Return the pseudonym of a global row."""
+        segment = bisect.bisect_right(self.starts, row_id) - 1
+        return self.tables[segment].pseudonym(row_id - self.starts[segment])
+
+    def identifier_indexes(self) -> List[SavedDigestIndex]:
+        """Return the digest lookups of every identifier, in the order of IDENTIFIERS."""
+        return [
+            SavedDigestIndex(
+                self,
+                [
+                    SegmentDigests(self.segment_dir(segment), IDENTIFIER_FILES[match_type])
+                    for segment in range(len(self.tables))
+                ],
+            )
+            for match_type, _ in IDENTIFIERS
+        ]
+
+    def rows_of(self, pseudonyms: Set[str]) -> List[int]:
+        """Return the global ids of the live rows of some pseudonyms."""
+        if not pseudonyms:
+            return []
+        keys = np.unique(np.fromiter(map(pseudonym_key, pseudonyms), np.uint64, len(pseudonyms)))
+        rows = []
+        for segment, (start, table) in enumerate(zip(self.starts, self.tables)):
+            segment_dir = self.segment_dir(segment)
+            sorted_keys = np.load(os.path.join(segment_dir, "pseudonyms.keys.npy"), mmap_mode="r")
+            key_rows = np.load(os.path.join(segment_dir, "pseudonyms.rows.npy"), mmap_mode="r")
+            firsts = np.searchsorted(sorted_keys, keys, side="left")
+            lasts = np.searchsorted(sorted_keys, keys, side="right")
+            for first, last in zip(firsts[firsts < lasts].tolist(), lasts[firsts < lasts].tolist()):
+                for local_row in key_rows[first:last].tolist():
+                    if table.pseudonym(local_row) in pseudonyms and start + local_row not in self.superseded:
+                        rows.append(start + local_row)
+        return sorted(rows)
+
+    def close(self) -> None:
+        """Release the memory maps of the segment rows."""
+        for table in self.tables:
+            table.close()
+
+
+def build_index(hashed_file: str, index_dir: str) -> int:
+    """
+    Save the identifier indexes of a hashed dataset to a new index directory.
+
+    Args:
+        hashed_file: Path to the hashed dataset, CSV or binary
+        index_dir: Directory to create the index in; it must not hold an index already
+
+    Returns:
+        The number of rows indexed
+
+    Raises:
+        ValueError: If the directory already holds an index, or the dataset cannot be indexed.
+    """
+    if is_match_index(index_dir):
+        raise ValueError(f"{index_dir} already holds a match index; append deltas to it instead")
+    os.makedirs(index_dir, exist_ok=True)
+    name = "segment-0000"
+    table = _write_segment(os.path.join(index_dir, name), hashed_file)
+    try:
+        try:
+            _check_dataset(table, {}, hashed_file)
+        except ValueError:
+            shutil.rmtree(os.path.join(index_dir, name))
+            raise
+        manifest: Dict[str, Any] = {
+            "version": INDEX_FORMAT_VERSION,
+            "algorithm": table.algorithm,
+            "digest_size": table.digest_size,
+            "key_id": table.key_id,
+            "columns": table.columns,
+            "segments": [{"name": name, "rows": len(table), "source": os.path.abspath(hashed_file)}],
+        }
+    finally:
+        table.close()
+    _write_manifest(index_dir, manifest)
+    return manifest["segments"][0]["rows"]
+
+
+def append_delta(index_dir: str, delta_file: str) -> Tuple[int, int]:
+    """
+    Append the new and changed rows of a delta hashed file to a saved index, without rebuilding it.
+
+    The rows of the delta replace all earlier rows of the same pseudonyms, which stay on disk but are no
+    longer matched.
+
+    Args:
+        index_dir: The index directory
+        delta_file: Path to the delta hashed file, with the columns and digest format of the index
+
+    Returns:
+        The number of rows appended and the number of earlier rows they replace
+
+    Raises:
+        ValueError: If the delta does not have the columns or digest format of the index.
+    """
+    index = MatchIndex(index_dir)
+    try:
+        name = f"segment-{len(index.manifest['segments']):04d}"
+        segment_dir = os.path.join(index_dir, name)
+        table = _write_segment(segment_dir, delta_file)
+        try:
+            try:
+                _check_dataset(table, index.manifest, delta_file)
+            except ValueError:
+                shutil.rmtree(segment_dir)
+                raise
+            superseded = index.rows_of({table.pseudonym(row) for row in range(len(table))})
+            delta_rows = len(table)
+        finally:
+            table.close()
+        _save_array(os.path.join(segment_dir, SUPERSEDES_FILE), np.array(superseded, dtype=np.int64))
+        manifest = dict(index.manifest)
+        manifest["segments"] = [
+            *index.manifest["segments"],
+            {"name": name, "rows": delta_rows, "source": os.path.abspath(delta_file)},
+        ]
+    finally:
+        index.close()
+    _write_manifest(index_dir, manifest)
+    return delta_rows, len(superseded)
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Save the identifier indexes of hashed datasets for matching")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build-index", help="Index a hashed dataset into a new index directory")
+    build_parser.add_argument("--hashed-file", required=True, help="Hashed dataset to index, CSV or binary")
+    build_parser.add_argument("--index-dir", required=True, help="Directory to save the index in")
+    append_parser = subparsers.add_parser(
+        "append", help="Append the new and changed rows of a delta hashed file to an index"
+    )
+    append_parser.add_argument("--index-dir", required=True, help="Directory of the index to update")
+    append_parser.add_argument("--delta-file", required=True, help="Hashed file of new and changed rows")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build-index":
+            rows = build_index(args.hashed_file, args.index_dir)
+            print(f"Indexed {rows} rows of {args.hashed_file} into {args.index_dir}")
+        else:
+            if not is_match_index(args.index_dir):
+                parser.error(f"{args.index_dir} is not a match index directory")
+            rows, replaced = append_delta(args.index_dir, args.delta_file)
+            print(f"Appended {rows} rows of {args.delta_file} to {args.index_dir}, replacing {replaced} rows")
+    except ValueError as error:
+        print(f"Error: {error}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import signal
+import traceback
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit
+
+import match_hashes
+from digest_index import DigestLookup
+from hashed_file import (
+    HASH_COLUMNS,
+    PSEUDONYM_COLUMN,
+    DigestParameters,
+    HashedRow,
+    HashedTable,
+    require_same_digests,
+)
+from match_hashes import FanoutCap, open_build_side, probe_hashed_rows
+from match_index import MatchIndex
+from match_store import OUTPUT_HEADER, MatchStore
+from metrics import Metrics, clock
+
+# A long-running match service: the indexes of one dataset are loaded once and kept in memory, and batches
+# of hashed rows are matched against them over HTTP on a local TCP port or a Unix socket.
+#
+#   POST /match   a hashed CSV batch (the Pseudonym and hash columns, hex digests) in the body and its
+#                 digest parameters in the X-Digest-* headers; answers with the match results in the CSV
+#                 format of match_hashes.py
+#   POST /reload  loads the dataset again, or another one of the --reload-dir directory given as
+#                 {"path": ...} in a JSON body, and swaps it in once it is indexed; requests keep being
+#                 answered from the old one meanwhile
+#   GET /stats    the index in use and the latency and throughput counters, as JSON
+#
+# SIGHUP reloads the dataset too. Batches are matched in worker threads, so requests are answered
+# while others are matched or a reload is indexing.
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 256 << 20
+MAX_HEADER_LINES = 100
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+# Request headers giving the digest parameters of a batch, as in the digest manifest of a CSV hashed file;
+# a batch without a key identifier is unkeyed
+ALGORITHM_HEADER = "x-digest-algorithm"
+DIGEST_SIZE_HEADER = "x-digest-size"
+KEY_ID_HEADER = "x-digest-key-id"
+
+
+class HttpError(Exception):
+    """An error answered with an HTTP status and a plain text message."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class LoadedDataset:
+    """
+    A dataset loaded and indexed for probing, with the number of requests using it, so a dataset replaced
+    by a reload is only closed once its last request is answered.
+    """
+
+    def __init__(self, path: str, generation: int) -> None:
+        self.build: Union[HashedTable, MatchIndex]
+        self.indexes: Sequence[DigestLookup]
+        self.build, self.indexes = open_build_side(path)
+        self.path = path
+        self.generation = generation
+        self.loaded_at = datetime.datetime.now(datetime.timezone.utc)
+        self.users = 0
+        self.retired = False
+
+    def release(self) -> None:
+        """End a request using the dataset."""
+        self.users -= 1
+        if self.retired and not self.users:
+            self.build.close()
+
+    def retire(self) -> None:
+        """Stop using the dataset for new requests, and close it once no request uses it."""
+        self.retired = True
+        if not self.users:
+            self.build.close()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "generation": self.generation,
+            "rows": len(self.build),
+            "digests": self.build.digest_parameters().describe(),
+            "loaded_at": self.loaded_at.isoformat(timespec="seconds"),
+        }
+
+
+def batch_digest_parameters(headers: Dict[str, str]) -> DigestParameters:
+    """
+    Return the digest parameters of a batch from the lower-cased headers of its request.
+
+    Raises:
+        ValueError: If the algorithm or the digest size is missing, or the digest size is not a number.
+    """
+    if ALGORITHM_HEADER not in headers or DIGEST_SIZE_HEADER not in headers:
+        raise ValueError("Give the digest parameters of the batch in the X-Digest-Algorithm and X-Digest-Size headers")
+    try:
+        digest_size = int(headers[DIGEST_SIZE_HEADER])
+    except ValueError:
+        raise ValueError(f"Malformed X-Digest-Size header: {headers[DIGEST_SIZE_HEADER]}") from None
+    return DigestParameters(headers[ALGORITHM_HEADER], digest_size, headers.get(KEY_ID_HEADER) or None)
+
+
+def parse_probe_batch(body: bytes, digest_size: int) -> Tuple[List[str], List[HashedRow]]:
+    """
+    Parse a batch of probe rows in the hashed CSV format.
+
+    Returns:
+        The hash columns of the batch and its rows, as the pseudonym and raw digests (b"" for blank values)
+
+    Raises:
+        ValueError: If the batch has no pseudonym column, a row has no pseudonym, or a digest is not hex of
+            the digest size.
+    """
+    reader = csv.reader(io.StringIO(body.decode("utf-8")))
+    fieldnames = next(reader, [])
+    if PSEUDONYM_COLUMN not in fieldnames:
+        raise ValueError(f"The batch has no {PSEUDONYM_COLUMN} column")
+    pseudonym_index = fieldnames.index(PSEUDONYM_COLUMN)
+    columns = [name for name in fieldnames if name in HASH_COLUMNS]
+    column_indices = [fieldnames.index(name) for name in columns]
+    rows: List[HashedRow] = []
+    for line, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        if pseudonym_index >= len(row):
+            raise ValueError(f"Line {line} of the batch has no {PSEUDONYM_COLUMN} value")
+        digests = []
+        for index in column_indices:
+            value = row[index] if index < len(row) else ""
+            try:
+                digest = bytes.fromhex(value)
+            except ValueError:
+                raise ValueError(f"Line {line} of the batch has a digest that is not hex") from None
+            if digest and len(digest) != digest_size:
+                raise ValueError(
+                    f"Line {line} of the batch has a {len(digest)}-byte digest; the dataset has {digest_size}-byte "
+                    "digests"
+                )
+            digests.append(digest)
+        rows.append((row[pseudonym_index], digests))
+    return columns, rows
+
+
+class MatchService:
+    """
+    Matches batches of hashed rows against the resident indexes of a dataset, and reloads the dataset on
+    request.
+
+    The dataset is the first dataset of the results by default, or the second with index_side 2. Results
+    come in batch order, as in streaming matching: a pseudonym repeated on several rows of a batch gets
+    one result row each. Other datasets can only be reloaded from reload_dir.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_side: int = 1,
+        max_fanouts: Optional[Dict[str, int]] = None,
+        reload_dir: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.reload_dir = os.path.realpath(reload_dir) if reload_dir else None
+        self.index_side = index_side
+        self.max_fanouts = max_fanouts or {}
+        self.dataset: Optional[LoadedDataset] = None
+        self.metrics = Metrics("match_server")
+        self.in_flight = 0
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    async def reload(self, path: Optional[str] = None) -> LoadedDataset:
+        """
+        Load and index the dataset, or another one, in a worker thread, then swap it in.
+
+        Raises:
+            ValueError: If the dataset has no email or personal info column.
+            OSError: If the dataset cannot be read.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            path = path or self.path
+            generation = self.dataset.generation + 1 if self.dataset else 1
+            start = clock()
+            loaded = await asyncio.get_running_loop().run_in_executor(None, LoadedDataset, path, generation)
+            self.metrics.observe("reload", start)
+            previous, self.dataset, self.path = self.dataset, loaded, path
+            if previous is not None:
+                previous.retire()
+            print(f"Loaded {len(loaded.build)} rows of {path} (generation {generation})")
+            return loaded
+
+    def resolve_reload_path(self, path: str) -> str:
+        """
+        Return the path of another dataset to reload, relative to the reload directory or absolute.
+
+        Raises:
+            HttpError: If no reload directory is configured, or the path is outside it.
+        """
+        if self.reload_dir is None:
+            raise HttpError(403, "Reloading another dataset needs the server to be started with --reload-dir")
+        resolved = os.path.realpath(os.path.join(self.reload_dir, path))
+        if os.path.commonpath([resolved, self.reload_dir]) != self.reload_dir:
+            raise HttpError(403, f"{path} is outside the reload directory")
+        return resolved
+
+    def match_batch(
+        self, dataset: LoadedDataset, columns: List[str], rows: List[HashedRow]
+    ) -> Tuple[List[List[str]], int, int]:
+        """
+        Match a batch against a dataset, in a worker thread.
+
+        Returns:
+            The result rows, the number of matched pairs and the number of hashes skipped by the fan-out caps
+
+        Raises:
+            ValueError: If the batch has no email or personal info column.
+        """
+        matches = MatchStore()
+        fanout_cap = FanoutCap(self.max_fanouts) if self.max_fanouts else None
+        probe = probe_hashed_rows(
+            dataset.build, dataset.indexes, self.index_side, columns, lambda: rows, matches, fanout_cap, False
+        )
+        result_rows: List[List[str]] = []
+        for _ in probe:
+            # The pairs of every probe row are collected as they are found, as stream_matches writes them
+            result_rows.extend(matches.rows())
+            matches.clear()
+        return result_rows, matches.total_pairs, len(fanout_cap.hot_keys) if fanout_cap else 0
+
+    async def match(self, body: bytes, headers: Dict[str, str]) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Match a batch in the CSV body of a request, returning the CSV results and extra response headers.
+
+        The batch must have been hashed with the digest parameters of the dataset, as given in its headers.
+        """
+        dataset = self.dataset
+        if dataset is None:
+            raise HttpError(400, "No dataset is loaded")
+        parameters = dataset.build.digest_parameters()
+        try:
+            require_same_digests([("the served dataset", parameters), ("the batch", batch_digest_parameters(headers))])
+            columns, rows = parse_probe_batch(body, parameters.digest_size)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HttpError(400, str(e)) from None
+        start = clock()
+        dataset.users += 1
+        try:
+            result_rows, pairs, hot_keys = await asyncio.get_running_loop().run_in_executor(
+                None, self.match_batch, dataset, columns, rows
+            )
+        except ValueError as e:
+            raise HttpError(400, str(e)) from None
+        finally:
+            dataset.release()
+        self.metrics.observe("match", start)
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(OUTPUT_HEADER)
+        writer.writerows(result_rows)
+        with self.metrics.lock:
+            self.metrics.rows += len(rows)
+            counters = self.metrics.counters
+            counters["batches"] = counters.get("batches", 0) + 1
+            counters["matched_pairs"] = counters.get("matched_pairs", 0) + pairs
+            counters["hot_hashes_skipped"] = counters.get("hot_hashes_skipped", 0) + hot_keys
+        headers = {
+            "X-Dataset-Generation": str(dataset.generation),
+            "X-Probe-Rows": str(len(rows)),
+            "X-Matched-Pairs": str(pairs),
+        }
+        return output.getvalue().encode("utf-8"), headers
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the dataset in use and the counters of the service."""
+        stats = self.metrics.to_dict()
+        stats["dataset"] = self.dataset.describe() if self.dataset else None
+        stats["in_flight"] = self.in_flight
+        return stats
+
+    async def dispatch(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, str, bytes, Dict[str, str]]:
+        """Answer a request: return the status, content type, body and extra headers of the response."""
+        if path == "/match":
+            if method != "POST":
+                raise HttpError(405, "Use POST /match with a hashed CSV batch")
+            results, response_headers = await self.match(body, headers)
+            return 200, "text/csv", results, response_headers
+        if path == "/reload":
+            if method != "POST":
+                raise HttpError(405, "Use POST /reload")
+            try:
+                reload_path = json.loads(body).get("path") if body.strip() else None
+            except (ValueError, AttributeError):
+                raise HttpError(400, 'The body of /reload must be empty or {"path": ...}') from None
+            if reload_path is not None:
+                reload_path = self.resolve_reload_path(str(reload_path))
+            try:
+                loaded = await self.reload(reload_path)
+            except (OSError, ValueError) as e:
+                raise HttpError(400, f"Reload failed, still serving the previous dataset: {e}") from None
+            return 200, "application/json", json.dumps(loaded.describe()).encode("utf-8"), {}
+        if path == "/stats":
+            if method != "GET":
+                raise HttpError(405, "Use GET /stats")
+            return 200, "application/json", json.dumps(self.stats(), indent=2).encode("utf-8"), {}
+        raise HttpError(404, f"Unknown path {path}; use /match, /reload or /stats")
+
+    def count_error(self) -> None:
+        """Count a request answered with an error."""
+        with self.metrics.lock:
+            self.metrics.counters["errors"] = self.metrics.counters.get("errors", 0) + 1
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the HTTP/1.1 requests of a connection, keeping it open between requests."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                path = urlsplit(target).path
+                start = clock()
+                self.in_flight += 1
+                try:
+                    status, content_type, response, extra_headers = await self.dispatch(method, path, headers, body)
+                except HttpError as e:
+                    status, content_type, response, extra_headers = e.status, "text/plain", f"Error: {e}\n".encode(), {}
+                except Exception:
+                    # A bug in answering one request must not take down the connection without an answer
+                    traceback.print_exc()
+                    status, content_type, response, extra_headers = 500, "text/plain", b"Error: Internal error\n", {}
+                finally:
+                    self.in_flight -= 1
+                name = path.strip("/") if path in ("/match", "/reload", "/stats") else "other"
+                self.metrics.observe(f"request_{name}", start)
+                if status != 200:
+                    self.count_error()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, content_type, response, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            # The request could not be read, so the connection is out of step and closed after the answer
+            self.count_error()
+            write_response(writer, e.status, "text/plain", f"Error: {e}\n".encode(), {}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            traceback.print_exc()
+            self.count_error()
+            write_response(writer, 500, "text/plain", b"Error: Internal error\n", {}, False)
+        finally:
+            writer.close()
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    """Read a line of the request head."""
+    try:
+        return await reader.readline()
+    except ValueError:  # the line is longer than the buffer limit of the stream
+        raise HttpError(400, "Request line or header line too long") from None
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """
+    Read an HTTP/1.1 request: its method, target, lower-cased headers and body, or None at the end of the
+    connection.
+
+    Raises:
+        HttpError: If the request is malformed or its body too large.
+    """
+    request_line = await _read_line(reader)
+    if not request_line.strip():
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise HttpError(400, "Malformed request line")
+    method, target, _ = parts
+    headers: Dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = (await _read_line(reader)).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(400, "Too many header lines")
+    if "transfer-encoding" in headers:
+        raise HttpError(400, "Chunked request bodies are not supported; send a Content-Length")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Malformed Content-Length") from None
+    if length < 0:
+        raise HttpError(400, "Malformed Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    content_type: str,
+    body: bytes,
+    extra_headers: Dict[str, str],
+    keep_alive: bool,
+) -> None:
+    """Write an HTTP/1.1 response."""
+    headers = {
+        "Content-Type": content_type,
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **extra_headers,
+    }
+    head = f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+
+async def serve(
+    service: MatchService, host: str = "127.0.0.1", port: int = DEFAULT_PORT, unix_socket: Optional[str] = None
+) -> None:
+    """Load the dataset and answer requests until the process is stopped; SIGHUP reloads the dataset."""
+    await service.reload()
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, "SIGHUP"):
+
+        def reload_on_signal() -> None:
+            async def reload() -> None:
+                try:
+                    await service.reload()
+                except (OSError, ValueError) as e:
+                    print(f"Reload failed, still serving the previous dataset: {e}")
+
+            loop.create_task(reload())
+
+        loop.add_signal_handler(signal.SIGHUP, reload_on_signal)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_socket)
+        print(f"Serving matches on unix socket {unix_socket}")
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving matches on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description="Serve matches against the resident indexes of a hashed dataset over local HTTP."
+    )
+    parser.add_argument(
+        "--hashed-file",
+        type=str,
+        required=True,
+        help="Dataset to match batches against: a hashed file, loaded and indexed in memory, or a match_index.py "
+        "index directory, probed in place",
+    )
+    parser.add_argument(
+        "--index-side",
+        type=int,
+        choices=(1, 2),
+        default=1,
+        help="Which dataset of the match results the served dataset is; batches are the other one (default: 1)",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"TCP port to listen on (default: {DEFAULT_PORT})"
+    )
+    parser.add_argument("--unix-socket", type=str, help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument(
+        "--reload-dir",
+        type=str,
+        help="Allow POST /reload to switch to another dataset in this directory (default: only reload the "
+        "served dataset)",
+    )
+    match_hashes.add_fanout_arguments(parser)
+    args = parser.parse_args()
+    max_fanouts = match_hashes.max_fanouts_from_arguments(parser, args)
+    if not os.path.exists(args.hashed_file):
+        parser.error(f"File not found: {args.hashed_file}")
+
+    if args.reload_dir and not os.path.isdir(args.reload_dir):
+        parser.error(f"Not a directory: {args.reload_dir}")
+
+    service = MatchService(args.hashed_file, args.index_side, max_fanouts, args.reload_dir)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix_socket))
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
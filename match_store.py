@@ -0,0 +1,184 @@
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+OUTPUT_HEADER = [
+    "Pseudonym1",
+    "Pseudonym2",
+    "Phone Match",
+    "Email Match",
+    "Personal Info Match",
+    "Matched Phone Hashes",
+    "Matched Personal Info Hash",
+    "Matched Email Hash",
+]
+MATCH_TYPES = ["Phone Match", "Email Match", "Personal Info Match"]
+# With approximate matching, the output has the similarity of the personal info sketches of every pair after
+# its match types, and the summary counts the pairs with similar personal info
+SIMILARITY_COLUMN = "Personal Info Similarity"
+APPROXIMATE_MATCH_TYPE = "Approximate Personal Info Match"
+# Bit of every match type in the match type mask of a pair
+MATCH_BITS = {match_type: 1 << bit for bit, match_type in enumerate(MATCH_TYPES)}
+
+# Pseudonym ids are packed into a single integer key per pair
+_ID_BITS = 32
+NO_DIGEST = -1
+NO_SIMILARITY = -1.0
+
+
+def output_header(approximate: bool = False) -> List[str]:
+    """Return the header of the match results, with the similarity column when matching approximately."""
+    if not approximate:
+        return OUTPUT_HEADER
+    position = OUTPUT_HEADER.index(MATCH_TYPES[-1]) + 1
+    return [*OUTPUT_HEADER[:position], SIMILARITY_COLUMN, *OUTPUT_HEADER[position:]]
+
+
+class MatchStore:
+    """
+    Compact store of match results, one entry per pair of pseudonyms, in the order pairs were first matched.
+
+    Pseudonyms are interned once and matched digests kept once per pair, both referenced by integer id, and
+    every pair is a row of parallel integer arrays: the two pseudonym ids, a bitmask of its match types, the
+    ids of its email and personal info digests and of its first phone digest. The rare pairs that matched on
+    several phone digests keep the others in a side table. The summary counts are kept up to date as pairs
+    are recorded.
+
+    Once similarities are tracked, every pair also has the similarity of its personal info sketches, recorded
+    for the pairs approximate matching found, and the rows have the similarity column.
+    """
+
+    def __init__(self) -> None:
+        self.approximate = False
+        self.total_pairs = 0
+        self.match_type_counts = {match_type: 0 for match_type in MATCH_TYPES}
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def _intern_pseudonym(self, side: int, pseudonym: str) -> int:
+        pseudonym_ids = self._pseudonym_ids[side]
+        pseudonym_id = pseudonym_ids.get(pseudonym)
+        if pseudonym_id is None:
+            pseudonym_id = pseudonym_ids[pseudonym] = len(self.pseudonyms[side])
+            self.pseudonyms[side].append(pseudonym)
+        return pseudonym_id
+
+    def _add_digest(self, digest: bytes) -> int:
+        self.digests.append(digest)
+        return len(self.digests) - 1
+
+    def _pair(self, pseudonym1: str, pseudonym2: str) -> int:
+        """Return the id of a pair, adding it if it has not been recorded yet."""
+        key = self._intern_pseudonym(0, pseudonym1) << _ID_BITS | self._intern_pseudonym(1, pseudonym2)
+        pair = self._pairs.get(key)
+        if pair is None:
+            pair = self._pairs[key] = len(self.masks)
+            self.ids1.append(key >> _ID_BITS)
+            self.ids2.append(key & ((1 << _ID_BITS) - 1))
+            self.masks.append(0)
+            self.phone_digests.append(NO_DIGEST)
+            self.email_digests.append(NO_DIGEST)
+            self.personal_info_digests.append(NO_DIGEST)
+            if self.approximate:
+                self.similarities.append(NO_SIMILARITY)
+            self.total_pairs += 1
+        return pair
+
+    def record(self, pseudonym1: str, pseudonym2: str, match_type: str, digest: bytes) -> None:
+        """
+        Record that a pair of pseudonyms matched on a hashed identifier.
+
+        Args:
+            pseudonym1: Pseudonym of the record from the first dataset
+            pseudonym2: Pseudonym of the record from the second dataset
+            match_type: "Phone Match", "Email Match" or "Personal Info Match"
+            digest: The matched digest
+        """
+        pair = self._pair(pseudonym1, pseudonym2)
+        bit = MATCH_BITS[match_type]
+        if not self.masks[pair] & bit:
+            self.masks[pair] |= bit
+            self.match_type_counts[match_type] += 1
+        if match_type == "Phone Match":
+            if self.phone_digests[pair] == NO_DIGEST:
+                self.phone_digests[pair] = self._add_digest(digest)
+            elif digest not in self.phone_hashes(pair):
+                self._more_phone_digests.setdefault(pair, []).append(self._add_digest(digest))
+        elif match_type == "Email Match":
+            self._set_digest(self.email_digests, pair, digest)
+        else:
+            self._set_digest(self.personal_info_digests, pair, digest)
+
+    def track_similarities(self) -> None:
+        """Start tracking personal info similarities, with none for the pairs recorded so far."""
+        if not self.approximate:
+            self.approximate = True
+            self.similarities = array("d", [NO_SIMILARITY]) * len(self)
+            self.match_type_counts[APPROXIMATE_MATCH_TYPE] = 0
+
+    def record_similarity(self, pseudonym1: str, pseudonym2: str, similarity: float) -> None:
+        """Record the personal info similarity of a pair of pseudonyms, once similarities are tracked."""
+        pair = self._pair(pseudonym1, pseudonym2)
+        if self.similarities[pair] == NO_SIMILARITY:
+            self.match_type_counts[APPROXIMATE_MATCH_TYPE] += 1
+        self.similarities[pair] = max(self.similarities[pair], similarity)
+
+    def _set_digest(self, digest_ids: array, pair: int, digest: bytes) -> None:
+        # A pair that matches again on the same digest keeps its reference instead of adding a copy
+        digest_id = digest_ids[pair]
+        if digest_id == NO_DIGEST or self.digests[digest_id] != digest:
+            digest_ids[pair] = self._add_digest(digest)
+
+    def pair_pseudonyms(self, pair: int) -> Tuple[str, str]:
+        """Return the pseudonyms of a pair."""
+        return self.pseudonyms[0][self.ids1[pair]], self.pseudonyms[1][self.ids2[pair]]
+
+    def phone_hashes(self, pair: int) -> List[bytes]:
+        """Return the distinct phone digests a pair matched on, in sorted order."""
+        if self.phone_digests[pair] == NO_DIGEST:
+            return []
+        digest_ids = [self.phone_digests[pair]] + self._more_phone_digests.get(pair, [])
+        return sorted(self.digests[digest_id] for digest_id in digest_ids)
+
+    def _digest_hex(self, digest_id: int) -> str:
+        return "" if digest_id == NO_DIGEST else self.digests[digest_id].hex()
+
+    def row(self, pair: int) -> List[str]:
+        """
+        Format the match result of a pair as an output row.
+
+        Matched phone hashes are written in sorted order, so the output does not depend on matching order.
+        """
+        mask = self.masks[pair]
+        similarity = []
+        if self.approximate:
+            similarity = [f"{self.similarities[pair]:.3f}" if self.similarities[pair] != NO_SIMILARITY else ""]
+        return [
+            *self.pair_pseudonyms(pair),
+            *("Yes" if mask & MATCH_BITS[match_type] else "No" for match_type in MATCH_TYPES),
+            *similarity,
+            "|".join(phone.hex() for phone in self.phone_hashes(pair)),
+            self._digest_hex(self.personal_info_digests[pair]),
+            self._digest_hex(self.email_digests[pair]),
+        ]
+
+    def rows(self) -> Iterator[List[str]]:
+        """Yield the output rows of all pairs, in the order the pairs were first matched."""
+        for pair in range(len(self)):
+            yield self.row(pair)
+
+    def clear(self) -> None:
+        """Drop the stored pairs, keeping the summary counts of everything recorded so far."""
+        self.pseudonyms: Tuple[List[str], List[str]] = ([], [])
+        self.digests: List[bytes] = []
+        self.ids1 = array("q")
+        self.ids2 = array("q")
+        self.masks = bytearray()
+        self.phone_digests = array("q")
+        self.email_digests = array("q")
+        self.personal_info_digests = array("q")
+        self.similarities = array("d")
+        self._pseudonym_ids: Tuple[Dict[str, int], Dict[str, int]] = ({}, {})
+        self._pairs: Dict[int, int] = {}
+        self._more_phone_digests: Dict[int, List[int]] = {}
@@ -0,0 +1,282 @@
+import argparse
+import json
+import math
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from digest_index import IDENTIFIERS
+from hashed_file import (
+    OUTPUT_FORMATS,
+    DigestParameters,
+    HashedTable,
+    is_binary_hashed_file,
+    open_hashed_writer,
+    read_hashed_file,
+    require_same_digests,
+)
+from vectorized_join import FINGERPRINT_SIZE, column_entries
+
+# A membership filter is a Bloom filter of the distinct digests of every identifier of a hashed dataset,
+# so the other party can drop the rows of its own dataset that cannot match before sending them. Every
+# digest sets hash_count bits of the filter, at positions derived from its 8-byte fingerprint by double
+# hashing; digests are uniformly random already, so no further hashing is needed.
+#
+# File layout: MAGIC, then a JSON header padded with spaces to HEADER_SIZE bytes, then the bits of the
+# filter, eight per byte, lowest bit first.
+MAGIC = b"PSIBLOOM"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+IDENTIFIER_COLUMNS = [column for _, columns in IDENTIFIERS for column in columns]
+# Rows read at a time when adding or testing the digests of a dataset
+BLOCK_ROWS = 1 << 18
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _second_hashes(fingerprints: np.ndarray) -> np.ndarray:
+    """Return the odd step of the double hashing of every fingerprint: its SplitMix64 finalization."""
+    mixed = (fingerprints ^ (fingerprints >> np.uint64(30))) * _MIX1
+    mixed = (mixed ^ (mixed >> np.uint64(27))) * _MIX2
+    return (mixed ^ (mixed >> np.uint64(31))) | np.uint64(1)
+
+
+class MembershipFilter:
+    """
+    Bloom filter of the digests of a hashed dataset, with the digest parameters of the dataset.
+
+    A digest that was added is always reported as possibly present; a digest that was not is reported as
+    possibly present with about the false positive rate the filter was sized for.
+    """
+
+    def __init__(
+        self, bit_count: int, hash_count: int, parameters: DigestParameters, bits: Optional[bytes] = None
+    ) -> None:
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.parameters = parameters
+        self.item_count = 0
+        size = (bit_count + 7) // 8
+        self.bits = (
+            np.zeros(size, dtype=np.uint8) if bits is None else np.frombuffer(bits, dtype=np.uint8, count=size).copy()
+        )
+
+    @classmethod
+    def for_items(cls, item_count: int, false_positive_rate: float, parameters: DigestParameters) -> "MembershipFilter":
+        """
+        Return an empty filter sized for a number of distinct digests at a false positive rate.
+
+        Raises:
+            ValueError: If the false positive rate is not between 0 and 1.
+        """
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(f"The false positive rate must be between 0 and 1, got {false_positive_rate}")
+        items = max(item_count, 1)
+        bit_count = max(64, math.ceil(-items * math.log(false_positive_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / items * math.log(2)))
+        return cls(bit_count, hash_count, parameters)
+
+    def _positions(self, fingerprints: np.ndarray) -> np.ndarray:
+        """Return the bit positions of the fingerprints, one row of hash_count positions per fingerprint."""
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        return (fingerprints[:, None] + steps * _second_hashes(fingerprints)[:, None]) % np.uint64(self.bit_count)
+
+    def add(self, fingerprints: np.ndarray) -> None:
+        """Add digests, given as the 8-byte fingerprints of distinct digests."""
+        positions = np.unique(self._positions(fingerprints))
+        byte_positions = positions >> np.uint64(3)
+        values = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        starts = np.flatnonzero(np.r_[True, byte_positions[1:] != byte_positions[:-1]])
+        self.bits[byte_positions[starts]] |= np.bitwise_or.reduceat(values, starts)
+        self.item_count += len(fingerprints)
+
+    def might_contain(self, fingerprints: np.ndarray) -> np.ndarray:
+        """Return for every fingerprint whether its digest may have been added."""
+        positions = self._positions(fingerprints)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def false_positive_rate(self) -> float:
+        """Return the expected false positive rate with the digests added so far."""
+        return (1 - math.exp(-self.hash_count * self.item_count / self.bit_count)) ** self.hash_count
+
+    def header(self) -> Dict[str, Any]:
+        """Return the parameters of the filter, as stored in the header of a filter file."""
+        header: Dict[str, Any] = {
+            "version": FORMAT_VERSION,
+            "algorithm": self.parameters.algorithm,
+            "digest_size": self.parameters.digest_size,
+            "bit_count": self.bit_count,
+            "hash_count": self.hash_count,
+            "item_count": self.item_count,
+        }
+        if self.parameters.key_id:
+            header["key_id"] = self.parameters.key_id
+        return header
+
+    def save(self, file_path: str) -> None:
+        """Write the filter to a file."""
+        encoded = json.dumps(self.header()).encode("utf-8")
+        with open(file_path, "wb") as file:
+            file.write(MAGIC + encoded.ljust(HEADER_SIZE - len(MAGIC), b" "))
+            file.write(self.bits.tobytes())
+
+    @classmethod
+    def load(cls, file_path: str) -> "MembershipFilter":
+        """
+        Read a filter from a file.
+
+        Raises:
+            ValueError: If the file is not a membership filter file.
+        """
+        with open(file_path, "rb") as file:
+            data = file.read()
+        if data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{file_path} is not a membership filter file")
+        header = json.loads(data[len(MAGIC) : HEADER_SIZE].decode("utf-8"))
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{file_path} uses membership filter format version {header['version']}, expected {FORMAT_VERSION}"
+            )
+        parameters = DigestParameters(header["algorithm"], header["digest_size"], header.get("key_id"))
+        membership_filter = cls(header["bit_count"], header["hash_count"], parameters, data[HEADER_SIZE:])
+        membership_filter.item_count = header["item_count"]
+        return membership_filter
+
+
+def _require_fingerprints(hashes: HashedTable, file_path: str) -> None:
+    if hashes.digest_size < FINGERPRINT_SIZE:
+        raise ValueError(f"{file_path} has {hashes.digest_size}-byte digests; filters need at least {FINGERPRINT_SIZE}")
+
+
+def build_filter(
+    hashed_file: str, filter_file: str, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE
+) -> MembershipFilter:
+    """
+    Build the membership filter of the phone, email and personal info digests of a hashed dataset.
+
+    The filter is sized for the distinct digests of the dataset, so it takes about 1.44 * log2(1 / rate)
+    bits per distinct digest: 9.6 bits at 1%, 14.4 bits at 0.1%.
+
+    Raises:
+        ValueError: If the file is not a valid hashed file or the false positive rate is out of range.
+    """
+    hashes = read_hashed_file(hashed_file)
+    try:
+        _require_fingerprints(hashes, hashed_file)
+        blocks = [
+            np.unique(column_entries(hashes, IDENTIFIER_COLUMNS, start, start + BLOCK_ROWS).fingerprints)
+            for start in range(0, len(hashes), BLOCK_ROWS)
+        ]
+        fingerprints = np.unique(np.concatenate(blocks)) if blocks else np.empty(0, dtype=np.uint64)
+        membership_filter = MembershipFilter.for_items(
+            len(fingerprints), false_positive_rate, hashes.digest_parameters()
+        )
+        for start in range(0, len(fingerprints), BLOCK_ROWS):
+            membership_filter.add(fingerprints[start : start + BLOCK_ROWS])
+    finally:
+        hashes.close()
+    membership_filter.save(filter_file)
+    return membership_filter
+
+
+def apply_filter(filter_file: str, hashed_file: str, output_file: str, output_format: Optional[str] = None) -> int:
+    """
+    Write the rows of a hashed dataset that may match the dataset of a membership filter: the rows with a
+    phone, email or personal info digest the filter may contain. Rows that cannot match are left out.
+
+    Args:
+        filter_file: Path to the membership filter of the other dataset
+        hashed_file: Path to the hashed dataset to filter
+        output_file: Path of the hashed file of candidate rows, with all columns of the input
+        output_format: "csv" or "binary" (default: the format of the input)
+
+    Returns:
+        The number of candidate rows written
+
+    Raises:
+        ValueError: If the file is not a valid hashed file, or was hashed with other digest parameters than
+            the dataset of the filter.
+    """
+    membership_filter = MembershipFilter.load(filter_file)
+    hashes = read_hashed_file(hashed_file)
+    try:
+        require_same_digests(
+            [(f"the dataset of {filter_file}", membership_filter.parameters), (hashed_file, hashes.digest_parameters())]
+        )
+        _require_fingerprints(hashes, hashed_file)
+        if output_format is None:
+            output_format = "binary" if is_binary_hashed_file(hashed_file) else "csv"
+        kept = 0
+        with open_hashed_writer(output_file, output_format, hashes.columns, *hashes.digest_parameters()) as writer:
+            for start in range(0, len(hashes), BLOCK_ROWS):
+                entries = column_entries(hashes, IDENTIFIER_COLUMNS, start, start + BLOCK_ROWS)
+                hits = membership_filter.might_contain(entries.fingerprints)
+                for row_id in np.unique(entries.positions[hits] // entries.width).tolist():
+                    writer.write_row(
+                        hashes.pseudonym(row_id),
+                        [hashes.digest(column, row_id) for column in range(len(hashes.columns))],
+                    )
+                    kept += 1
+    finally:
+        hashes.close()
+    return kept
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description="Shrink hashed datasets before an exchange with a Bloom filter of the other dataset"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build-filter", help="Build the membership filter of the digests of a hashed dataset, to send instead of it"
+    )
+    build_parser.add_argument("--hashed-file", required=True, help="Hashed dataset to build the filter of")
+    build_parser.add_argument("--filter-file", required=True, help="Path of the new filter file")
+    build_parser.add_argument(
+        "--false-positive-rate",
+        type=float,
+        default=DEFAULT_FALSE_POSITIVE_RATE,
+        help="Share of the digests not in the dataset that the filter lets through; lower rates make larger "
+        f"filters (default: {DEFAULT_FALSE_POSITIVE_RATE})",
+    )
+    apply_parser = subparsers.add_parser(
+        "apply-filter", help="Keep only the rows of a hashed dataset that may match the dataset of a filter"
+    )
+    apply_parser.add_argument("--filter-file", required=True, help="Filter of the other dataset")
+    apply_parser.add_argument("--hashed-file", required=True, help="Hashed dataset to filter, CSV or binary")
+    apply_parser.add_argument("--output-file", required=True, help="Path of the hashed file of candidate rows")
+    apply_parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help="Format of the candidate file (default: the format of the input)",
+    )
+    args = parser.parse_args()
+    if args.command == "build-filter" and not 0 < args.false_positive_rate < 1:
+        parser.error("--false-positive-rate must be between 0 and 1")
+
+    try:
+        if args.command == "build-filter":
+            membership_filter = build_filter(args.hashed_file, args.filter_file, args.false_positive_rate)
+            print(
+                f"Built a filter of {membership_filter.item_count} distinct digests of {args.hashed_file} into "
+                f"{args.filter_file}: {os.path.getsize(args.filter_file)} bytes, {membership_filter.hash_count} "
+                f"hashes, expected false positive rate {membership_filter.false_positive_rate():.3%}"
+            )
+        else:
+            kept = apply_filter(args.filter_file, args.hashed_file, args.output_file, args.output_format)
+            input_size, output_size = os.path.getsize(args.hashed_file), os.path.getsize(args.output_file)
+            print(
+                f"Kept {kept} candidate rows of {args.hashed_file} in {args.output_file}: {output_size} bytes, "
+                f"{output_size / input_size:.1%} of the input"
+            )
+    except ValueError as error:
+        print(f"Error: {error}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
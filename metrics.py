@@ -0,0 +1,265 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import sys
+import threading
+import time
+from typing import Any, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+METRICS_FORMAT_VERSION = 1
+# Latency bucket b counts latencies below 2**b microseconds (and at least 2**(b - 1) for b > 0)
+LATENCY_BUCKETS = 32
+
+T = TypeVar("T")
+Clock = Tuple[float, float]
+
+
+def clock() -> Clock:
+    """Return the wall clock and the CPU time of the current thread, in seconds."""
+    return time.perf_counter(), time.thread_time()
+
+
+def peak_memory_bytes(children: bool = False) -> int:
+    """
+    Return the peak resident set size in bytes, or 0 if it is unavailable.
+
+    Args:
+        children: Return the peak of the largest terminated child process, such as a worker of a process
+            pool, instead of the current process
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def children_cpu_seconds() -> float:
+    """Return the CPU time used by the terminated child processes, or 0 if it is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageTime:
+    """The time spent in a stage: the number of timed calls and rows, and their wall and CPU seconds."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.rows = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def add(self, wall_seconds: float, cpu_seconds: float, rows: int = 0, calls: int = 1) -> None:
+        self.calls += calls
+        self.rows += rows
+        self.wall_seconds += wall_seconds
+        self.cpu_seconds += cpu_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        stage: Dict[str, Any] = {
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+        }
+        if self.rows:
+            stage["rows"] = self.rows
+            stage["rows_per_second"] = round(self.rows / self.wall_seconds, 1) if self.wall_seconds else None
+        return stage
+
+
+class StageCall:
+    """A timed call to a stage; its row count can be set once known, inside the with statement."""
+
+    def __init__(self, rows: int = 0) -> None:
+        self.rows = rows
+
+
+class LatencyHistogram:
+    """Histogram of latencies in power-of-two microsecond buckets, with their count, sum and maximum."""
+
+    def __init__(self) -> None:
+        self.buckets: List[int] = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[min(int(seconds * 1e6).bit_length(), LATENCY_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self.buckets = [count + other_count for count, other_count in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total_seconds += other.total_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+    def quantile(self, fraction: float) -> float:
+        """Return an upper bound of a quantile of the latencies in seconds: the bound of its bucket."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1e6, self.max_seconds)
+        return self.max_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_seconds": self.total_seconds / self.count if self.count else None,
+            "p50_seconds": self.quantile(0.5),
+            "p90_seconds": self.quantile(0.9),
+            "p99_seconds": self.quantile(0.99),
+            "max_seconds": self.max_seconds,
+            "buckets_us": {f"<{1 << bucket}": count for bucket, count in enumerate(self.buckets) if count},
+        }
+
+
+class Metrics:
+    """
+    Performance metrics of a run: the wall and CPU time and rows of every stage, latency histograms and
+    counters, exported as JSON.
+
+    Stages are timed per thread, so the CPU time of a stage running in a pipeline thread is its own. Stage
+    times measured in worker processes are merged in by the parent (see merge), so the times of a stage
+    add up over all its threads and processes and may exceed the wall time of the run. The metrics object
+    is safe to update from several threads.
+    """
+
+    def __init__(self, script: str = "") -> None:
+        self.script = script
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = clock()
+        self.started_process_cpu = time.process_time()
+        self.stages: Dict[str, StageTime] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, Any] = {}
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def add(self, name: str, wall_seconds: float, cpu_seconds: float, rows: int = 0) -> None:
+        """Add a timed call to a stage."""
+        with self.lock:
+            self.stages.setdefault(name, StageTime()).add(wall_seconds, cpu_seconds, rows)
+
+    def add_since(self, name: str, start: Clock, rows: int = 0) -> Clock:
+        """Add the time since a clock() reading to a stage, and return the current clock() reading."""
+        now = clock()
+        self.add(name, now[0] - start[0], now[1] - start[1], rows)
+        return now
+
+    def observe(self, name: str, start: Clock) -> None:
+        """Add the time since a clock() reading to a stage and record it as a latency in the stage histogram."""
+        now = clock()
+        with self.lock:
+            self.stages.setdefault(name, StageTime()).add(now[0] - start[0], now[1] - start[1])
+            self.histograms.setdefault(name, LatencyHistogram()).record(now[0] - start[0])
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows: int = 0) -> Iterator[StageCall]:
+        """Time the body of a with statement as a call to a stage."""
+        call = StageCall(rows)
+        start = clock()
+        try:
+            yield call
+        finally:
+            self.add_since(name, start, call.rows)
+
+    def timed_iter(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Yield the items of an iterable, timing the production of every item as a one-row call to a stage."""
+        iterator = iter(items)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_since(name, start)
+                return
+            self.add_since(name, start, rows=1)
+            yield item
+
+    def count(self, name: str, value: Any) -> None:
+        """Set a counter."""
+        self.counters[name] = value
+
+    def state(self) -> Tuple[Dict[str, StageTime], Dict[str, LatencyHistogram]]:
+        """Return the stage times and histograms, to send from a worker process to merge into the parent."""
+        with self.lock:
+            return dict(self.stages), dict(self.histograms)
+
+    def reset(self) -> None:
+        """Clear the stage times and histograms, as a worker process does before every task."""
+        with self.lock:
+            self.stages = {}
+            self.histograms = {}
+
+    def merge(self, state: Tuple[Dict[str, StageTime], Dict[str, LatencyHistogram]]) -> None:
+        """Add the stage times and histograms of a worker process."""
+        stages, histograms = state
+        with self.lock:
+            for name, stage in stages.items():
+                self.stages.setdefault(name, StageTime()).add(
+                    stage.wall_seconds, stage.cpu_seconds, stage.rows, stage.calls
+                )
+            for name, histogram in histograms.items():
+                self.histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the metrics of the run so far."""
+        wall_seconds = time.perf_counter() - self.started[0]
+        return {
+            "version": METRICS_FORMAT_VERSION,
+            "script": self.script,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "wall_seconds": round(wall_seconds, 6),
+            "cpu_seconds": round(time.process_time() - self.started_process_cpu, 6),
+            "children_cpu_seconds": round(children_cpu_seconds(), 6),
+            "peak_rss_bytes": peak_memory_bytes(),
+            "children_peak_rss_bytes": peak_memory_bytes(children=True),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / wall_seconds, 1) if wall_seconds else None,
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            "counters": self.counters,
+        }
+
+    def write_json(self, file_path: str) -> None:
+        """Write the metrics of the run as a JSON file."""
+        with open(file_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+            file.write("\n")
+
+
+def stage(metrics: Optional[Metrics], name: str, rows: int = 0) -> ContextManager[StageCall]:
+    """Time the body of a with statement as a call to a stage if metrics are collected."""
+    return metrics.stage(name, rows) if metrics is not None else contextlib.nullcontext(StageCall(rows))
+
+
+@contextlib.contextmanager
+def profiled(profile_file: Optional[str]) -> Iterator[None]:
+    """
+    Profile the body of a with statement with cProfile and dump the stats to a file, if one is given.
+
+    Only the current thread is profiled, not pipeline threads or worker processes. The stats can be
+    read with python -m pstats <file>, or with snakeviz.
+    """
+    if not profile_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        print(f"Profile written to {profile_file} (view with: python -m pstats {profile_file})")
@@ -0,0 +1,157 @@
+import math
+import os
+import re
+import tempfile
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from hashed_file import HashedTable, csv_to_binary, is_binary_hashed_file, read_hashed_file
+from vectorized_join import Entries, JoinedPairs, column_entries, concatenate_pairs, empty_entries
+
+# Working memory of the in-memory join per entry, as a multiple of the spilled entry size: both sides'
+# arrays plus the temporaries of isin, unique and the sorts.
+JOIN_MEMORY_FACTOR = 6
+# Upper bound on the number of partitions, to keep the number of spill files manageable
+MAX_PARTITIONS = 4096
+
+_MEMORY_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+_MEMORY_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+Join = Callable[[Entries, Entries], JoinedPairs]
+
+
+def parse_memory_size(text: str) -> int:
+    """
+    Parse a memory size such as "512M", "2G" or "1000000" into bytes.
+
+    Raises:
+        ValueError: If the text is not a memory size.
+    """
+    match = _MEMORY_SIZE_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid memory size '{text}', expected e.g. 512M or 2G")
+    return int(float(match.group(1)) * _MEMORY_UNITS[match.group(2).lower()])
+
+
+def spool_hashed_file(file_path: str, spill_dir: str) -> HashedTable:
+    """
+    Open a hashed file without loading it into memory.
+
+    Binary hashed files are memory-mapped directly; CSV hashed files are first streamed into a binary
+    file in spill_dir.
+    """
+    if not is_binary_hashed_file(file_path):
+        descriptor, binary_path = tempfile.mkstemp(suffix=".bin", dir=spill_dir)
+        os.close(descriptor)
+        csv_to_binary(file_path, binary_path)
+        file_path = binary_path
+    return read_hashed_file(file_path)
+
+
+def _entry_dtype(digest_size: int) -> np.dtype:
+    return np.dtype([("fingerprint", "<u8"), ("digest", f"V{digest_size}"), ("position", "<i8")])
+
+
+def plan_partitions(hashes1: HashedTable, hashes2: HashedTable, width: int, memory_budget: int) -> Tuple[int, int]:
+    """
+    Choose how to split a join of width columns per row so that it fits in a memory budget.
+
+    Returns:
+        The number of partitions, and the number of rows read per chunk while spilling
+    """
+    entry_size = _entry_dtype(hashes1.digest_size).itemsize
+    join_bytes = (len(hashes1) + len(hashes2)) * width * entry_size * JOIN_MEMORY_FACTOR
+    partitions = min(MAX_PARTITIONS, max(1, math.ceil(join_bytes / memory_budget)))
+    rows_per_chunk = max(1, memory_budget // (width * entry_size * JOIN_MEMORY_FACTOR))
+    return partitions, rows_per_chunk
+
+
+def spill_partitions(
+    hashes: HashedTable,
+    column_names: Sequence[str],
+    partitions: int,
+    rows_per_chunk: int,
+    path_prefix: str,
+) -> List[str]:
+    """
+    Radix-partition the entries of some hash columns into spill files by digest fingerprint.
+
+    Chunks are appended in scan order, so every spill file holds its entries in scan order.
+
+    Args:
+        hashes: The hashed dataset
+        column_names: The hash columns to spill
+        partitions: Number of partitions
+        rows_per_chunk: Number of rows read into memory at a time
+        path_prefix: Prefix of the spill file paths
+
+    Returns:
+        The path of the spill file of every partition; files of empty partitions are not created
+    """
+    paths = [f"{path_prefix}.{partition}" for partition in range(partitions)]
+    dtype = _entry_dtype(hashes.digest_size)
+    for start in range(0, len(hashes), rows_per_chunk):
+        entries = column_entries(hashes, column_names, start, start + rows_per_chunk)
+        partition_ids = entries.fingerprints % np.uint64(partitions)
+        order = np.argsort(partition_ids, kind="stable")
+        records = np.empty(len(order), dtype=dtype)
+        records["fingerprint"] = entries.fingerprints[order]
+        records["digest"] = entries.digests[order]
+        records["position"] = entries.positions[order]
+        bounds = np.searchsorted(partition_ids[order], np.arange(partitions + 1, dtype=np.uint64))
+        for partition in np.flatnonzero(np.diff(bounds)):
+            with open(paths[partition], "ab") as spill_file:
+                records[bounds[partition] : bounds[partition + 1]].tofile(spill_file)
+    return paths
+
+
+def _load_partition(path: str, digest_size: int, width: int) -> Entries:
+    """Read a spill file back, and delete it."""
+    if not os.path.exists(path):
+        return empty_entries(digest_size, width)
+    records = np.fromfile(path, dtype=_entry_dtype(digest_size))
+    os.remove(path)
+    return Entries(records["fingerprint"], records["digest"], records["position"], width)
+
+
+def partitioned_join(
+    hashes1: HashedTable,
+    hashes2: HashedTable,
+    column_names: Sequence[str],
+    join: Join,
+    memory_budget: int,
+    spill_dir: str,
+) -> JoinedPairs:
+    """
+    Join hash columns of two datasets one partition at a time.
+
+    Both datasets are partitioned by digest fingerprint into spill files, so equal digests always land in
+    the same partition, and each partition pair is joined in memory. The pairs of all partitions are then
+    put in the same order the in-memory join produces.
+
+    Args:
+        hashes1: First dataset with hashed identifiers
+        hashes2: Second dataset with hashed identifiers
+        column_names: The hash columns to join
+        join: The in-memory join applied to every partition (e.g. vectorized_join.product_join)
+        memory_budget: Memory budget in bytes for the entries of one partition and its join
+        spill_dir: Directory for the spill files
+
+    Returns:
+        The joined pairs of all partitions
+    """
+    width = len(column_names)
+    partitions, rows_per_chunk = plan_partitions(hashes1, hashes2, width, memory_budget)
+    prefix = os.path.join(spill_dir, re.sub(r"\W", "_", column_names[0]).lower())
+    paths1 = spill_partitions(hashes1, column_names, partitions, rows_per_chunk, f"{prefix}.1")
+    paths2 = spill_partitions(hashes2, column_names, partitions, rows_per_chunk, f"{prefix}.2")
+
+    parts = []
+    for path1, path2 in zip(paths1, paths2):
+        entries1 = _load_partition(path1, hashes1.digest_size, width)
+        entries2 = _load_partition(path2, hashes2.digest_size, width)
+        if len(entries1.positions) and len(entries2.positions):
+            parts.append(join(entries1, entries2))
+    print(f"Joined {', '.join(column_names)} in {partitions} partition(s)")
+    return concatenate_pairs(parts, hashes1.digest_size)
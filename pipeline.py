@@ -0,0 +1,232 @@
+import argparse
+from typing import Optional, Sequence
+
+import hash_datasets
+import match_hashes
+from approximate_match import DEFAULT_BAND_SIZE
+from hashed_file import OUTPUT_FORMATS, HashedTable, HashedTableBuilder, HashedWriter, open_hashed_writer
+from match_hashes import ENGINES, FanoutCap
+from match_store import MatchStore
+from metrics import Metrics, peak_memory_bytes, profiled
+from partitioned_join import parse_memory_size
+
+# Hashing and matching in one process: the rows of the input files are hashed straight into in-memory hashed
+# datasets, with raw digests, and matched from there, without writing hashed files and parsing them back.
+# Hashing is configured through hash_datasets (configure_digest, configure_phone_cache and
+# personal_info_sketches), and the metrics of both steps are collected in hash_datasets.metrics and
+# match_hashes.metrics.
+
+
+def hash_input(
+    input_file: str,
+    workers: int = 1,
+    chunk_size: int = 10000,
+    hashed_file: Optional[str] = None,
+    output_format: str = "csv",
+) -> HashedTable:
+    """
+    Hash an input file into an in-memory hashed dataset, optionally writing the hashed rows to a file too.
+
+    Args:
+        input_file: Path to the input CSV file
+        workers: Number of worker processes used for hashing (1 hashes in the current process)
+        chunk_size: Number of rows per chunk sent to a worker process
+        hashed_file: Optional path of a hashed file to keep, as hash_datasets.py would write it
+        output_format: Format of the hashed file, "csv" (hex digests) or "binary"
+
+    Returns:
+        The hashed dataset, with the digest parameters the rows were hashed with
+
+    Raises:
+        ValueError: If a required column is missing from the input file header.
+    """
+    rows = hash_datasets.iter_hashed_input(input_file, workers, chunk_size)
+    columns = hash_datasets.output_columns()
+    parameters = hash_datasets.digester.parameters
+    builder = HashedTableBuilder(columns, *parameters)
+    writer: Optional[HashedWriter] = None
+    try:
+        if hashed_file:
+            writer = open_hashed_writer(hashed_file, output_format, columns, *parameters)
+        for pseudonym, digests in rows:
+            builder.write_row(pseudonym, digests)
+            if writer is not None:
+                writer.write_row(pseudonym, digests)
+    finally:
+        rows.close()
+        if writer is not None:
+            writer.close()
+    if hash_datasets.metrics is not None:
+        hash_datasets.metrics.rows += builder.row_count
+    return builder.table()
+
+
+def hash_and_match(
+    input_file_1: str,
+    input_file_2: str,
+    workers: int = 1,
+    chunk_size: int = 10000,
+    engine: str = "python",
+    memory_budget: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+    fanout_cap: Optional[FanoutCap] = None,
+    min_similarity: Optional[float] = None,
+    band_size: int = DEFAULT_BAND_SIZE,
+    hashed_files: Sequence[Optional[str]] = (None, None),
+    output_format: str = "csv",
+) -> MatchStore:
+    """
+    Hash two input files and match them in the current process.
+
+    The digests stay raw bytes from hashing to matching. Approximate matching (min_similarity) needs
+    hash_datasets.personal_info_sketches to be set before hashing.
+
+    Args:
+        input_file_1: Path to the first input CSV file
+        input_file_2: Path to the second input CSV file
+        workers: Number of worker processes used for hashing
+        chunk_size: Number of rows per chunk sent to a worker process
+        engine: "python" for dictionary lookups, or "numpy" for the vectorized sort-based join
+        memory_budget: Optional memory budget in bytes of an out-of-core join
+        spill_dir: Directory for the spill files of an out-of-core join (default: a temporary directory)
+        fanout_cap: Optional caps on the number of pairs a single digest may produce; the skipped digests
+            are collected in it
+        min_similarity: Optional lowest similarity of the personal info sketches of pairs reported by
+            approximate matching
+        band_size: Number of sketch values per LSH band of approximate matching
+        hashed_files: Optional paths of hashed files to keep for the first and the second input file
+        output_format: Format of the hashed files, "csv" (hex digests) or "binary"
+
+    Returns:
+        The match results
+
+    Raises:
+        ValueError: If a required column is missing from an input file header, or the options do not fit
+            the datasets (see match_hashes.match_datasets).
+    """
+    hashes1 = hash_input(input_file_1, workers, chunk_size, hashed_files[0], output_format)
+    hashes2 = hash_input(input_file_2, workers, chunk_size, hashed_files[1], output_format)
+    return match_hashes.match_datasets(
+        hashes1, hashes2, engine, memory_budget, spill_dir, fanout_cap, min_similarity, band_size
+    )
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description="Hash two datasets and match them in one process, without hashed files in between."
+    )
+    parser.add_argument("--input-file-1", type=str, required=True, help="Path to the first input CSV file")
+    parser.add_argument("--input-file-2", type=str, required=True, help="Path to the second input CSV file")
+    parser.add_argument("--output-file", type=str, required=True, help="Path to output CSV file for match results")
+    parser.add_argument("--hashed-file-1", type=str, help="Also write the hashed rows of the first dataset here")
+    parser.add_argument("--hashed-file-2", type=str, help="Also write the hashed rows of the second dataset here")
+    parser.add_argument(
+        "--hashed-format",
+        choices=OUTPUT_FORMATS,
+        default="csv",
+        help="Format of --hashed-file-1 and --hashed-file-2 (default: csv)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes used for hashing (default: 1)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="Rows per chunk sent to a worker process (default: 10000)"
+    )
+    parser.add_argument(
+        "--phone-cache-size",
+        type=int,
+        default=100000,
+        help="Maximum number of distinct raw phone strings cached per process, 0 to disable (default: 100000)",
+    )
+    hash_datasets.add_digest_arguments(parser)
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="python",
+        help="Join engine: python dictionary lookups, or a vectorized NumPy sort-based join (default: python)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=str,
+        help="Join out of core within this memory budget (e.g. 512M, 4G), spilling partitions to disk; the "
+        "hashed datasets themselves are held in memory",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="Directory for spill files of an out-of-core join (default: the system temporary directory)",
+    )
+    match_hashes.add_matching_arguments(parser)
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Write performance metrics of hashing and matching as JSON to this file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the run with cProfile and write the stats to this file (the main thread only)",
+    )
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.phone_cache_size < 0:
+        parser.error("--phone-cache-size must not be negative")
+    max_fanouts = match_hashes.max_fanouts_from_arguments(parser, args)
+    memory_budget = None
+    if args.memory_budget:
+        try:
+            memory_budget = parse_memory_size(args.memory_budget)
+        except ValueError as e:
+            parser.error(str(e))
+
+    hash_datasets.configure_digest_from_arguments(parser, args)
+    # Approximate matching needs the sketches, which only exist while hashing
+    hash_datasets.personal_info_sketches = args.personal_info_sketches or args.min_personal_info_similarity is not None
+    hash_datasets.configure_phone_cache(args.phone_cache_size)
+    metrics = Metrics("pipeline") if args.metrics_file else None
+    hash_datasets.metrics = match_hashes.metrics = metrics
+
+    try:
+        with profiled(args.profile):
+            hashes = [
+                hash_input(input_file, args.workers, args.chunk_size, hashed_file, args.hashed_format)
+                for input_file, hashed_file in (
+                    (args.input_file_1, args.hashed_file_1),
+                    (args.input_file_2, args.hashed_file_2),
+                )
+            ]
+            for input_file, table in zip((args.input_file_1, args.input_file_2), hashes):
+                print(f"Hashed {len(table)} rows of {input_file}")
+            print(f"Digests: {hash_datasets.digester.parameters.describe()}")
+            match_hashes.find_and_write_matches(
+                hashes[0],
+                hashes[1],
+                args.output_file,
+                engine=args.engine,
+                memory_budget=memory_budget,
+                spill_dir=args.spill_dir,
+                max_fanouts=max_fanouts,
+                hot_key_report=args.hot_key_report,
+                min_similarity=args.min_personal_info_similarity,
+                band_size=args.sketch_band_size,
+            )
+    except FileNotFoundError as e:
+        print(f"File not found: {e.filename}")
+        raise SystemExit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    if memory_budget:
+        print(f"Peak memory: {peak_memory_bytes() / (1 << 20):.1f} MiB (budget {memory_budget / (1 << 20):.1f} MiB)")
+    if metrics is not None:
+        metrics.count("phone_warnings", dict(hash_datasets.phone_warnings))
+        metrics.write_json(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+import abc
+import argparse
+import hashlib
+import os
+import secrets
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import match_hashes
+from digest_algorithms import DIGEST_ALGORITHMS
+from hashed_file import (
+    SKETCH_COLUMNS,
+    HashedBinaryWriter,
+    HashedRow,
+    iter_hashed_rows,
+    read_digest_parameters,
+    read_hashed_file,
+    require_same_digests,
+)
+from metrics import Metrics, profiled
+
+try:
+    from cryptography.hazmat.primitives.asymmetric import x25519
+except ImportError:  # cryptography is only needed for the x25519 group
+    x25519 = None  # type: ignore[assignment]
+
+try:
+    import gmpy2
+except ImportError:  # gmpy2 only speeds up the modp2048 group
+    gmpy2 = None
+
+# The 2048-bit MODP group of RFC 3526 (group 14): p is a safe prime, and identifiers are hashed into its
+# subgroup of quadratic residues, of prime order (p - 1) / 2
+MODP2048_PRIME = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+    "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+    "83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+    "15728E5A8AACAA68FFFFFFFFFFFFFFFF",
+    16,
+)
+# Secret exponents are 256 bits rather than full size, twice the 112-bit strength of the group as
+# RFC 3526 recommends, which makes every exponentiation about 8 times faster
+MODP_KEY_BITS = 256
+# Identifiers are expanded to 2304 bits before the reduction modulo p, 256 bits more than p, so the reduced
+# values are within 2^-256 of uniform
+MODP_HASH_BYTES = 288
+GROUPS = ("x25519", "modp2048")
+BLINDED_ALGORITHM_PREFIX = "psi-"
+
+
+class Group(abc.ABC):
+    """
+    A group in which blinding an element with a secret key commutes: blind(a, blind(b, x)) equals
+    blind(b, blind(a, x)), and equal elements stay equal after blinding with the same key.
+    """
+
+    name = ""
+    element_size = 0
+
+    @abc.abstractmethod
+    def random_key(self) -> bytes:
+        """Return a new secret key."""
+
+    @abc.abstractmethod
+    def hash_to_element(self, digest: bytes) -> bytes:
+        """Map the digest of an identifier to a group element."""
+
+    @abc.abstractmethod
+    def blind(self, key: bytes, elements: List[bytes]) -> List[bytes]:
+        """Raise every element to the secret key."""
+
+
+class X25519Group(Group):
+    """
+    Curve25519, blinding with the X25519 function: a scalar multiplication of the u-coordinate of a point.
+
+    Identifiers are hashed to a 32-byte u-coordinate. The scalar multiplications run in the cryptography
+    package, tens of thousands per second and core.
+    """
+
+    name = "x25519"
+    element_size = 32
+
+    def __init__(self) -> None:
+        if x25519 is None:
+            raise ValueError("The x25519 group needs the cryptography package (pip install cryptography)")
+
+    def random_key(self) -> bytes:
+        return secrets.token_bytes(32)
+
+    def hash_to_element(self, digest: bytes) -> bytes:
+        return hashlib.sha256(b"psi-x25519:" + digest).digest()
+
+    def blind(self, key: bytes, elements: List[bytes]) -> List[bytes]:
+        private_key = x25519.X25519PrivateKey.from_private_bytes(key)
+        return [private_key.exchange(x25519.X25519PublicKey.from_public_bytes(element)) for element in elements]
+
+
+def expand_digest(digest: bytes, size: int) -> bytes:
+    """Expand a digest to size bytes with counter-mode SHA-512."""
+    blocks = -(-size // hashlib.sha512().digest_size)
+    expanded = b"".join(
+        hashlib.sha512(b"psi-modp2048:" + bytes([counter]) + digest).digest() for counter in range(blocks)
+    )
+    return expanded[:size]
+
+
+class Modp2048Group(Group):
+    """
+    The quadratic residues modulo the 2048-bit safe prime of RFC 3526, blinding by modular exponentiation.
+
+    Identifiers are hashed to a residue by expanding the digest to 2304 bits with SHA-512, reducing it
+    modulo p and squaring it. Exponentiations use gmpy2 when it is installed, and Python integers otherwise,
+    a few hundred per second and core.
+    """
+
+    name = "modp2048"
+    element_size = 256
+
+    def random_key(self) -> bytes:
+        return (secrets.randbits(MODP_KEY_BITS - 1) | (1 << (MODP_KEY_BITS - 1))).to_bytes(MODP_KEY_BITS // 8, "big")
+
+    def hash_to_element(self, digest: bytes) -> bytes:
+        value = int.from_bytes(expand_digest(digest, MODP_HASH_BYTES), "big") % MODP2048_PRIME
+        return pow(value, 2, MODP2048_PRIME).to_bytes(self.element_size, "big")
+
+    def blind(self, key: bytes, elements: List[bytes]) -> List[bytes]:
+        exponent = int.from_bytes(key, "big")
+        if gmpy2 is not None:
+            prime, exponent = gmpy2.mpz(MODP2048_PRIME), gmpy2.mpz(exponent)
+            return [
+                int(gmpy2.powmod(gmpy2.mpz(int.from_bytes(element, "big")), exponent, prime)).to_bytes(256, "big")
+                for element in elements
+            ]
+        return [
+            pow(int.from_bytes(element, "big"), exponent, MODP2048_PRIME).to_bytes(256, "big") for element in elements
+        ]
+
+
+def get_group(name: str) -> Group:
+    """Return the group of a name in GROUPS."""
+    if name == "x25519":
+        return X25519Group()
+    if name == "modp2048":
+        return Modp2048Group()
+    raise ValueError(f"Unknown PSI group '{name}', expected one of {GROUPS}")
+
+
+def blind_digests(group: Group, key: bytes, rows: List[List[bytes]], hash_first: bool) -> Tuple[List[List[bytes]], int]:
+    """
+    Blind the digests of a batch of rows, each distinct digest once.
+
+    Args:
+        group: The group to blind in
+        key: The secret key of the party blinding
+        rows: The digests of every row of the batch, b"" for blank values
+        hash_first: Whether the digests are identifier digests to hash into the group first, rather than
+            elements already blinded by the other party
+
+    Returns:
+        The blinded digests of every row, b"" for blank values, and the number of exponentiations
+    """
+    distinct = list({digest: None for row in rows for digest in row if digest})
+    elements = [group.hash_to_element(digest) for digest in distinct] if hash_first else distinct
+    blinded = dict(zip(distinct, group.blind(key, elements)))
+    return [[blinded[digest] if digest else b"" for digest in row] for row in rows], len(distinct)
+
+
+_worker_group: Optional[Group] = None
+_worker_key = b""
+
+
+def _init_worker(group_name: str, key: bytes) -> None:
+    """Initialize module state in a blinding worker process."""
+    global _worker_group, _worker_key
+    _worker_group = get_group(group_name)
+    _worker_key = key
+
+
+def _blind_batch(rows: List[List[bytes]], hash_first: bool) -> Tuple[List[List[bytes]], int]:
+    """Blind a batch of rows inside a worker process."""
+    assert _worker_group is not None
+    return blind_digests(_worker_group, _worker_key, rows, hash_first)
+
+
+def _batches(rows: Iterable[HashedRow], batch_size: int) -> Iterator[Tuple[List[str], List[List[bytes]]]]:
+    pseudonyms: List[str] = []
+    digests: List[List[bytes]] = []
+    for pseudonym, row_digests in rows:
+        pseudonyms.append(pseudonym)
+        digests.append(row_digests)
+        if len(pseudonyms) == batch_size:
+            yield pseudonyms, digests
+            pseudonyms, digests = [], []
+    if pseudonyms:
+        yield pseudonyms, digests
+
+
+class BlindingStats(NamedTuple):
+    """What a blinding pass did: its rows, its exponentiations, its wall time and the size of its output."""
+
+    rows: int
+    operations: int
+    seconds: float
+    output_bytes: int
+
+    @property
+    def operations_per_second(self) -> float:
+        return self.operations / self.seconds if self.seconds else 0.0
+
+
+def blind_file(
+    input_file: str,
+    output_file: str,
+    group: Group,
+    key: bytes,
+    workers: int = 1,
+    batch_size: int = 4096,
+) -> BlindingStats:
+    """
+    Blind every digest of a hashed file with a secret key, writing a binary hashed file of group elements.
+
+    A hashed file from hash_datasets.py is hashed into the group first; a file already blinded by the other
+    party in the same group is blinded again, which gives the doubly blinded file both parties can match
+    on. Pseudonyms and row order are kept; personal info sketches are dropped. Rows are blinded in batches,
+    by a pool of worker processes when there is more than one worker, with at most two batches per worker
+    in flight.
+
+    Raises:
+        ValueError: If the file was blinded in another group, or twice already.
+    """
+    started = time.perf_counter()
+    columns, rows = iter_hashed_rows(input_file)
+    # Personal info sketches are only compared approximately, which blinding would defeat, so they are
+    # left out of the exchanged files
+    kept = [position for position, column in enumerate(columns) if column not in SKETCH_COLUMNS]
+    if len(kept) < len(columns):
+        columns = [columns[position] for position in kept]
+        rows = ((pseudonym, [digests[position] for position in kept]) for pseudonym, digests in rows)
+    algorithm = read_digest_parameters(input_file).algorithm
+    if algorithm in DIGEST_ALGORITHMS:
+        hash_first, output_algorithm = True, f"{BLINDED_ALGORITHM_PREFIX}{group.name}"
+    elif algorithm == f"{BLINDED_ALGORITHM_PREFIX}{group.name}":
+        hash_first, output_algorithm = False, f"{BLINDED_ALGORITHM_PREFIX}{group.name}-double"
+    else:
+        raise ValueError(f"{input_file} holds {algorithm} digests and cannot be blinded in the {group.name} group")
+
+    row_count = operations = 0
+    with HashedBinaryWriter(output_file, columns, output_algorithm, group.element_size) as writer:
+
+        def write(pseudonyms: List[str], blinded: List[List[bytes]], batch_operations: int) -> None:
+            nonlocal row_count, operations
+            for pseudonym, digests in zip(pseudonyms, blinded):
+                writer.write_row(pseudonym, digests)
+            row_count += len(pseudonyms)
+            operations += batch_operations
+
+        if workers == 1:
+            for pseudonyms, digests in _batches(rows, batch_size):
+                write(pseudonyms, *blind_digests(group, key, digests, hash_first))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(group.name, key)
+            ) as executor:
+                pending: Deque[Tuple[List[str], Future]] = deque()
+                for pseudonyms, digests in _batches(rows, batch_size):
+                    pending.append((pseudonyms, executor.submit(_blind_batch, digests, hash_first)))
+                    if len(pending) >= workers * 2:
+                        batch_pseudonyms, future = pending.popleft()
+                        write(batch_pseudonyms, *future.result())
+                while pending:
+                    batch_pseudonyms, future = pending.popleft()
+                    write(batch_pseudonyms, *future.result())
+
+    return BlindingStats(row_count, operations, time.perf_counter() - started, os.path.getsize(output_file))
+
+
+def print_blinding(step: str, stats: BlindingStats) -> None:
+    """Print the statistics of a blinding pass."""
+    print(
+        f"{step}: {stats.rows} rows, {stats.operations} exponentiations in {stats.seconds:.2f}s "
+        f"({stats.operations_per_second:,.0f} ops/s), {stats.output_bytes / (1 << 20):.1f} MiB to send"
+    )
+
+
+def simulate_psi(
+    hashed_file_1: str,
+    hashed_file_2: str,
+    output_file: str,
+    group_name: str = "x25519",
+    workers: int = 1,
+    batch_size: int = 4096,
+    work_dir: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> Dict[str, BlindingStats]:
+    """
+    Run a Diffie-Hellman private set intersection of two hashed datasets, with both parties simulated locally.
+
+    Each party blinds its own digests with its secret key and sends them to the other, which blinds them
+    again with its own key. Blinding commutes, so a digest both datasets share becomes the same doubly
+    blinded value on both sides, while a single blinded value reveals nothing that can be checked against
+    guessed phone numbers or emails without the key. The doubly blinded datasets are then matched like
+    hashed files, with the same output and summary as match_hashes.py.
+
+    Every blinding is a variable-base exponentiation (the base is the identifier, the exponent the fixed
+    key), so there is no fixed base to precompute tables for; instead every distinct digest of a batch is
+    blinded once, and batches are spread over worker processes.
+
+    Args:
+        hashed_file_1: Hashed dataset of the first party
+        hashed_file_2: Hashed dataset of the second party
+        output_file: Path of the match results
+        group_name: The group to blind in, one of GROUPS
+        workers: Number of blinding processes
+        batch_size: Number of rows blinded per batch
+        work_dir: Directory for the exchanged files (default: a temporary directory, removed afterwards);
+            when given, the files are kept
+        metrics: Performance metrics to add the blinding and matching stages to
+
+    Returns:
+        The statistics of every blinding step
+
+    Raises:
+        ValueError: If the datasets were hashed with different digest parameters.
+    """
+    require_same_digests(
+        [(file_path, read_digest_parameters(file_path)) for file_path in (hashed_file_1, hashed_file_2)]
+    )
+    group = get_group(group_name)
+    key_1, key_2 = group.random_key(), group.random_key()
+    steps: Dict[str, BlindingStats] = {}
+    with tempfile.TemporaryDirectory(prefix="psi_") as temporary_dir:
+        directory = work_dir or temporary_dir
+        os.makedirs(directory, exist_ok=True)
+        blinded_1, blinded_2 = os.path.join(directory, "party1_blinded.bin"), os.path.join(
+            directory, "party2_blinded.bin"
+        )
+        double_1, double_2 = os.path.join(directory, "party1_double.bin"), os.path.join(directory, "party2_double.bin")
+        for step, input_file, output, key in (
+            ("Party 1 blinds its dataset", hashed_file_1, blinded_1, key_1),
+            ("Party 2 blinds its dataset", hashed_file_2, blinded_2, key_2),
+            ("Party 2 blinds the dataset of party 1", blinded_1, double_1, key_2),
+            ("Party 1 blinds the dataset of party 2", blinded_2, double_2, key_1),
+        ):
+            stats = blind_file(input_file, output, group, key, workers, batch_size)
+            print_blinding(step, stats)
+            steps[step] = stats
+            if metrics is not None:
+                metrics.add(f"blind_{len(steps)}", stats.seconds, 0.0, stats.rows)
+
+        total_operations = sum(stats.operations for stats in steps.values())
+        total_seconds = sum(stats.seconds for stats in steps.values())
+        print(f"Blinding: {total_operations} exponentiations, {total_operations / total_seconds:,.0f} ops/s")
+        if metrics is not None:
+            metrics.count("group", group.name)
+            metrics.count("exponentiations", total_operations)
+            metrics.count("exponentiations_per_second", round(total_operations / total_seconds, 1))
+
+        hashes1, hashes2 = read_hashed_file(double_1), read_hashed_file(double_2)
+        match_hashes.metrics = metrics
+        try:
+            match_hashes.find_and_write_matches(hashes1, hashes2, output_file)
+        finally:
+            hashes1.close()
+            hashes2.close()
+    return steps
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description="Private set intersection of two hashed datasets by commutative (Diffie-Hellman) blinding."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    simulate_parser = subparsers.add_parser(
+        "simulate", help="Run both parties locally: blind both datasets twice and match the doubly blinded files"
+    )
+    simulate_parser.add_argument("--hashed-file-1", type=str, required=True, help="Hashed dataset of party 1")
+    simulate_parser.add_argument("--hashed-file-2", type=str, required=True, help="Hashed dataset of party 2")
+    simulate_parser.add_argument("--output-file", type=str, required=True, help="Path of the match results")
+    simulate_parser.add_argument(
+        "--work-dir", type=str, help="Keep the blinded files exchanged by the parties in this directory"
+    )
+    simulate_parser.add_argument("--metrics-file", type=str, help="Write performance metrics as JSON to this file")
+    simulate_parser.add_argument(
+        "--profile", type=str, help="Profile the run with cProfile and write the stats to this file"
+    )
+
+    keygen_parser = subparsers.add_parser("keygen", help="Generate the secret key of a party")
+    keygen_parser.add_argument("--key-file", type=str, required=True, help="Path of the new key file")
+
+    blind_parser = subparsers.add_parser(
+        "blind", help="Blind a hashed file, or a file blinded by the other party, with the key of a party"
+    )
+    blind_parser.add_argument("--input-file", type=str, required=True, help="Hashed or blinded file to blind")
+    blind_parser.add_argument("--output-file", type=str, required=True, help="Path of the blinded binary file")
+    blind_parser.add_argument("--key-file", type=str, required=True, help="Secret key of the party blinding")
+
+    for subparser in (simulate_parser, keygen_parser, blind_parser):
+        subparser.add_argument(
+            "--group",
+            choices=GROUPS,
+            default="x25519",
+            help="Group to blind in: X25519 (needs the cryptography package) or 2048-bit MODP (default: x25519)",
+        )
+    for subparser in (simulate_parser, blind_parser):
+        subparser.add_argument("--workers", type=int, default=1, help="Number of blinding processes (default: 1)")
+        subparser.add_argument(
+            "--batch-size", type=int, default=4096, help="Number of rows blinded per batch (default: 4096)"
+        )
+    args = parser.parse_args()
+    if getattr(args, "workers", 1) < 1:
+        parser.error("--workers must be at least 1")
+    if getattr(args, "batch_size", 1) < 1:
+        parser.error("--batch-size must be at least 1")
+
+    try:
+        group = get_group(args.group)
+        if args.command == "keygen":
+            # The key is as sensitive as the identifiers it blinds: only the owner may read it
+            with open(os.open(args.key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+                file.write(f"{group.name}:{group.random_key().hex()}\n")
+            print(f"Key written to {args.key_file}")
+        elif args.command == "blind":
+            with open(args.key_file) as file:
+                key_group, _, key_hex = file.read().strip().partition(":")
+            if key_group != group.name:
+                raise ValueError(f"{args.key_file} is a key of the {key_group} group, not {group.name}")
+            stats = blind_file(
+                args.input_file, args.output_file, group, bytes.fromhex(key_hex), args.workers, args.batch_size
+            )
+            print_blinding(f"Blinded {args.input_file} into {args.output_file}", stats)
+        else:
+            for file_path in (args.hashed_file_1, args.hashed_file_2):
+                if not os.path.exists(file_path):
+                    print(f"File not found: {file_path}")
+                    return
+            metrics = Metrics("psi") if args.metrics_file else None
+            with profiled(args.profile):
+                simulate_psi(
+                    args.hashed_file_1,
+                    args.hashed_file_2,
+                    args.output_file,
+                    args.group,
+                    args.workers,
+                    args.batch_size,
+                    args.work_dir,
+                    metrics,
+                )
+            if metrics is not None:
+                metrics.write_json(args.metrics_file)
+                print(f"Metrics written to {args.metrics_file}")
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# The hashed output of a row, without its pseudonym: the digests of its hash columns (b"" for blank
+# values) and the standardization failure reason of each phone field (None for a valid phone)
+CachedRow = Tuple[List[bytes], List[Optional[str]]]
+
+KEY_SIZE = 16
+# SQLite allows at least 999 parameters per statement
+_LOOKUP_BATCH = 900
+
+
+def row_cache_key(fields: Sequence[str]) -> bytes:
+    """Return the cache key of a row: a digest of the projected input fields that its hashed output depends on."""
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+def _encode_digests(digests: Sequence[bytes]) -> bytes:
+    return b"".join(bytes([len(digest)]) + digest for digest in digests)
+
+
+def _decode_digests(data: bytes) -> List[bytes]:
+    digests = []
+    position = 0
+    while position < len(data):
+        size = data[position]
+        digests.append(data[position + 1 : position + 1 + size])
+        position += 1 + size
+    return digests
+
+
+class RowCache:
+    """
+    Persistent cache of hashed rows in an SQLite file, keyed on a digest of the input fields of every row.
+
+    The cache is tied to a fingerprint of the normalization code and hashing configuration: opening it with
+    another fingerprint drops every entry, so results of older code are never reused. Entries of rows that
+    no longer occur are kept; the file can be deleted at any time to reclaim the space.
+    """
+
+    def __init__(self, path: str, fingerprint: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows (key BLOB PRIMARY KEY, digests BLOB NOT NULL, reasons TEXT NOT NULL)"
+        )
+        stored = self.connection.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        self.invalidated = stored is not None and stored[0] != fingerprint
+        if stored is None or self.invalidated:
+            self.connection.execute("DELETE FROM rows")
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self.connection.commit()
+        self.reused = 0
+        self.computed = 0
+
+    def lookup(self, keys: Sequence[bytes]) -> Dict[bytes, CachedRow]:
+        """Return the cached rows of those keys that are in the cache."""
+        found: Dict[bytes, CachedRow] = {}
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start : start + _LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for key, digests, reasons in self.connection.execute(
+                f"SELECT key, digests, reasons FROM rows WHERE key IN ({placeholders})", batch
+            ):
+                found[key] = (_decode_digests(digests), json.loads(reasons))
+        return found
+
+    def store(self, entries: Iterable[Tuple[bytes, CachedRow]]) -> None:
+        """Add the hashed rows of some keys to the cache."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+            ((key, _encode_digests(digests), json.dumps(reasons)) for key, (digests, reasons) in entries),
+        )
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def close(self) -> None:
+        """Commit the stored rows and close the cache file."""
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+
+import pytest
+
+import match_server
+from hashed_file import HASH_COLUMNS, open_hashed_writer
+
+DIGEST_HEADERS = b"X-Digest-Algorithm: sha256\r\nX-Digest-Size: 32\r\n"
+
+
+def digest(value: str) -> bytes:
+    return hashlib.sha256(value.encode("utf-8")).digest()
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """A hashed dataset of two rows, sharing an email with the batch of post_batch."""
+    path = str(tmp_path / "dataset.csv")
+    with open_hashed_writer(path, "csv", HASH_COLUMNS) as writer:
+        writer.write_row("a1", [b"", b"", b"", digest("info a1"), digest("one@example.com")])
+        writer.write_row("a2", [digest("+14155552671"), b"", b"", digest("info a2"), digest("two@example.com")])
+    return path
+
+
+def exchange(dataset: str, *requests: bytes) -> list:
+    """Send raw requests to a server on the dataset, each on its own connection, and return the raw answers."""
+
+    async def run() -> list:
+        service = match_server.MatchService(dataset)
+        await service.reload()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        answers = []
+        async with server:
+            for request in requests:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(request)
+                await writer.drain()
+                answers.append(await asyncio.wait_for(reader.read(), 10))
+                writer.close()
+        answers.append(service.metrics.counters.get("errors", 0))
+        return answers
+
+    return asyncio.run(run())
+
+
+def post_batch(body: bytes, headers: bytes = DIGEST_HEADERS) -> bytes:
+    return b"POST /match HTTP/1.1\r\n%sConnection: close\r\nContent-Length: %d\r\n\r\n%s" % (headers, len(body), body)
+
+
+def status(answer: bytes) -> int:
+    return int(answer.split(b" ", 2)[1])
+
+
+@pytest.mark.parametrize(
+    "request_bytes",
+    [
+        b"POST /match HTTP/1.1\r\nContent-Length: -5\r\n\r\n",
+        b"POST /match HTTP/1.1\r\nContent-Length: five\r\n\r\n",
+        b"POST /match HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n",
+        b"GARBAGE\r\n\r\n",
+        b"GET /stats HTTP/1.1\r\nX-Long: " + b"x" * 100000 + b"\r\n\r\n",
+        b"GET /stats HTTP/1.1\r\n" + b"X-Header: 1\r\n" * (match_server.MAX_HEADER_LINES + 1) + b"\r\n",
+    ],
+    ids=["negative length", "malformed length", "chunked", "malformed request line", "long header", "many headers"],
+)
+def test_bad_request_framing_is_answered_with_400(dataset, request_bytes):
+    answer, errors = exchange(dataset, request_bytes)
+    assert status(answer) == 400
+    assert errors == 1
+
+
+def test_oversized_body_is_answered_with_413(dataset):
+    answer, _ = exchange(
+        dataset, b"POST /match HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (match_server.MAX_BODY_BYTES + 1)
+    )
+    assert status(answer) == 413
+
+
+def test_bad_batches_are_answered_with_400(dataset):
+    answers = exchange(
+        dataset,
+        post_batch(b"Phone Hash 1,Email Hash,Personal Info Hash,Pseudonym\n,,\n"),
+        post_batch(b"Pseudonym,Email Hash\nb1,zz\n"),
+        post_batch(b"Pseudonym,Email Hash\nb1,\n", headers=b""),
+        post_batch(b"Pseudonym,Email Hash\nb1,\n", headers=b"X-Digest-Algorithm: blake2b\r\nX-Digest-Size: 32\r\n"),
+    )
+    assert [status(answer) for answer in answers[:-1]] == [400, 400, 400, 400]
+    assert answers[-1] == 4
+
+
+def test_batch_is_matched_after_a_bad_request(dataset):
+    batch = f"Pseudonym,Email Hash,Personal Info Hash\nb1,{digest('two@example.com').hex()},\n".encode()
+    bad, answer, errors = exchange(dataset, b"POST /match HTTP/1.1\r\nContent-Length: -1\r\n\r\n", post_batch(batch))
+    assert status(bad) == 400
+    assert status(answer) == 200
+    rows = answer.split(b"\r\n\r\n", 1)[1].decode().splitlines()
+    assert len(rows) == 2 and rows[1].startswith("a2,b1,")
+    assert errors == 1
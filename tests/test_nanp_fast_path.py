@@ -0,0 +1,25 @@
+import hash_datasets
+from benchmark import generate_phone_corpus
+
+
+def test_nanp_fast_path_matches_libphonenumber():
+    # The corpus holds a number of every area code and exchange digit, so the whole validity table is checked
+    corpus = generate_phone_corpus(30000, seed=0)
+    accepted = 0
+    mismatches = []
+    for value in corpus:
+        fast = hash_datasets.parse_nanp_number(value)
+        if fast is None:
+            continue
+        accepted += 1
+        if fast != hash_datasets.parse_phone_number_with_libphonenumber(value):
+            mismatches.append(value)
+    assert not mismatches, f"{len(mismatches)} values differ, such as {mismatches[:5]!r}"
+    # The corpus exercises both the fast path and the libphonenumber fallback
+    assert 0 < accepted < len(corpus)
+
+
+def test_nanp_fast_path_leaves_uncommon_shapes_to_libphonenumber():
+    assert hash_datasets.parse_nanp_number("(415) 555-2671") == ("+14155552671", None, False)
+    for value in ("001-415-555-2671", "415/555/2671", "+44 20 7946 0958", "800-555-1234", "415-555-267"):
+        assert hash_datasets.parse_nanp_number(value) is None
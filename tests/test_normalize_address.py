@@ -0,0 +1,90 @@
+import random
+import re
+from typing import List
+
+import hash_datasets
+
+# Differential test of normalize_address against its original per-call regex implementation, on a seeded
+# generated corpus; benchmark.py address reuses both for its throughput numbers
+
+
+def legacy_normalize_address(address: str) -> str:
+    """The original per-call regex implementation of normalize_address, kept as the differential reference."""
+    if not address:
+        return ""
+    address = address.lower().strip()
+    address = re.sub(r"^[,.\s]+|[,.\s]+$", "", address)
+    address = re.sub(r"\b(?:apartment|apt|suite|ste|unit|fl|floor|#)\s*[\w-]+\b", "", address)
+    substitutions = {
+        "street": "st",
+        "avenue": "ave",
+        "road": "rd",
+        "drive": "dr",
+        "place": "pl",
+        "lane": "ln",
+        "highway": "hwy",
+        "court": "ct",
+        "square": "sq",
+        "loop": "lp",
+        "trail": "trl",
+        "parkway": "pkwy",
+        "commons": "cmns",
+        "north": "n",
+        "south": "s",
+        "east": "e",
+        "west": "w",
+        "boulevard": "blvd",
+        "circle": "cir",
+        "terrace": "ter",
+    }
+    for k, v in substitutions.items():
+        address = re.sub(rf"\b{k}\b\.?", v, address)
+    address = re.sub(r"[^\w\s]", "", address)
+    address = re.sub(r"\s+", " ", address).strip()
+    return address
+
+
+def generate_address_corpus(count: int, seed: int) -> List[str]:
+    """
+    Generate address-like strings that exercise every rule of normalize_address.
+
+    Values mix street suffixes and directions (in any case, with or without a trailing "."),
+    unit designators, house numbers, plain words and punctuation glued between words, and
+    repeat a pool of city names the way real panel files do.
+    """
+    rng = random.Random(seed)
+    keywords = list(hash_datasets.ADDRESS_SUBSTITUTIONS) + list(hash_datasets.ADDRESS_SUBSTITUTIONS.values())
+    units = ["apartment", "apt", "suite", "ste", "unit", "fl", "floor", "#"]
+    words = ["lake", "port", "new", "mount", "oak", "main", "elm", "st", "saint", "fort", "x", "1st", "über", "o'neil"]
+    separators = [" ", "  ", ".", ",", ". ", ", ", "-", "#", "..", "\t", "/", ""]
+    cities = [f"{rng.choice(words)} {rng.choice(keywords)}".title() for _ in range(200)]
+
+    corpus = []
+    for _ in range(count):
+        if rng.random() < 0.3:
+            corpus.append(rng.choice(cities))
+            continue
+        tokens = []
+        for _ in range(rng.randint(1, 8)):
+            kind = rng.random()
+            if kind < 0.45:
+                token = rng.choice(keywords)
+            elif kind < 0.6:
+                token = f"{rng.choice(units)}{rng.choice(['', ' ', '  '])}{rng.randint(1, 999)}{rng.choice(['', '-b'])}"
+            elif kind < 0.75:
+                token = str(rng.randint(1, 99999))
+            else:
+                token = rng.choice(words)
+            if rng.random() < 0.3:
+                token = rng.choice([token.upper(), token.title()])
+            tokens.append(token)
+            tokens.append(rng.choice(separators))
+        corpus.append(rng.choice(["", " ", ",", ". "]) + "".join(tokens) + rng.choice(["", ".", " ,", "  "]))
+    return corpus
+
+
+def test_normalize_address_matches_the_legacy_implementation():
+    normalize_address = hash_datasets.normalize_address.__wrapped__
+    corpus = generate_address_corpus(50000, seed=0)
+    mismatches = [value for value in corpus if normalize_address(value) != legacy_normalize_address(value)]
+    assert not mismatches, f"{len(mismatches)} values differ, such as {mismatches[:5]!r}"
@@ -0,0 +1,35 @@
+import hashlib
+
+import pytest
+
+import psi
+
+
+def test_expand_digest_covers_the_modp_hash_size():
+    digest = hashlib.sha256(b"5551234567").digest()
+    expanded = psi.expand_digest(digest, psi.MODP_HASH_BYTES)
+    assert len(expanded) == psi.MODP_HASH_BYTES == 288
+    # The bytes beyond the 2048 bits of the prime are hash output too, not padding
+    assert expanded[256:] != bytes(32)
+    assert expanded[:256] == psi.expand_digest(digest, 256)
+
+
+def test_modp2048_hash_to_element_is_a_residue():
+    group = psi.Modp2048Group()
+    element = group.hash_to_element(hashlib.sha256(b"someone@example.com").digest())
+    value = int.from_bytes(element, "big")
+    assert len(element) == group.element_size
+    assert 1 < value < psi.MODP2048_PRIME
+    assert pow(value, (psi.MODP2048_PRIME - 1) // 2, psi.MODP2048_PRIME) == 1
+
+
+def test_incomplete_group_cannot_be_created():
+    class NoBlinding(psi.Group):
+        def random_key(self):
+            return b""
+
+        def hash_to_element(self, digest):
+            return digest
+
+    with pytest.raises(TypeError):
+        NoBlinding()
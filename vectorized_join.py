@@ -0,0 +1,221 @@
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hashed_file import HashedTable
+
+# Digests are joined on their first 8 bytes, read as a big-endian integer fingerprint. Only rows whose
+# fingerprint occurs on both sides are candidates, and candidates are grouped by their full digest, so a
+# truncated fingerprint collision can never produce a false match.
+FINGERPRINT_SIZE = 8
+
+
+class Entries(NamedTuple):
+    """
+    The non-empty digests of some hash columns of a dataset.
+
+    Positions number the cells of the requested columns in a row-by-row, column-by-column scan, so the
+    row id of an entry is its position divided by the number of requested columns (the width).
+    """
+
+    fingerprints: np.ndarray
+    digests: np.ndarray
+    positions: np.ndarray
+    width: int
+
+
+class JoinedPairs(NamedTuple):
+    """
+    Pairs of entries joined on equal digests.
+
+    Each pair carries the scan positions of its two entries, the matched digest, and the position
+    at which that digest first appears in the first dataset, which together define the output order.
+    """
+
+    positions1: np.ndarray
+    positions2: np.ndarray
+    digests: np.ndarray
+    first_positions: np.ndarray
+
+
+def column_entries(
+    hashes: HashedTable, column_names: Sequence[str], start: int = 0, stop: Optional[int] = None
+) -> Entries:
+    """
+    Read the non-empty digests of some hash columns as NumPy arrays, without copying the records.
+
+    Args:
+        hashes: The hashed dataset
+        column_names: The hash columns to read; columns the dataset does not have are skipped
+        start: First row to read
+        stop: Row to stop reading at (default: the end of the dataset)
+
+    Returns:
+        The entries of the rows read, in scan order
+    """
+    width = len(column_names)
+    requested = [(number, hashes.column_index(name)) for number, name in enumerate(column_names)]
+    numbers = [number for number, column in requested if column is not None]
+    columns = [column for _, column in requested if column is not None]
+    digest_size = hashes.digest_size
+    stop = len(hashes) if stop is None else min(stop, len(hashes))
+    if not columns or start >= stop or digest_size < FINGERPRINT_SIZE:
+        return empty_entries(digest_size, width)
+
+    dtype = np.dtype(
+        {
+            "names": [f"fingerprint{column}" for column in columns] + [f"digest{column}" for column in columns],
+            "formats": [">u8"] * len(columns) + [f"V{digest_size}"] * len(columns),
+            "offsets": [column * digest_size for column in columns] * 2,
+            "itemsize": hashes.record_size,
+        }
+    )
+    records = np.frombuffer(
+        hashes.buffer,
+        dtype=dtype,
+        count=stop - start,
+        offset=hashes.records_offset + start * hashes.record_size,
+    )
+    fingerprints = np.stack([records[f"fingerprint{column}"] for column in columns], axis=1).ravel()
+    digests = np.stack([records[f"digest{column}"] for column in columns], axis=1).ravel()
+    positions = (np.arange(start, stop, dtype=np.int64)[:, None] * width + np.array(numbers, dtype=np.int64)).ravel()
+
+    present = (fingerprints != 0) | (digests != np.void(bytes(digest_size)))
+    return Entries(fingerprints[present].astype(np.uint64), digests[present], positions[present], width)
+
+
+def empty_entries(digest_size: int, width: int) -> Entries:
+    """Return an Entries with no entries."""
+    return Entries(
+        np.empty(0, dtype=np.uint64), np.empty(0, dtype=f"V{digest_size}"), np.empty(0, dtype=np.int64), width
+    )
+
+
+def _empty_pairs(digest_size: int) -> JoinedPairs:
+    return JoinedPairs(
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=f"V{digest_size}"),
+        np.empty(0, dtype=np.int64),
+    )
+
+
+def _candidate_groups(
+    entries1: Entries, entries2: Entries
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the entries of both sides whose digest occurs on both sides.
+
+    Returns:
+        A tuple containing the group ids and positions of the matching entries of the first side, the
+        group ids and positions of the matching entries of the second side (both in scan order), and
+        the distinct digests indexed by group id
+    """
+    candidates1 = np.isin(entries1.fingerprints, entries2.fingerprints)
+    candidates2 = np.isin(entries2.fingerprints, entries1.fingerprints)
+    digests1, positions1 = entries1.digests[candidates1], entries1.positions[candidates1]
+    digests2, positions2 = entries2.digests[candidates2], entries2.positions[candidates2]
+
+    distinct, groups = np.unique(np.concatenate([digests1, digests2]), return_inverse=True)
+    groups = groups.ravel()
+    groups1, groups2 = groups[: len(digests1)], groups[len(digests1) :]
+    matched1 = np.isin(groups1, groups2)
+    matched2 = np.isin(groups2, groups1)
+    return groups1[matched1], positions1[matched1], groups2[matched2], positions2[matched2], distinct
+
+
+def _group_firsts(groups: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the distinct groups with the smallest position of each."""
+    order = np.lexsort((positions, groups))
+    groups, positions = groups[order], positions[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return groups[starts], positions[starts]
+
+
+class HotEntries(NamedTuple):
+    """The digests and scan positions of the entries of both sides that a capped join left out."""
+
+    digests1: np.ndarray
+    positions1: np.ndarray
+    digests2: np.ndarray
+    positions2: np.ndarray
+
+
+def product_join(entries1: Entries, entries2: Entries) -> JoinedPairs:
+    """
+    Join entries, pairing every entry of the first side with every entry of the second side that has
+    the same digest.
+
+    Pairs are ordered as nested loops over the distinct digests of the first side (by first appearance),
+    then its entries with that digest, then the second side's entries with it.
+    """
+    return _product_pairs(*_candidate_groups(entries1, entries2), entries1.digests.dtype.itemsize)
+
+
+def capped_product_join(entries1: Entries, entries2: Entries, max_fanout: int) -> Tuple[JoinedPairs, HotEntries]:
+    """
+    Join entries like product_join, leaving out the hot digests that would pair more than max_fanout
+    entries of the first side with entries of the second side.
+
+    Returns:
+        The joined pairs of the other digests, and the entries of both sides with a hot digest
+    """
+    groups1, positions1, groups2, positions2, distinct = _candidate_groups(entries1, entries2)
+    counts1 = np.bincount(groups1, minlength=len(distinct))
+    counts2 = np.bincount(groups2, minlength=len(distinct))
+    hot = counts1.astype(np.int64) * counts2 > max_fanout
+    hot1, hot2 = hot[groups1], hot[groups2]
+    hot_entries = HotEntries(distinct[groups1[hot1]], positions1[hot1], distinct[groups2[hot2]], positions2[hot2])
+    pairs = _product_pairs(
+        groups1[~hot1], positions1[~hot1], groups2[~hot2], positions2[~hot2], distinct, entries1.digests.dtype.itemsize
+    )
+    return pairs, hot_entries
+
+
+def _product_pairs(
+    groups1: np.ndarray,
+    positions1: np.ndarray,
+    groups2: np.ndarray,
+    positions2: np.ndarray,
+    distinct: np.ndarray,
+    digest_size: int,
+) -> JoinedPairs:
+    """Pair every candidate entry of the first side with every candidate entry of the second side in its group."""
+    if not len(groups1):
+        return _empty_pairs(digest_size)
+
+    first_groups, first_positions = _group_firsts(groups1, positions1)
+    order2 = np.lexsort((positions2, groups2))
+    groups2, positions2 = groups2[order2], positions2[order2]
+
+    starts = np.searchsorted(groups2, groups1, side="left")
+    counts = np.searchsorted(groups2, groups1, side="right") - starts
+    pair_groups = np.repeat(groups1, counts)
+    pair_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pairs = JoinedPairs(
+        np.repeat(positions1, counts),
+        positions2[np.repeat(starts, counts) + pair_offsets],
+        distinct[pair_groups],
+        first_positions[np.searchsorted(first_groups, pair_groups)],
+    )
+    return sort_pairs(pairs)
+
+
+def sort_pairs(pairs: JoinedPairs) -> JoinedPairs:
+    """Put joined pairs in output order."""
+    order = np.lexsort((pairs.positions2, pairs.positions1, pairs.first_positions))
+    return JoinedPairs(*(array[order] for array in pairs))
+
+
+def concatenate_pairs(parts: Sequence[JoinedPairs], digest_size: int) -> JoinedPairs:
+    """Concatenate joined pairs computed separately, e.g. per partition, and put them in output order."""
+    if not parts:
+        return _empty_pairs(digest_size)
+    return sort_pairs(JoinedPairs(*(np.concatenate(arrays) for arrays in zip(*parts))))
+
+
+def require_column(hashes1: HashedTable, hashes2: HashedTable, column_name: str) -> None:
+    """Raise a ValueError if either dataset lacks a hash column."""
+    for hashes in (hashes1, hashes2):
+        if hashes.column_index(column_name) is None:
+            raise ValueError(f"Hashed dataset has no {column_name} column")